@@ -1,11 +1,22 @@
 import asyncio
 import logging
 
-from quart import Quart
+from quart import Quart, jsonify
 from quart_schema import QuartSchema
 from common.grpc_client.grpc_client import grpc_stream
 from common.repository.cyoda.cyoda_init import init_cyoda
-from app_init.app_init import cyoda_token
+from app_init.app_init import cyoda_token, entity_service
+from common.exception.exceptions import LoadSheddingException, CircuitOpenException, DeadlineExceededException, \
+    EntityRejectedException
+from common.ai.ai_api import api_bp_ai
+from common.monitoring.loop_monitor import loop_monitor
+from common.monitoring.metrics_api import api_bp_metrics
+from common.monitoring.profiling_api import api_bp_profiling
+from common.monitoring.server_timing import register_server_timing
+from common.monitoring.tracing import register_request_tracing
+from common.repository.in_memory_db import persistence as in_memory_persistence
+from common.resilience.bulkhead import register_request_traffic_class, traffic_class, INIT
+from common.resilience.deadline import register_request_deadline
 #please update this line to your entity
 from entity.ENTITY_NAME_VAR.api import api_bp_ENTITY_NAME_VAR
 
@@ -14,17 +25,45 @@ logging.basicConfig(level=logging.INFO)
 app = Quart(__name__)
 QuartSchema(app)
 app.register_blueprint(api_bp_ENTITY_NAME_VAR, url_prefix='/api/ENTITY_NAME_VAR')
+app.register_blueprint(api_bp_ai, url_prefix='/api/ai')
+app.register_blueprint(api_bp_metrics)
+app.register_blueprint(api_bp_profiling, url_prefix='/admin/profiling')
+register_request_tracing(app)
+register_server_timing(app)
+register_request_deadline(app)
+register_request_traffic_class(app)
+
+@app.errorhandler(LoadSheddingException)
+@app.errorhandler(CircuitOpenException)
+@app.errorhandler(DeadlineExceededException)
+async def handle_unavailable(error):
+    headers = {"Retry-After": "1"} if error.status_code == 503 else {}
+    return jsonify({"error": error.message}), error.status_code, headers
+
+@app.errorhandler(EntityRejectedException)
+async def handle_rejected(error):
+    return jsonify({"error": error.message}), error.status_code
 
 @app.before_serving
 async def startup():
-    await init_cyoda(cyoda_token)
+    if loop_monitor:
+        loop_monitor.start()
+    with traffic_class(INIT):
+        await init_cyoda(cyoda_token)
+    entity_service.start_outbox(cyoda_token)
     app.background_task = asyncio.create_task(grpc_stream(cyoda_token))
 
 
 @app.after_serving
 async def shutdown():
+    await entity_service.flush_updates()
+    await entity_service.stop_outbox()
     app.background_task.cancel()
     await app.background_task
+    if loop_monitor:
+        await loop_monitor.stop()
+    if in_memory_persistence:
+        await in_memory_persistence.close()
 
 #put_application_code_here
 
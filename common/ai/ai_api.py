@@ -0,0 +1,52 @@
+import json
+import logging
+
+from quart import Blueprint, request, jsonify, Response
+
+from app_init.app_init import ai_service, cyoda_token
+from common.resilience import deadline
+
+logger = logging.getLogger(__name__)
+
+api_bp_ai = Blueprint('api/ai', __name__)
+
+
+def format_sse_event(data: str, event: str = None) -> str:
+    """Format a piece of data as a single server-sent event."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in str(data).split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+@api_bp_ai.route('/chat/stream', methods=['POST'])
+@deadline.exempt
+async def stream_ai_chat():
+    """API endpoint to stream an AI answer as server-sent events, or as a chunked text body."""
+    data = await request.json
+    if not data or not data.get('question'):
+        return jsonify({"error": "No question provided"}), 400
+
+    chunks = ai_service.ai_chat_stream(
+        token=cyoda_token, chat_id=data.get('chat_id'), ai_endpoint=data.get('ai_endpoint'),
+        ai_question=data.get('question')
+    )
+    as_sse = 'text/event-stream' in request.headers.get('Accept', 'text/event-stream')
+
+    async def generate():
+        try:
+            async for chunk in chunks:
+                yield format_sse_event(chunk) if as_sse else chunk
+            if as_sse:
+                yield format_sse_event("[DONE]", event="done")
+        except Exception as e:
+            logger.exception(e)
+            if as_sse:
+                yield format_sse_event(json.dumps({"error": str(e)}), event="error")
+        finally:
+            await chunks.aclose()
+
+    response = Response(generate(), mimetype='text/event-stream' if as_sse else 'text/plain')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.timeout = None
+    return response
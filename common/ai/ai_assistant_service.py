@@ -32,3 +32,17 @@ class IAiAssistantService(ABC):
         """
         pass
 
+    @abstractmethod
+    def ai_chat_stream(self, token: str, chat_id: str, ai_endpoint: str, ai_question: str):
+        """Send chat message to appropriate AI endpoint and stream the answer back
+
+        Args:
+            token: Authentication token
+            chat_id: Unique chat identifier
+            ai_endpoint: Target AI endpoint to route message to, same values as ai_chat
+            ai_question: Chat message/question to send
+
+        Yields:
+            str: Parts of the AI answer in the order they are produced
+        """
+        pass
@@ -2,9 +2,12 @@ import json
 import logging
 
 from common.ai.ai_assistant_service import IAiAssistantService
+from common.ai.ai_cache import ai_response_cache
+from common.ai.ai_scheduler import ai_scheduler
 from common.config.config import CYODA_AI_URL, CYODA_AI_API, WORKFLOW_AI_API, CONNECTION_AI_API, RANDOM_AI_API, MOCK_AI, \
-    TRINO_AI_API
-from common.util.utils import parse_json, validate_result, send_post_request, ValidationErrorException
+    TRINO_AI_API, AI_STREAM_CHUNK_SIZE
+from common.util.utils import parse_json, validate_result, send_post_request, ValidationErrorException, \
+    send_post_stream_request
 
 API_V_CONNECTIONS_ = "api/v1/connections"
 API_V_CYODA_ = "api/v1/cyoda"
@@ -23,9 +26,12 @@ class AiAssistantService(IAiAssistantService):
         if MOCK_AI=="true":
             return {"success": True}
         data = json.dumps({"chat_id": f"{chat_id}"})
-        endpoints = [API_V_CYODA_, API_V_WORKFLOWS_, API_V_RANDOM_]
-        for endpoint in endpoints:
-            await send_post_request(token, CYODA_AI_URL, "%s/initial" % endpoint, data)
+        endpoints = [(CYODA_AI_API, API_V_CYODA_), (WORKFLOW_AI_API, API_V_WORKFLOWS_), (RANDOM_AI_API, API_V_RANDOM_)]
+        # The chats are independent of each other, initialise them concurrently
+        await ai_scheduler.gather(*(
+            (ai_endpoint, chat_id, send_post_request, (token, CYODA_AI_URL, "%s/initial" % path, data), {})
+            for ai_endpoint, path in endpoints
+        ))
         return {"success": True}
 
     async def init_workflow_chat(self, token, chat_id):
@@ -59,42 +65,102 @@ class AiAssistantService(IAiAssistantService):
             return {"error": "Answer size exceeds 1MB limit"}
         if MOCK_AI=="true":
             return {"entity": "some random text"}
+        async with ai_scheduler.slot(ai_endpoint, chat_id):
+            if ai_endpoint == CYODA_AI_API:
+                resp = await self.chat_cyoda(token=token, chat_id=chat_id, ai_question=ai_question)
+                return resp
+            if ai_endpoint == WORKFLOW_AI_API:
+                resp = await self.chat_workflow(token=token, chat_id=chat_id, ai_question=ai_question)
+                return resp
+            if ai_endpoint == CONNECTION_AI_API:
+                resp = await self.chat_connection(token=token, chat_id=chat_id, ai_question=ai_question)
+                return resp
+            if ai_endpoint == RANDOM_AI_API:
+                resp = await self.chat_random(token=token, chat_id=chat_id, ai_question=ai_question)
+                return resp
+            if ai_endpoint == TRINO_AI_API:
+                resp = await self.chat_trino(token=token, chat_id=chat_id, ai_question=ai_question)
+                return resp
+
+    async def ai_chat_stream(self, token, chat_id, ai_endpoint, ai_question):
+        if ai_question and len(str(ai_question).encode('utf-8')) > 1 * 1024 * 1024:
+            yield json.dumps({"error": "Answer size exceeds 1MB limit"})
+            return
+        if MOCK_AI=="true":
+            yield json.dumps({"entity": "some random text"})
+            return
+        path, payload = self._chat_request(chat_id, ai_endpoint, ai_question)
+        payload["stream"] = True
+        stream = send_post_stream_request(token, CYODA_AI_URL, path, json.dumps(payload),
+                                          chunk_size=AI_STREAM_CHUNK_SIZE)
+        async with ai_scheduler.slot(ai_endpoint, chat_id):
+            try:
+                head = await anext(stream)
+                if head["status"] != 200:
+                    body = "".join([chunk async for chunk in stream])
+                    raise Exception(f"AI chat stream failed with status {head['status']}: {body}")
+                if 'application/json' in head["content_type"]:
+                    # The backend does not stream this endpoint, fall back to the buffered answer
+                    body = "".join([chunk async for chunk in stream])
+                    answer = json.loads(body).get('message') if body else None
+                    yield answer if isinstance(answer, str) else json.dumps(answer)
+                elif 'text/event-stream' in head["content_type"]:
+                    async for event_data in _iter_sse_data(stream):
+                        yield event_data
+                else:
+                    async for chunk in stream:
+                        yield chunk
+            finally:
+                await stream.aclose()
+
+    async def _send_chat(self, token, chat_id, ai_endpoint, ai_question):
+        path, payload = self._chat_request(chat_id, ai_endpoint, ai_question)
+        resp = await send_post_request(token, CYODA_AI_URL, path, json.dumps(payload))
+        return resp.get('json').get('message')
+
+    @staticmethod
+    def _chat_request(chat_id, ai_endpoint, ai_question):
+        # The path and payload of each AI endpoint's chat, shared by the buffered and the streaming calls
         if ai_endpoint == CYODA_AI_API:
-            resp = await self.chat_cyoda(token=token, chat_id=chat_id, ai_question=ai_question)
-            return resp
+            return "%s/chat" % API_V_CYODA_, {"chat_id": f"{chat_id}", "question": f"{ai_question}"}
         if ai_endpoint == WORKFLOW_AI_API:
-            resp = await self.chat_workflow(token=token, chat_id=chat_id, ai_question=ai_question)
-            return resp
+            return "%s/chat" % API_V_WORKFLOWS_, {
+                "question": f"{ai_question}",
+                "return_object": "workflow",
+                "chat_id": f"{chat_id}",
+                "class_name": "com.cyoda.tdb.model.treenode.TreeNodeEntity"
+            }
         if ai_endpoint == CONNECTION_AI_API:
-            resp = await self.chat_connection(token=token, chat_id=chat_id, ai_question=ai_question)
-            return resp
+            return "%s/chat" % API_V_CONNECTIONS_, {
+                "question": f"{ai_question}",
+                "return_object": "import-connections",
+                "chat_id": f"{chat_id}"
+            }
         if ai_endpoint == RANDOM_AI_API:
-            resp = await self.chat_random(token=token, chat_id=chat_id, ai_question=ai_question)
-            return resp
+            return "%s/chat" % API_V_RANDOM_, {
+                "question": f"{ai_question}",
+                "return_object": "random",
+                "chat_id": f"{chat_id}"
+            }
         if ai_endpoint == TRINO_AI_API:
-            resp = await self.chat_trino(token=token, chat_id=chat_id, ai_question=ai_question)
-            return resp
+            return "%s/chat" % API_V_TRINO_, {
+                "question": f"{ai_question}",
+                "return_object": "random",
+                "chat_id": f"{chat_id}"
+            }
+        raise ValueError(f"Unknown AI endpoint: {ai_endpoint}")
 
     async def chat_cyoda(self, token, chat_id, ai_question):
         if ai_question and len(str(ai_question).encode('utf-8')) > 1 * 1024 * 1024:
             return {"error": "Answer size exceeds 1MB limit"}
-        data = json.dumps({"chat_id": f"{chat_id}", "question": f"{ai_question}"})
-        resp = await send_post_request(token, CYODA_AI_URL, "%s/chat" % API_V_CYODA_, data)
-        return resp.get('json').get('message')
+        return await self._send_chat(token, chat_id, CYODA_AI_API, ai_question)
 
 
 
     async def chat_workflow(self, token, chat_id, ai_question):
         if ai_question and len(str(ai_question).encode('utf-8')) > 1 * 1024 * 1024:
             return {"error": "Answer size exceeds 1MB limit"}
-        data = json.dumps({
-            "question": f"{ai_question}",
-            "return_object": "workflow",
-            "chat_id": f"{chat_id}",
-            "class_name": "com.cyoda.tdb.model.treenode.TreeNodeEntity"
-        })
-        resp = await send_post_request(token, CYODA_AI_URL, "%s/chat" % API_V_WORKFLOWS_, data)
-        return resp.get('json').get('message')
+        return await self._send_chat(token, chat_id, WORKFLOW_AI_API, ai_question)
 
     async def export_workflow_to_cyoda_ai(self, token, chat_id, data):
         try:
@@ -104,8 +170,15 @@ class AiAssistantService(IAiAssistantService):
                 "class_name": data["class_name"],
                 "transitions": data["transitions"]
             })
-            resp = await send_post_request(token, CYODA_AI_URL, "%s/generate-workflow" % API_V_WORKFLOWS_, data)
-            return resp.get('json').get('message')
+            path = "%s/generate-workflow" % API_V_WORKFLOWS_
+
+            async def generate_workflow():
+                resp = await ai_scheduler.run(WORKFLOW_AI_API, chat_id, send_post_request,
+                                              token, CYODA_AI_URL, path, data)
+                return resp.get('json').get('message') if resp.get('status') == 200 else None
+
+            # The generated workflow only depends on the workflow definition, not on the chat
+            return await ai_response_cache.get_or_fetch(path, data, generate_workflow, ignore_keys=("chat_id",))
         except Exception as e:
             logger.error(f"Failed to export workflow: {e}")
 
@@ -143,31 +216,37 @@ class AiAssistantService(IAiAssistantService):
     async def chat_connection(self, token, chat_id, ai_question):
         if ai_question and len(str(ai_question).encode('utf-8')) > 1 * 1024 * 1024:
             return {"error": "Answer size exceeds 1MB limit"}
-        data = json.dumps({
-            "question": f"{ai_question}",
-            "return_object": "import-connections",
-            "chat_id": f"{chat_id}"
-        })
-        resp = await send_post_request(token, CYODA_AI_URL, "%s/chat" % API_V_CONNECTIONS_, data)
-        return resp.get('json').get('message')
+        return await self._send_chat(token, chat_id, CONNECTION_AI_API, ai_question)
 
 
     async def chat_random(self, token, chat_id, ai_question):
         if ai_question and len(str(ai_question).encode('utf-8')) > 1 * 1024 * 1024:
             return {"error": "Answer size exceeds 1MB limit"}
-        data = json.dumps({
-            "question": f"{ai_question}",
-            "return_object": "random",
-            "chat_id": f"{chat_id}"
-        })
-        resp = await send_post_request(token, CYODA_AI_URL, "%s/chat" % API_V_RANDOM_, data)
-        return resp.get('json').get('message')
+        return await self._send_chat(token, chat_id, RANDOM_AI_API, ai_question)
 
 
     async def chat_trino(self, token, chat_id, ai_question):
-        data = json.dumps({
-            "question": f"{ai_question}",
-            "return_object": "random",
-            "chat_id": f"{chat_id}"})
-        resp = await send_post_request(token, CYODA_AI_URL, "%s/chat" % API_V_TRINO_, data)
-        return resp.get('json').get('message')
\ No newline at end of file
+        return await self._send_chat(token, chat_id, TRINO_AI_API, ai_question)
+
+
+async def _iter_sse_data(chunks):
+    """Re-assemble text chunks into server-sent events and yield the data of each event."""
+    buffer = ""
+    data_lines = []
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line = line.rstrip("\r")
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip(" "))
+            elif not line and data_lines:
+                data = "\n".join(data_lines)
+                data_lines = []
+                if data == "[DONE]":
+                    return
+                yield data
+    if buffer.startswith("data:"):
+        data_lines.append(buffer[5:].lstrip(" "))
+    if data_lines and "\n".join(data_lines) != "[DONE]":
+        yield "\n".join(data_lines)
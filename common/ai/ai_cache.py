@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import aiofiles
+
+from common.config.config import AI_CACHE_ENABLED, AI_CACHE_DIR, AI_CACHE_MAX_BYTES, AI_CACHE_TTL
+from common.monitoring.profiling import register_component
+
+logger = logging.getLogger(__name__)
+
+
+def _canonicalize(payload: Any, ignore_keys: Iterable[str] = ()) -> str:
+    if isinstance(payload, (str, bytes)):
+        try:
+            payload = json.loads(payload)
+        except json.JSONDecodeError:
+            return payload.decode("utf-8") if isinstance(payload, bytes) else payload
+    if isinstance(payload, dict) and ignore_keys:
+        payload = {key: value for key, value in payload.items() if key not in ignore_keys}
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+class AiResponseCache:
+    """
+    Content-addressed on-disk cache for deterministic AI calls.
+
+    Entries are keyed by the sha256 of the endpoint and the canonicalised payload, expire after
+    `ttl` seconds and are evicted least recently used first once the store exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        # key -> entry size in bytes, ordered from least to most recently used
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def make_key(endpoint: str, payload: Any, ignore_keys: Iterable[str] = ()) -> str:
+        canonical = f"{endpoint.strip('/')}\n{_canonicalize(payload, ignore_keys)}"
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def get_or_fetch(self, endpoint: str, payload: Any, fetch: Callable[[], Awaitable[Any]],
+                           ignore_keys: Iterable[str] = (),
+                           cacheable: Callable[[Any], bool] = lambda value: value is not None) -> Any:
+        """Return the cached answer for this request or call `fetch` and store its result."""
+        if not self.enabled:
+            return await fetch()
+        key = self.make_key(endpoint, payload, ignore_keys)
+        cached = await self.get(key)
+        if cached is not None:
+            logger.info(f"AI cache hit for {endpoint}")
+            return cached
+        value = await fetch()
+        if cacheable(value):
+            await self.set(key, value)
+        return value
+
+    async def get(self, key: str) -> Optional[Any]:
+        await self._ensure_loaded()
+        if key not in self._index:
+            return None
+        try:
+            async with aiofiles.open(self._path(key), "r") as file:
+                entry = json.loads(await file.read())
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logger.warning(f"Dropping unreadable AI cache entry {key}: {e}")
+            await self._remove(key)
+            return None
+        if time.time() - entry.get("created", 0) > self.ttl:
+            await self._remove(key)
+            return None
+        async with self._lock:
+            # Evicted or removed by a concurrent call while the file was read, a miss like any other
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        # Persist the recency so the LRU order survives restarts
+        try:
+            await asyncio.to_thread(os.utime, self._path(key))
+        except FileNotFoundError:
+            pass
+        return entry.get("value")
+
+    async def set(self, key: str, value: Any) -> None:
+        await self._ensure_loaded()
+        content = json.dumps({"created": time.time(), "value": value}, ensure_ascii=False)
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.info(f"AI cache entry {key} of {size} bytes exceeds the cache size, not storing it")
+            return
+        tmp_path = f"{self._path(key)}.tmp"
+        async with aiofiles.open(tmp_path, "w") as file:
+            await file.write(content)
+        await asyncio.to_thread(os.replace, tmp_path, self._path(key))
+        async with self._lock:
+            self._total_bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+            evicted = []
+            while self._total_bytes > self.max_bytes and self._index:
+                old_key, old_size = self._index.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            await asyncio.to_thread(self._unlink, old_key)
+
+    async def _remove(self, key: str) -> None:
+        async with self._lock:
+            self._total_bytes -= self._index.pop(key, 0)
+        await asyncio.to_thread(self._unlink, key)
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            entries = await asyncio.to_thread(self._scan)
+            for key, size in entries:
+                self._index[key] = size
+                self._total_bytes += size
+            self._loaded = True
+            logger.info(f"Loaded {len(self._index)} AI cache entries ({self._total_bytes} bytes) from {self.cache_dir}")
+
+    def _scan(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.ttl:
+                os.remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        return [(key, size) for _, key, size in sorted(entries)]
+
+    def _unlink(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+
+ai_response_cache = AiResponseCache(cache_dir=AI_CACHE_DIR, max_bytes=AI_CACHE_MAX_BYTES, ttl=AI_CACHE_TTL,
+                                    enabled=AI_CACHE_ENABLED == "true")
+register_component("ai_response_cache_index", lambda: ai_response_cache._index)
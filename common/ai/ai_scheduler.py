@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from common.config.config import AI_MAX_CONCURRENCY, AI_RATE_LIMIT, AI_RATE_BURST, AI_ENDPOINT_LIMITS
+from common.monitoring import metrics
+from common.monitoring.profiling import register_component
+from common.resilience import deadline
+from common.util.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class _EndpointGate:
+    """Concurrency slots for one AI endpoint, handed out round-robin across chat ids."""
+
+    def __init__(self, max_concurrency: int, rate: float, burst: float):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.waiters = {}  # chat_id -> deque of futures
+        self.rotation = deque()  # chat ids with queued work, in serving order
+        self.queued = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def acquire(self, chat_id) -> None:
+        if self.in_flight < self.max_concurrency and not self.queued:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        if chat_id not in self.waiters:
+            self.waiters[chat_id] = deque()
+            self.rotation.append(chat_id)
+        self.waiters[chat_id].append(future)
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the cancellation, pass it on
+                self.release()
+            else:
+                self._discard(chat_id, future)
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        while self.rotation and self.in_flight < self.max_concurrency:
+            chat_id = self.rotation.popleft()
+            futures = self.waiters[chat_id]
+            future = futures.popleft()
+            self.queued -= 1
+            if futures:
+                self.rotation.append(chat_id)
+            else:
+                del self.waiters[chat_id]
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _discard(self, chat_id, future) -> None:
+        futures = self.waiters.get(chat_id)
+        if futures is None or future not in futures:
+            return
+        futures.remove(future)
+        self.queued -= 1
+        if not futures:
+            del self.waiters[chat_id]
+            self.rotation.remove(chat_id)
+
+    def record_wait(self, endpoint, seconds: float) -> None:
+        metrics.ai_queue_wait.observe(seconds, endpoint=endpoint)
+        self.wait_count += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+class AiRequestScheduler:
+    """
+    Schedules calls to the AI service: per-endpoint concurrency and token-bucket rate limits,
+    with excess work queued fairly per chat_id so a single busy chat cannot starve the others.
+    """
+
+    def __init__(self, max_concurrency: int, rate: float, burst: float, endpoint_limits: dict = None):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.endpoint_limits = endpoint_limits or {}
+        self._gates = {}
+
+    def _gate(self, endpoint) -> _EndpointGate:
+        gate = self._gates.get(endpoint)
+        if gate is None:
+            max_concurrency, rate = self.endpoint_limits.get(endpoint, (self.max_concurrency, self.rate))
+            gate = _EndpointGate(max_concurrency, rate, self.burst)
+            self._gates[endpoint] = gate
+        return gate
+
+    @asynccontextmanager
+    async def slot(self, endpoint, chat_id):
+        """Hold a concurrency slot of the endpoint for the duration of the block."""
+        gate = self._gate(endpoint)
+        queued_at = time.monotonic()
+        await deadline.wait_for(gate.acquire(chat_id), f"AI endpoint {endpoint}")
+        try:
+            await gate.bucket.acquire()
+            wait = time.monotonic() - queued_at
+            gate.record_wait(endpoint, wait)
+            if wait > 1:
+                logger.info(f"AI request for endpoint {endpoint}, chat {chat_id} waited {wait:.2f}s in queue")
+            yield
+        finally:
+            gate.release()
+
+    async def run(self, endpoint, chat_id, func, *args, **kwargs):
+        """Await func(*args, **kwargs) once the endpoint has capacity."""
+        async with self.slot(endpoint, chat_id):
+            return await func(*args, **kwargs)
+
+    async def gather(self, *calls):
+        """Fan out independent (endpoint, chat_id, func, args, kwargs) calls concurrently."""
+        return await asyncio.gather(*(self.run(endpoint, chat_id, func, *args, **kwargs)
+                                      for endpoint, chat_id, func, args, kwargs in calls))
+
+    def stats(self) -> dict:
+        return {
+            endpoint: {
+                "in_flight": gate.in_flight,
+                "queued": gate.queued,
+                "wait_count": gate.wait_count,
+                "wait_seconds_total": gate.wait_seconds_total,
+                "wait_seconds_max": gate.wait_seconds_max,
+            }
+            for endpoint, gate in self._gates.items()
+        }
+
+
+def _parse_endpoint_limits(value: str) -> dict:
+    # "trino=2:0.5,workflow=4" -> {"trino": (2, 0.5), "workflow": (4, AI_RATE_LIMIT)}
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        endpoint, _, limit = item.partition("=")
+        concurrency, _, rate = limit.partition(":")
+        limits[endpoint.strip()] = (int(concurrency), float(rate) if rate else AI_RATE_LIMIT)
+    return limits
+
+
+ai_scheduler = AiRequestScheduler(max_concurrency=AI_MAX_CONCURRENCY, rate=AI_RATE_LIMIT, burst=AI_RATE_BURST,
+                                  endpoint_limits=_parse_endpoint_limits(AI_ENDPOINT_LIMITS))
+metrics.queue_depth.add_function(
+    lambda: {(f"ai_{endpoint}",): stats["queued"] for endpoint, stats in ai_scheduler.stats().items()})
+register_component("ai_scheduler_queues", lambda: ai_scheduler._gates)
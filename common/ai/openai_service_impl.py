@@ -1,9 +1,11 @@
+import asyncio
 import json
 import logging
 
 from common.ai.ai_assistant_service import IAiAssistantService
 from common.config.config import CYODA_AI_URL, CYODA_AI_API, WORKFLOW_AI_API, CONNECTION_AI_API, RANDOM_AI_API, MOCK_AI, \
     TRINO_AI_API
+from common.resilience import deadline
 from common.util.utils import parse_json, validate_result, send_post_request, ValidationErrorException
 
 API_V_CONNECTIONS_ = "api/v1/connections"
@@ -60,4 +62,34 @@ class OpenAiAssistantService(IAiAssistantService):
         logger.info(resp)
         return resp
 
-
+    async def ai_chat_stream(self, token, chat_id, ai_endpoint, ai_question):
+        if ai_question and len(str(ai_question).encode('utf-8')) > 1 * 1024 * 1024:
+            yield json.dumps({"error": "Answer size exceeds 1MB limit"})
+            return
+        if MOCK_AI=="true":
+            yield json.dumps({"entity": "some random text"})
+            return
+        # Bound the whole completion by the caller's deadline, if it has one
+        timeout = {"timeout": deadline.timeout(float("inf"), "AI chat")} if deadline.remaining() is not None else {}
+        # The OpenAI client is synchronous, pull each delta in a worker thread to keep the event loop free
+        stream = await asyncio.to_thread(
+            client.chat.completions.create,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You are Cyoda app builder."},
+                {"role": "user", "content": ai_question}
+            ],
+            stream=True,
+            **timeout
+        )
+        chunks = iter(stream)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                deadline.check("AI chat stream")
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
@@ -30,3 +30,80 @@ CHAT_REPOSITORY = os.getenv("CHAT_REPOSITORY", "cyoda")
 PROJECT_DIR = os.getenv("PROJECT_DIR", "/tmp")
 REPOSITORY_URL = os.getenv("REPOSITORY_URL", "https://github.com/Cyoda-platform/quart-client-template")
 REPOSITORY_NAME = REPOSITORY_URL.split('/')[-1].replace('.git', '')
+AI_STREAM_CHUNK_SIZE = int(os.getenv("AI_STREAM_CHUNK_SIZE", "1024"))
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "false")
+AI_CACHE_DIR = os.getenv("AI_CACHE_DIR", f"{PROJECT_DIR}/ai_cache")
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_RATE_LIMIT = float(os.getenv("AI_RATE_LIMIT", "0"))
+AI_RATE_BURST = float(os.getenv("AI_RATE_BURST", "10"))
+AI_ENDPOINT_LIMITS = os.getenv("AI_ENDPOINT_LIMITS", "")
+TRINO_CACHE_TTL = float(os.getenv("TRINO_CACHE_TTL", "60"))
+TRINO_CACHE_MAX_ENTRIES = int(os.getenv("TRINO_CACHE_MAX_ENTRIES", "256"))
+TRINO_PAGE_SIZE = int(os.getenv("TRINO_PAGE_SIZE", "1000"))
+TRINO_CATALOG = os.getenv("TRINO_CATALOG", "cyoda")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false")
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false")
+TRACING_EXPORT_FILE = os.getenv("TRACING_EXPORT_FILE", f"{PROJECT_DIR}/traces.jsonl")
+TRACING_EXPORT_FORMAT = os.getenv("TRACING_EXPORT_FORMAT", "json")
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false")
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_MONITOR_THRESHOLD = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.25"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false")
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "500"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_BURST = float(os.getenv("LOG_RATE_BURST", "50"))
+CYODA_LIMITER_ENABLED = os.getenv("CYODA_LIMITER_ENABLED", "false")
+CYODA_LIMITER_INITIAL = int(os.getenv("CYODA_LIMITER_INITIAL", "20"))
+CYODA_LIMITER_MIN = int(os.getenv("CYODA_LIMITER_MIN", "2"))
+CYODA_LIMITER_MAX = int(os.getenv("CYODA_LIMITER_MAX", "200"))
+CYODA_LIMITER_MAX_QUEUE = int(os.getenv("CYODA_LIMITER_MAX_QUEUE", "500"))
+CYODA_LIMITER_MAX_WAIT = float(os.getenv("CYODA_LIMITER_MAX_WAIT", "10"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "5"))
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "false")
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "30"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "60"))
+PROCESSOR_DEADLINE = float(os.getenv("PROCESSOR_DEADLINE", "120"))
+BULKHEAD_ENABLED = os.getenv("BULKHEAD_ENABLED", "false")
+BULKHEAD_CLASS_LIMITS = os.getenv("BULKHEAD_CLASS_LIMITS", "api=64,init=16,processor=32")
+BULKHEAD_MODEL_LIMIT = int(os.getenv("BULKHEAD_MODEL_LIMIT", "16"))
+BULKHEAD_MODEL_LIMITS = os.getenv("BULKHEAD_MODEL_LIMITS", "")
+ENTITY_LOADER_ENABLED = os.getenv("ENTITY_LOADER_ENABLED", "false")
+ENTITY_LOADER_WINDOW_MS = float(os.getenv("ENTITY_LOADER_WINDOW_MS", "0"))
+ENTITY_LOADER_MAX_BATCH = int(os.getenv("ENTITY_LOADER_MAX_BATCH", "100"))
+ENTITY_LOADER_FETCH_CONCURRENCY = int(os.getenv("ENTITY_LOADER_FETCH_CONCURRENCY", "10"))
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false")
+WRITE_BEHIND_WINDOW_MS = float(os.getenv("WRITE_BEHIND_WINDOW_MS", "50"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "100"))
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "false")
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", f"{PROJECT_DIR}/outbox/outbox.log")
+OUTBOX_FSYNC = os.getenv("OUTBOX_FSYNC", "always")
+OUTBOX_FSYNC_INTERVAL = float(os.getenv("OUTBOX_FSYNC_INTERVAL", "1"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_RESOLVED = int(os.getenv("OUTBOX_MAX_RESOLVED", "100000"))
+IN_MEMORY_PERSISTENCE_ENABLED = os.getenv("IN_MEMORY_PERSISTENCE_ENABLED", "false")
+IN_MEMORY_PERSISTENCE_DIR = os.getenv("IN_MEMORY_PERSISTENCE_DIR", f"{PROJECT_DIR}/in_memory_db")
+IN_MEMORY_SNAPSHOT_INTERVAL = float(os.getenv("IN_MEMORY_SNAPSHOT_INTERVAL", "300"))
+IN_MEMORY_SNAPSHOT_WAL_RECORDS = int(os.getenv("IN_MEMORY_SNAPSHOT_WAL_RECORDS", "10000"))
+IN_MEMORY_WAL_FSYNC = os.getenv("IN_MEMORY_WAL_FSYNC", "false")
+IN_MEMORY_COLUMNAR_MODELS = os.getenv("IN_MEMORY_COLUMNAR_MODELS", "")
+QUERY_PLAN_CACHE_SIZE = int(os.getenv("QUERY_PLAN_CACHE_SIZE", "256"))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "1000"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "10000"))
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "5"))
+DELETE_CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", "100"))
+DELETE_CONCURRENCY = int(os.getenv("DELETE_CONCURRENCY", "10"))
+BULK_TRANSITION_CONCURRENCY = int(os.getenv("BULK_TRANSITION_CONCURRENCY", "10"))
+BULK_TRANSITION_RATE = float(os.getenv("BULK_TRANSITION_RATE", "50"))
+BULK_TRANSITION_BURST = float(os.getenv("BULK_TRANSITION_BURST", "10"))
+BULK_TRANSITION_REPORT_EVERY = int(os.getenv("BULK_TRANSITION_REPORT_EVERY", "100"))
+ENTITY_STREAM_CHUNK_SIZE = int(os.getenv("ENTITY_STREAM_CHUNK_SIZE", "65536"))
@@ -8,4 +8,29 @@ class UnauthorizedAccessException(Exception):
     def __init__(self, message="Unauthorized access"):
         self.message = message
         self.status_code = 401
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class LoadSheddingException(Exception):
+    def __init__(self, message="Service overloaded, try again later"):
+        self.message = message
+        self.status_code = 503
+        super().__init__(self.message)
+
+class CircuitOpenException(Exception):
+    def __init__(self, message="Downstream service unavailable"):
+        self.message = message
+        self.status_code = 503
+        super().__init__(self.message)
+
+class DeadlineExceededException(Exception):
+    def __init__(self, message="Deadline exceeded"):
+        self.message = message
+        self.status_code = 504
+        super().__init__(self.message)
+
+class EntityRejectedException(Exception):
+    """The repository refused the entity itself (a 4xx other than 408/429), retrying it cannot succeed."""
+    def __init__(self, message="Entity rejected", status_code=400):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(self.message)
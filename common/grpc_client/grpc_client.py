@@ -4,9 +4,14 @@ import grpc
 import uuid
 import json
 import asyncio
+import time
 from cloudevents_pb2 import CloudEvent
 from common.config import config
-from common.config.config import GRPC_PROCESSOR_TAG
+from common.config.config import GRPC_PROCESSOR_TAG, PROCESSOR_DEADLINE
+from common.monitoring import metrics, tracing
+from common.monitoring.profiling import register_component
+from common.resilience import deadline, bulkhead
+from common.util.logging_utils import hot_path_logger, truncated
 from cyoda_cloud_api_pb2_grpc import CloudEventsServiceStub
 from entity.workflow import process_dispatch, process_event
 
@@ -25,6 +30,12 @@ EVENT_ID_FORMAT = "{uuid}"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_calc_request_log = hot_path_logger(logger, "grpc.calc_request")
+
+# Outbound event queue of the current stream, exposed as a queue depth metric
+_event_queue = None
+metrics.queue_depth.add_function(lambda: {("grpc_outbound",): _event_queue.qsize() if _event_queue else 0})
+register_component("grpc_event_queue", lambda: _event_queue)
 
 
 def create_cloud_event(event_id: str, source: str, event_type: str, data: dict) -> CloudEvent:
@@ -89,11 +100,13 @@ async def event_generator(queue: asyncio.Queue):
     :yield: CloudEvent instances.
     """
     # Yield the initial join event
+    metrics.grpc_events.inc(direction="sent", type=JOIN_EVENT_TYPE)
     yield create_join_event()
     while True:
         event = await queue.get()
         if event is None:
             break
+        metrics.grpc_events.inc(direction="sent", type=event.type)
         yield event
         queue.task_done()
 
@@ -121,7 +134,7 @@ def handle_greet_event():
 
 
 async def handle_keep_alive_event(response, queue: asyncio.Queue):
-    logger.debug(f"handle_keep_alive_event: {response}")
+    logger.debug("handle_keep_alive_event: %s", response)
     data = json.loads(response.text_data)
     event = create_cloud_event(
         event_id=str(uuid.uuid4()),
@@ -145,15 +158,25 @@ async def process_calc_req_event(token, data: dict, queue: asyncio.Queue):
     :param queue: The asyncio queue for event processing.
     """
     processor_name = data.get('processorName')
-
-    try:
-        # Process the first or subsequent versions of the entity
-        if processor_name in process_dispatch:
-            logger.debug(f"Processing notification entity: {data}")
-            await process_event(token, data, processor_name)
-
-    except Exception as e:
-        logger.error(e)
+    start = time.perf_counter()
+    status = "ok"
+
+    with tracing.start_trace("process_calc_req_event", requestId=data.get('requestId'),
+                             entityId=data.get('entityId'), processorName=processor_name) as current, \
+            deadline.scope(PROCESSOR_DEADLINE), bulkhead.traffic_class(bulkhead.PROCESSOR):
+        try:
+            # Process the first or subsequent versions of the entity
+            if processor_name in process_dispatch:
+                logger.debug("Processing notification entity: %s", truncated(data))
+                await process_event(token, data, processor_name)
+
+        except Exception as e:
+            status = "error"
+            if current is not None:
+                tracing.record_exception(current, e)
+            metrics.processor_failures.inc(processor=processor_name)
+            logger.error(e)
+    metrics.processor_duration.observe(time.perf_counter() - start, processor=processor_name, status=status)
     #Create notification event and put it in the queue
     notification_event = create_notification_event(data)
     await queue.put(notification_event)
@@ -177,25 +200,30 @@ async def consume_stream(token):
     """
     Handle bidirectional streaming with response-driven event generation.
     """
+    global _event_queue
     credentials = get_grpc_credentials(token)
     queue = asyncio.Queue()
+    _event_queue = queue
 
     async with grpc.aio.secure_channel(config.GRPC_ADDRESS, credentials) as channel:
         stub = CloudEventsServiceStub(channel)
         call = stub.startStreaming(event_generator(queue))
 
         async for response in call:
-            logger.debug(f"Received response: {response}")
+            logger.debug("Received response: %s", response)
+            metrics.grpc_events.inc(direction="received", type=response.type)
 
             if response.type == GREET_EVENT_TYPE:
                 handle_greet_event()
             elif response.type == KEEP_ALIVE_EVENT_TYPE:
                 await handle_keep_alive_event(response, queue)
             elif response.type == CALC_REQ_EVENT_TYPE:
-                logger.info(f"Received calc request: {response}")
                 # Parse response entity
                 data = json.loads(response.text_data)
                 processor_name = data.get('processorName')
+                _calc_request_log.info("Received calc request: %s", truncated(response.text_data),
+                                       processor=processor_name, request_id=data.get('requestId'),
+                                       entity_id=data.get('entityId'))
 
                 if processor_name in process_dispatch:
                     await process_calc_req_event(token, data, queue)
@@ -0,0 +1,138 @@
+"""
+Event loop lag watchdog.
+
+A coroutine measures how late the loop wakes it up, and a watchdog thread notices when the loop stops
+responding for longer than the threshold and captures the stack of the code holding it, so blocking calls
+show up in the logs and in the metrics together with lag percentiles.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from common.config.config import LOOP_MONITOR_ENABLED, LOOP_MONITOR_INTERVAL, LOOP_MONITOR_THRESHOLD
+from common.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MAX_OFFENDERS = 20
+
+loop_lag = metrics.Histogram(
+    "event_loop_lag_seconds", "Delay between the scheduled and actual wake-up of the loop monitor",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+loop_blocked = metrics.Counter(
+    "event_loop_blocked_total", "Times the event loop was held beyond the threshold, by blocking call site",
+    ("site",))
+loop_blocked_seconds = metrics.Counter(
+    "event_loop_blocked_seconds_total", "Time the event loop was held beyond the threshold, by blocking call site",
+    ("site",))
+
+
+class LoopLagMonitor:
+
+    def __init__(self, interval: float, threshold: float, window: int = 1000):
+        self.interval = interval
+        self.threshold = threshold
+        self._lags = deque(maxlen=window)
+        self._offenders = {}  # site -> {"count", "total_seconds", "max_seconds", "stack"}
+        self._heartbeat = time.monotonic()
+        self._stalled_site = None
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop monitor started, interval {self.interval}s, threshold {self.threshold}s")
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _measure(self) -> None:
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            woke = time.monotonic()
+            lag = max(0.0, woke - scheduled - self.interval)
+            self._heartbeat = woke
+            self._lags.append(lag)
+            loop_lag.observe(lag)
+            site = self._stalled_site
+            if site is not None:
+                self._stalled_site = None
+                offender = self._offenders[site]
+                offender["total_seconds"] += lag
+                offender["max_seconds"] = max(offender["max_seconds"], lag)
+                loop_blocked_seconds.inc(lag, site=site)
+                logger.warning(f"Event loop was blocked for {lag:.3f}s by {site}")
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            if self._stalled_site is None and time.monotonic() - self._heartbeat > self.threshold + self.interval:
+                self._capture()
+
+    def _capture(self) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        site = _blocking_site(stack)
+        offender = self._offenders.get(site)
+        if offender is None:
+            if len(self._offenders) >= MAX_OFFENDERS:
+                site = "other"
+                offender = self._offenders.get(site)
+            if offender is None:
+                offender = self._offenders[site] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                                                    "stack": None}
+        offender["count"] += 1
+        offender["stack"] = "".join(traceback.format_list(stack[-15:]))
+        self._stalled_site = site
+        loop_blocked.inc(site=site)
+        logger.warning(f"Event loop blocked for more than {self.threshold}s at {site}:\n{offender['stack']}")
+
+    def percentiles(self) -> dict:
+        lags = sorted(self._lags)
+        if not lags:
+            return {}
+        return {quantile: lags[min(len(lags) - 1, int(quantile * len(lags)))] for quantile in (0.5, 0.9, 0.99, 1.0)}
+
+    def top_offenders(self, limit: int = 10) -> list:
+        ranked = sorted(self._offenders.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        return [{"site": site, **offender} for site, offender in ranked[:limit]]
+
+
+def _blocking_site(stack) -> str:
+    """Innermost frame from the application code, which is the call that holds the loop."""
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(PROJECT_ROOT) and "site-packages" not in filename and filename != __file__:
+            return f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+    frame = stack[-1]
+    return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+
+loop_monitor = LoopLagMonitor(interval=LOOP_MONITOR_INTERVAL, threshold=LOOP_MONITOR_THRESHOLD) \
+    if LOOP_MONITOR_ENABLED == "true" else None
+
+metrics.Gauge("event_loop_lag_percentile_seconds", "Event loop lag percentiles over the recent window",
+              ("quantile",),
+              function=lambda: {(str(quantile),): lag for quantile, lag in loop_monitor.percentiles().items()}
+              if loop_monitor else {})
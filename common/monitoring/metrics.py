@@ -0,0 +1,212 @@
+"""
+Minimal in-process metrics (counters, gauges, histograms) rendered in the Prometheus text format.
+
+Recording is a no-op unless METRICS_ENABLED is "true", so instrumented hot paths pay a single flag check.
+"""
+import functools
+import re
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Tuple
+
+from common.config.config import METRICS_ENABLED
+from common.util.class_decorators import wrap_public_coroutines
+
+enabled = METRICS_ENABLED == "true"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+_INF_BUCKET = 'le="+Inf"'
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for labelvalues, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not enabled:
+            return
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; `function` may compute {labelvalues tuple: value} at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 function: Callable[[], Dict[Tuple, float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._functions = [function] if function else []
+
+    def set(self, value: float, **labels) -> None:
+        if enabled:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if enabled:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def add_function(self, function: Callable[[], Dict[Tuple, float]]) -> None:
+        self._functions.append(function)
+
+    def render(self):
+        for function in self._functions:
+            for labelvalues, value in function().items():
+                self._values[tuple(labelvalues)] = value
+        yield from super().render()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        if not enabled:
+            return
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]  # bucket counts, count, sum
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += 1
+        state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block; a "status" label, when declared, is set to "error" on exceptions."""
+        if not enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            if "status" in self.labelnames and "status" not in labels:
+                labels["status"] = "error"
+            raise
+        finally:
+            if "status" in self.labelnames and "status" not in labels:
+                labels["status"] = "ok"
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labelvalues, (bucket_counts, count, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, _INF_BUCKET)} {count}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {total}"
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_ID_SEGMENT = re.compile(r"^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+)$")
+
+
+def path_template(url: str) -> str:
+    """Reduce a request url to a low-cardinality path template: no host, no query, ids replaced by {id}."""
+    path = re.sub(r"^[a-zA-Z]+://[^/]+", "", url).split("?", 1)[0]
+    return "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+# Metrics shared across the application
+http_request_duration = Histogram(
+    "cyoda_http_request_duration_seconds", "Outbound HTTP request latency by method, path template and status",
+    ("method", "path", "status"))
+repository_operation_duration = Histogram(
+    "repository_operation_duration_seconds", "CrudRepository operation latency",
+    ("repository", "operation", "status"))
+snapshot_search_phase_duration = Histogram(
+    "snapshot_search_phase_duration_seconds", "Cyoda snapshot search latency by phase (create, poll, fetch)",
+    ("phase",))
+grpc_events = Counter(
+    "grpc_events_total", "gRPC cloud events by direction and type", ("direction", "type"))
+processor_duration = Histogram(
+    "processor_duration_seconds", "Workflow processor process_event latency", ("processor", "status"))
+processor_failures = Counter(
+    "processor_failures_total", "Workflow processor failures", ("processor",))
+queue_depth = Gauge(
+    "queue_depth", "Number of items waiting in internal queues", ("queue",))
+ai_queue_wait = Histogram(
+    "ai_queue_wait_seconds", "Time AI requests wait for a scheduler slot", ("endpoint",))
+concurrency_limit = Gauge(
+    "concurrency_limit", "Current limit and in-flight calls of adaptive concurrency limiters", ("limiter", "value"))
+load_shed = Counter(
+    "load_shed_total", "Calls rejected by a concurrency limiter", ("limiter", "reason"))
+request_retries = Counter(
+    "request_retries_total", "Outbound HTTP requests retried", ("host", "reason"))
+circuit_state = Gauge(
+    "circuit_breaker_open", "1 while the circuit breaker of a host is open or half-open", ("host",))
+hedged_requests = Counter(
+    "hedged_requests_total", "Hedged GET requests by the attempt that answered first", ("path", "winner"))
+
+
+def instrument_repository(cls):
+    """Class decorator timing every public async operation of a repository."""
+    repository = cls.__name__
+    return wrap_public_coroutines(cls, lambda method, name: _timed_operation(method, repository, name))
+
+
+def _timed_operation(method, repository: str, operation: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if not enabled:
+            return await method(*args, **kwargs)
+        with repository_operation_duration.time(repository=repository, operation=operation):
+            return await method(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,13 @@
+from quart import Blueprint, Response
+
+from common.monitoring import metrics
+
+api_bp_metrics = Blueprint('metrics', __name__)
+
+
+@api_bp_metrics.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Expose the collected metrics in the Prometheus text format."""
+    if not metrics.enabled:
+        return Response("Metrics are disabled, set METRICS_ENABLED=true\n", status=404, mimetype='text/plain')
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
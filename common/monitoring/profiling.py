@@ -0,0 +1,161 @@
+"""
+On-demand CPU and memory profiling of a live process: cProfile captures, tracemalloc snapshots and diffs,
+and a size accounting of the application's main in-memory structures.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+MAX_WALKED_OBJECTS = 1_000_000
+MAX_WALK_SECONDS = 2.0
+# Bound to the event loop and shared with running requests, so never followed by the size walk
+_UNWALKED_TYPES = (asyncio.Future, asyncio.Lock, asyncio.Event, asyncio.Condition, asyncio.Semaphore,
+                   asyncio.AbstractEventLoop, asyncio.Handle)
+
+_components: Dict[str, Callable[[], Any]] = {}
+_cpu_profile_lock = asyncio.Lock()
+_baseline_snapshot = None
+
+
+def register_component(name: str, getter: Callable[[], Any]) -> None:
+    """Register an in-memory structure (cache, queue, ...) to be accounted for in memory reports."""
+    _components[name] = getter
+
+
+async def profile_cpu(seconds: float) -> pstats.Stats:
+    """Profile the event loop thread for the given number of seconds while it keeps serving requests."""
+    if _cpu_profile_lock.locked():
+        raise RuntimeError("A CPU profile is already running")
+    async with _cpu_profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        return pstats.Stats(profiler)
+
+
+def stats_to_text(stats: pstats.Stats, sort: str = "cumulative", limit: int = 50) -> str:
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def stats_to_bytes(stats: pstats.Stats) -> bytes:
+    """Serialise stats in the format written by pstats.Stats.dump_stats, loadable by snakeviz or pstats."""
+    return marshal.dumps(stats.stats)
+
+
+def start_memory_tracing(frames: int = 10) -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_memory_tracing() -> None:
+    global _baseline_snapshot
+    _baseline_snapshot = None
+    tracemalloc.stop()
+
+
+def take_memory_snapshot(limit: int = 30, group_by: str = "lineno") -> dict:
+    """Top allocation sites of a new snapshot, which also becomes the baseline for the next diff."""
+    global _baseline_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Memory tracing is not started")
+    snapshot = _filtered_snapshot()
+    _baseline_snapshot = snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "top": [{"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics(group_by)[:limit]],
+        "components": component_sizes(),
+    }
+
+
+def diff_memory_snapshot(limit: int = 30, group_by: str = "lineno") -> dict:
+    """Allocation growth since the baseline snapshot."""
+    global _baseline_snapshot
+    if _baseline_snapshot is None:
+        raise RuntimeError("No baseline snapshot, take a snapshot first")
+    snapshot = _filtered_snapshot()
+    diff = snapshot.compare_to(_baseline_snapshot, group_by)
+    _baseline_snapshot = snapshot
+    return {
+        "top": [{"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "size_bytes": stat.size,
+                 "count_diff": stat.count_diff} for stat in diff[:limit]],
+        "components": component_sizes(),
+    }
+
+
+def _filtered_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def component_sizes() -> dict:
+    """Sizes of the registered components; blocking, so call it off the event loop (asyncio.to_thread)."""
+    sizes = {}
+    for name, getter in _components.items():
+        try:
+            size, objects = deep_sizeof(getter())
+            sizes[name] = {"size_bytes": size, "objects": objects}
+        except Exception as e:
+            logger.warning(f"Failed to measure component {name}: {e}")
+            sizes[name] = {"error": str(e)}
+    return sizes
+
+
+def deep_sizeof(root: Any) -> tuple:
+    """
+    Approximate retained size of an object graph: (bytes, objects walked), bounded by MAX_WALKED_OBJECTS and
+    MAX_WALK_SECONDS. Loop-bound objects (futures, tasks, locks, ...) are counted but not followed.
+    """
+    seen = set()
+    stack = [root]
+    total = 0
+    deadline = time.monotonic() + MAX_WALK_SECONDS
+    while stack and len(seen) < MAX_WALKED_OBJECTS:
+        if len(seen) % 1000 == 0 and time.monotonic() > deadline:
+            break
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        try:
+            _push_referents(obj, stack)
+        except RuntimeError:
+            # Resized by the event loop while the walk copied it from another thread
+            pass
+    return total, len(seen)
+
+
+def _push_referents(obj: Any, stack: list) -> None:
+    if isinstance(obj, _UNWALKED_TYPES):
+        return
+    if isinstance(obj, dict):
+        stack.extend(list(obj.keys()))
+        stack.extend(list(obj.values()))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        stack.extend(list(obj))
+    elif isinstance(obj, (asyncio.Queue,)):
+        stack.extend(list(getattr(obj, "_queue", ())))
+    elif hasattr(obj, "__dict__"):
+        stack.append(vars(obj))
+    elif hasattr(obj, "__slots__"):
+        stack.extend(getattr(obj, slot) for slot in obj.__slots__ if hasattr(obj, slot))
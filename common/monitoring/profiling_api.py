@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import hmac
+from typing import Optional
+
+from quart import Blueprint, request, jsonify, Response
+
+from common.config.config import ADMIN_TOKEN
+from common.monitoring import profiling
+from common.monitoring.loop_monitor import loop_monitor
+
+api_bp_profiling = Blueprint('admin/profiling', __name__)
+
+MAX_CPU_PROFILE_SECONDS = 300
+GROUP_BY_OPTIONS = ('filename', 'lineno', 'traceback')
+
+
+def admin_only(route):
+    """Only allow requests carrying the ADMIN_TOKEN; the routes are disabled when it is not configured."""
+
+    @functools.wraps(route)
+    async def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Profiling is disabled, set ADMIN_TOKEN"}), 404
+        provided = request.headers.get('X-Admin-Token') or \
+            request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(provided.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({"error": "Unauthorized access"}), 401
+        return await route(*args, **kwargs)
+
+    return wrapper
+
+
+def _positive_int_arg(name: str, default: int) -> Optional[int]:
+    """The query argument as a positive int, None when it is not one."""
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+def _invalid_argument(name: str):
+    return jsonify({"error": f"{name} must be a positive integer"}), 400
+
+
+def _memory_report_args():
+    """limit and group_by of the memory reports, or the 400 response for an invalid one."""
+    limit = _positive_int_arg('limit', 30)
+    if limit is None:
+        return None, None, _invalid_argument('limit')
+    group_by = request.args.get('group_by', 'lineno')
+    if group_by not in GROUP_BY_OPTIONS:
+        return None, None, (jsonify({"error": f"group_by must be one of {', '.join(GROUP_BY_OPTIONS)}"}), 400)
+    return limit, group_by, None
+
+
+@api_bp_profiling.route('/cpu', methods=['POST'])
+@admin_only
+async def profile_cpu():
+    """Profile the event loop for ?seconds=N, returned as a pstats file or, with ?format=text, as a report."""
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not 0 < seconds <= MAX_CPU_PROFILE_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {MAX_CPU_PROFILE_SECONDS}"}), 400
+    try:
+        stats = await profiling.profile_cpu(seconds)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    if request.args.get('format') == 'text':
+        limit = _positive_int_arg('limit', 50)
+        if limit is None:
+            return _invalid_argument('limit')
+        text = profiling.stats_to_text(stats, sort=request.args.get('sort', 'cumulative'), limit=limit)
+        return Response(text, mimetype='text/plain')
+    response = Response(profiling.stats_to_bytes(stats), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = 'attachment; filename="cpu.pstats"'
+    return response
+
+
+@api_bp_profiling.route('/memory/start', methods=['POST'])
+@admin_only
+async def start_memory_tracing():
+    frames = _positive_int_arg('frames', 10)
+    if frames is None:
+        return _invalid_argument('frames')
+    profiling.start_memory_tracing(frames)
+    return jsonify({"tracing": True})
+
+
+@api_bp_profiling.route('/memory/stop', methods=['POST'])
+@admin_only
+async def stop_memory_tracing():
+    profiling.stop_memory_tracing()
+    return jsonify({"tracing": False})
+
+
+@api_bp_profiling.route('/memory/snapshot', methods=['GET'])
+@admin_only
+async def memory_snapshot():
+    limit, group_by, invalid = _memory_report_args()
+    if invalid is not None:
+        return invalid
+    try:
+        return jsonify(await asyncio.to_thread(profiling.take_memory_snapshot, limit=limit, group_by=group_by))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+
+
+@api_bp_profiling.route('/memory/diff', methods=['GET'])
+@admin_only
+async def memory_diff():
+    limit, group_by, invalid = _memory_report_args()
+    if invalid is not None:
+        return invalid
+    try:
+        return jsonify(await asyncio.to_thread(profiling.diff_memory_snapshot, limit=limit, group_by=group_by))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+
+
+@api_bp_profiling.route('/memory/components', methods=['GET'])
+@admin_only
+async def memory_components():
+    return jsonify(await asyncio.to_thread(profiling.component_sizes))
+
+
+@api_bp_profiling.route('/loop', methods=['GET'])
+@admin_only
+async def loop_lag():
+    """Event loop lag percentiles and the call sites that blocked the loop longest, as seen by the loop monitor."""
+    if loop_monitor is None:
+        return jsonify({"error": "The event loop monitor is disabled, set LOOP_MONITOR_ENABLED"}), 404
+    limit = _positive_int_arg('limit', 10)
+    if limit is None:
+        return _invalid_argument('limit')
+    return jsonify({"lag_percentiles": {str(quantile): lag for quantile, lag in loop_monitor.percentiles().items()},
+                    "top_offenders": loop_monitor.top_offenders(limit)})
@@ -0,0 +1,114 @@
+"""
+Per-request latency breakdown emitted as a Server-Timing header and a structured access log line.
+
+Time is accumulated per category (entity service, Cyoda REST, AI, JSON, validation) in a context variable
+that only exists while a Quart request is being handled, so code running outside a request pays nothing.
+"""
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from common.config.config import SERVER_TIMING_ENABLED
+from common.util.class_decorators import wrap_public_coroutines
+
+access_logger = logging.getLogger("access")
+
+enabled = SERVER_TIMING_ENABLED == "true"
+
+CATEGORY_DESCRIPTIONS = {
+    "entity": "Entity service",
+    "cyoda": "Cyoda REST",
+    "ai": "AI service",
+    "json": "JSON (de)serialisation",
+    "validation": "Validation",
+}
+
+_timings: ContextVar[Optional[dict]] = ContextVar("server_timings", default=None)
+# Categories being timed by an enclosing block, whose time already includes the nested blocks
+_active: ContextVar[frozenset] = ContextVar("server_timing_active", default=frozenset())
+
+
+@contextmanager
+def timed(category: str):
+    """
+    Add the duration of the block to the category of the current request, if any. Only the outermost block of a
+    category counts, e.g. an entity service method calling another one is timed once.
+    """
+    timings = _timings.get()
+    active = _active.get()
+    if timings is None or category in active:
+        yield
+        return
+    token = _active.set(active | {category})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(category, time.perf_counter() - start, timings)
+        _active.reset(token)
+
+
+def add_timing(category: str, seconds: float, timings: dict = None) -> None:
+    timings = timings if timings is not None else _timings.get()
+    if timings is None:
+        return
+    total = timings.get(category)
+    timings[category] = (total[0] + seconds, total[1] + 1) if total else (seconds, 1)
+
+
+def timed_methods(category: str):
+    """Class decorator accumulating the time of every public async method in the given category."""
+
+    def decorate(cls):
+        return wrap_public_coroutines(cls, lambda method, name: _timed_method(method, category))
+
+    return decorate
+
+
+def _timed_method(method, category: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        with timed(category):
+            return await method(*args, **kwargs)
+
+    return wrapper
+
+
+def format_server_timing(timings: dict, total_seconds: float) -> str:
+    metrics = [f'{category};dur={seconds * 1000:.1f};desc="{CATEGORY_DESCRIPTIONS.get(category, category)} x{count}"'
+               for category, (seconds, count) in timings.items()]
+    metrics.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+def register_server_timing(app) -> None:
+    """Emit the Server-Timing header and an access log line for every Quart request."""
+    if not enabled:
+        return
+    from quart import g, request
+
+    @app.before_request
+    async def _start_server_timing():
+        g.server_timing_start = time.perf_counter()
+        _timings.set({})
+
+    @app.after_request
+    async def _emit_server_timing(response):
+        timings = _timings.get()
+        start = g.get("server_timing_start")
+        if timings is None or start is None:
+            return response
+        total = time.perf_counter() - start
+        response.headers["Server-Timing"] = format_server_timing(timings, total)
+        access_logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 1),
+            "timings_ms": {category: round(seconds * 1000, 1) for category, (seconds, _) in timings.items()},
+        }))
+        return response
@@ -0,0 +1,232 @@
+"""
+Lightweight contextvars-based tracing.
+
+A trace starts at a Quart request or a gRPC calc request, nested spans are opened around entity service,
+repository and REST calls, and finished traces are appended to a local file as JSON lines, either one
+span per line ("json") or one OTLP/JSON ExportTraceServiceRequest per trace ("otlp"), so it works offline.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from common.config.config import TRACING_ENABLED, TRACING_EXPORT_FILE, TRACING_EXPORT_FORMAT
+from common.util.class_decorators import wrap_public_coroutines
+
+logger = logging.getLogger(__name__)
+
+enabled = TRACING_ENABLED == "true"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "status",
+                 "error", "is_root", "_trace_spans")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, trace_id: str = None, parent_id: str = None,
+                 attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else (trace_id or os.urandom(16).hex())
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else parent_id
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = "OK"
+        self.error = None
+        self.is_root = parent is None
+        # Spans of the trace are collected on the root and exported together when it ends
+        self._trace_spans = parent._trace_spans if parent else []
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a child span of the current span, or a new trace when there is none."""
+    if not enabled:
+        yield None
+        return
+    yield from _run_span(Span(name, parent=_current_span.get(), attributes=attributes))
+
+
+@contextmanager
+def start_trace(name: str, traceparent: str = None, **attributes):
+    """Open a root span, continuing the W3C traceparent of the caller when given."""
+    if not enabled:
+        yield None
+        return
+    trace_id, parent_id = _parse_traceparent(traceparent)
+    yield from _run_span(Span(name, trace_id=trace_id, parent_id=parent_id, attributes=attributes))
+
+
+def _run_span(new_span: Span):
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        record_exception(new_span, e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(new_span)
+
+
+def record_exception(failed: Span, error: BaseException) -> None:
+    failed.status = "ERROR"
+    failed.error = f"{type(error).__name__}: {error}"
+
+
+def _finish(finished: Span) -> None:
+    finished.end_ns = time.time_ns()
+    finished._trace_spans.append(finished)
+    if finished.is_root:
+        spans = list(finished._trace_spans)
+        finished._trace_spans.clear()
+        _export(spans)
+
+
+def _parse_traceparent(traceparent: Optional[str]):
+    # version-traceid-parentid-flags
+    parts = (traceparent or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+
+def traceparent_header() -> Optional[str]:
+    current = _current_span.get()
+    return f"00-{current.trace_id}-{current.span_id}-01" if current else None
+
+
+def _export(spans) -> None:
+    if TRACING_EXPORT_FORMAT == "otlp":
+        lines = [json.dumps(_to_otlp(spans), default=str)]
+    else:
+        lines = [json.dumps(finished.to_dict(), default=str) for finished in spans]
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _write_lines, lines)
+    except RuntimeError:
+        _write_lines(lines)
+
+
+def _write_lines(lines) -> None:
+    try:
+        with _file_lock, open(TRACING_EXPORT_FILE, "a") as file:
+            file.write("\n".join(lines) + "\n")
+    except OSError as e:
+        logger.error(f"Failed to export spans to {TRACING_EXPORT_FILE}: {e}")
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(spans) -> dict:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "quart-client-template"}}]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [{
+                "traceId": finished.trace_id,
+                "spanId": finished.span_id,
+                "parentSpanId": finished.parent_id or "",
+                "name": finished.name,
+                "kind": 1,
+                "startTimeUnixNano": str(finished.start_ns),
+                "endTimeUnixNano": str(finished.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in finished.attributes.items()],
+                "status": {"code": 2, "message": finished.error} if finished.status == "ERROR" else {"code": 1},
+            } for finished in spans],
+        }],
+    }]}
+
+
+def trace_methods(prefix: str):
+    """Class decorator opening a span around every public async method of the class."""
+
+    def decorate(cls):
+        return wrap_public_coroutines(cls, lambda method, name: _traced(method, f"{prefix}.{name}"))
+
+    return decorate
+
+
+def _traced(method, span_name: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if not enabled:
+            return await method(*args, **kwargs)
+        # Entity service methods take the model as keyword arguments, repositories inside the meta dict
+        source = args[1] if len(args) > 1 and isinstance(args[1], dict) else kwargs
+        attributes = {key: source[key] for key in ("entity_model", "entity_version", "technical_id") if key in source}
+        with span(span_name, **attributes):
+            return await method(*args, **kwargs)
+
+    return wrapper
+
+
+def register_request_tracing(app) -> None:
+    """Start a trace for every Quart request."""
+    if not enabled:
+        return
+    from quart import g, request
+
+    @app.before_request
+    async def _start_request_trace():
+        trace_id, parent_id = _parse_traceparent(request.headers.get("traceparent"))
+        rule = request.url_rule.rule if request.url_rule else request.path
+        root = Span(f"{request.method} {rule}", trace_id=trace_id, parent_id=parent_id,
+                    attributes={"method": request.method, "path": request.path})
+        # The handler runs in the same task, so it sees this span as its parent
+        _current_span.set(root)
+        g.trace_root = root
+
+    @app.after_request
+    async def _tag_request_trace(response):
+        root = g.get("trace_root")
+        if root is not None:
+            root.set_attribute("status_code", response.status_code)
+            response.headers["traceparent"] = f"00-{root.trace_id}-{root.span_id}-01"
+        return response
+
+    @app.teardown_request
+    async def _end_request_trace(exc):
+        root = g.pop("trace_root", None)
+        if root is not None:
+            if exc is not None:
+                record_exception(root, exc)
+            _current_span.set(None)
+            _finish(root)
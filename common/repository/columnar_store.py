@@ -0,0 +1,485 @@
+"""
+Columnar storage for one entity model of the in-memory repository. Top-level scalar fields live in NumPy
+arrays, strings are dictionary-encoded into integer codes and nested or mixed-type fields are kept as Python
+objects. Filters and aggregations over scalar and string columns are evaluated on whole columns; entities are
+materialised back into dicts only when they are returned.
+"""
+import copy
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from common.service.aggregation import PREDICATES, aggregate_in_memory, get_field, validate_aggregations
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Per-row state of a column
+MISSING, NULL, VALUE = 0, 1, 2
+_INITIAL_CAPACITY = 1024
+_COMPARISONS = {"GREATER_THAN": "__gt__", "GREATER_OR_EQUAL": "__ge__", "LESS_THAN": "__lt__",
+                "LESS_OR_EQUAL": "__le__"}
+
+
+class _Unsupported(Exception):
+    """The filter or aggregation cannot be evaluated on columns, it is evaluated row by row instead."""
+
+
+def _kind_of(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -2 ** 63 <= value < 2 ** 63 else "object"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    return "object"
+
+
+class _Column:
+    kind = "object"
+    integral = None
+
+    def __init__(self, capacity: int):
+        self.values = [None] * capacity
+        self.state = np.zeros(capacity, dtype=np.int8)
+
+    def grow(self, capacity: int) -> None:
+        self.values.extend([None] * (capacity - len(self.values)))
+        self.state = np.concatenate([self.state, np.zeros(capacity - len(self.state), dtype=np.int8)])
+
+    def accepts(self, value: Any) -> bool:
+        return True
+
+    def set(self, row: int, value: Any) -> None:
+        self.state[row] = NULL if value is None else VALUE
+        self.values[row] = value
+
+    def clear(self, row: int) -> None:
+        self.state[row] = MISSING
+        self.values[row] = None
+
+    def get(self, row: int) -> Any:
+        return self.values[row]
+
+    def snapshot(self) -> "_Column":
+        """Point-in-time copy of the column's arrays and lists, the values themselves are shared."""
+        clone = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, (list, dict, np.ndarray)):
+                setattr(clone, name, value.copy())
+        return clone
+
+
+class _ScalarColumn(_Column):
+    DTYPES = {"bool": "bool", "int": "int64", "float": "float64"}
+
+    def __init__(self, capacity: int, kind: str):
+        self.kind = kind
+        self.values = np.zeros(capacity, dtype=self.DTYPES[kind])
+        self.state = np.zeros(capacity, dtype=np.int8)
+        # Float columns also take exact ints, flagged so they come back as ints
+        self.integral = np.zeros(capacity, dtype=bool) if kind == "float" else None
+
+    def grow(self, capacity: int) -> None:
+        self.values = np.concatenate([self.values, np.zeros(capacity - len(self.values), dtype=self.values.dtype)])
+        self.state = np.concatenate([self.state, np.zeros(capacity - len(self.state), dtype=np.int8)])
+        if self.integral is not None:
+            self.integral = np.concatenate([self.integral, np.zeros(capacity - len(self.integral), dtype=bool)])
+
+    def accepts(self, value: Any) -> bool:
+        return value is None or _kind_of(value) == self.kind or \
+            (self.kind == "float" and _kind_of(value) == "int" and abs(value) <= 2 ** 53)
+
+    def set(self, row: int, value: Any) -> None:
+        self.state[row] = NULL if value is None else VALUE
+        if value is not None:
+            self.values[row] = value
+            if self.integral is not None:
+                self.integral[row] = _kind_of(value) == "int"
+
+    def clear(self, row: int) -> None:
+        self.state[row] = MISSING
+
+    def get(self, row: int) -> Any:
+        value = self.values[row].item()
+        return int(value) if self.integral is not None and self.integral[row] else value
+
+
+class _StringColumn(_Column):
+    kind = "str"
+
+    def __init__(self, capacity: int):
+        self.values = np.zeros(capacity, dtype=np.int32)  # codes into dictionary
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.dictionary = []
+        self.codes = {}
+
+    grow = _ScalarColumn.grow
+
+    def accepts(self, value: Any) -> bool:
+        return value is None or isinstance(value, str)
+
+    def set(self, row: int, value: Any) -> None:
+        self.state[row] = NULL if value is None else VALUE
+        if value is not None:
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.dictionary)
+                self.dictionary.append(value)
+            self.values[row] = code
+
+    def clear(self, row: int) -> None:
+        self.state[row] = MISSING
+
+    def get(self, row: int) -> Any:
+        return self.dictionary[self.values[row]]
+
+
+class ColumnarStore:
+    """Entities of one model stored column by column, addressed by technical id."""
+
+    def __init__(self, entity_model: str):
+        self.entity_model = entity_model
+        self.capacity = _INITIAL_CAPACITY
+        self.columns: Dict[str, _Column] = {}
+        self.live = np.zeros(self.capacity, dtype=bool)
+        self.ids: List[Any] = [None] * self.capacity
+        self.rows: Dict[Any, int] = {}  # technical id -> row
+        self._free: List[int] = []
+        self._size = 0
+        self._opaque: Dict[Any, Any] = {}  # non-dict entities, stored as they are
+
+    def __len__(self) -> int:
+        return len(self.rows) + len(self._opaque)
+
+    def __contains__(self, technical_id: Any) -> bool:
+        return technical_id in self.rows or technical_id in self._opaque
+
+    def technical_ids(self) -> List[Any]:
+        return list(self.rows) + list(self._opaque)
+
+    def _new_column(self, value: Any) -> _Column:
+        kind = _kind_of(value)
+        if kind in _ScalarColumn.DTYPES:
+            return _ScalarColumn(self.capacity, kind)
+        if kind == "str":
+            return _StringColumn(self.capacity)
+        return _Column(self.capacity)
+
+    def _retype(self, name: str, value: Any) -> _Column:
+        """
+        Replace a typed column that got a value of another type: an int column becomes a float column when a
+        float arrives, anything else becomes an object column.
+        """
+        column = self.columns[name]
+        if column.kind == "int" and _kind_of(value) == "float" and \
+                not np.any(np.abs(column.values[column.state == VALUE]) > 2 ** 53):
+            retyped = _ScalarColumn(self.capacity, "float")
+            retyped.values[:] = column.values
+            retyped.state[:] = column.state
+            retyped.integral[:] = column.state == VALUE
+        else:
+            retyped = _Column(self.capacity)
+            for row in np.flatnonzero(column.state[:self._size]).tolist():
+                retyped.set(row, None if column.state[row] == NULL else column.get(row))
+            logger.debug(f"Column '{name}' of {self.entity_model} now holds mixed types, stored as objects")
+        self.columns[name] = retyped
+        return retyped
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._size == self.capacity:
+            self.capacity *= 2
+            self.live = np.concatenate([self.live, np.zeros(self.capacity - len(self.live), dtype=bool)])
+            self.ids.extend([None] * (self.capacity - len(self.ids)))
+            for column in self.columns.values():
+                column.grow(self.capacity)
+        self._size += 1
+        return self._size - 1
+
+    def put(self, technical_id: Any, entity: Any) -> None:
+        """Insert or fully replace the entity."""
+        if not isinstance(entity, dict):
+            self.delete(technical_id)
+            self._opaque[technical_id] = entity
+            return
+        self._opaque.pop(technical_id, None)
+        row = self.rows.get(technical_id)
+        if row is None:
+            row = self.rows[technical_id] = self._allocate()
+            self.ids[row] = technical_id
+            self.live[row] = True
+        else:
+            for name, column in self.columns.items():
+                if name not in entity:
+                    column.clear(row)
+        for name, value in entity.items():
+            if name == "technical_id":
+                continue
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = self._new_column(value)
+            elif not column.accepts(value):
+                column = self._retype(name, value)
+            column.set(row, value)
+
+    def delete(self, technical_id: Any) -> bool:
+        if technical_id in self._opaque:
+            del self._opaque[technical_id]
+            return True
+        row = self.rows.pop(technical_id, None)
+        if row is None:
+            return False
+        for column in self.columns.values():
+            column.clear(row)
+        self.live[row] = False
+        self.ids[row] = None
+        self._free.append(row)
+        return True
+
+    def _materialise(self, row: int) -> dict:
+        return {name: None if column.state[row] == NULL else column.get(row)
+                for name, column in self.columns.items() if column.state[row] != MISSING}
+
+    def get(self, technical_id: Any) -> Optional[Any]:
+        row = self.rows.get(technical_id)
+        if row is None:
+            return self._opaque.get(technical_id)
+        return self._materialise(row)
+
+    def entities(self, mask=None) -> List[Any]:
+        """Materialise the entities of the selected rows (all by default) with their technical_id."""
+        rows = np.flatnonzero(self.live[:self._size] if mask is None else mask)
+        entities = []
+        for row in rows.tolist():
+            entity = self._materialise(row)
+            entity["technical_id"] = self.ids[row]
+            entities.append(entity)
+        if mask is None:
+            entities.extend(self._opaque.values())
+        return entities
+
+    def iter_entities(self) -> Iterator[Any]:
+        """Materialise the entities one at a time, skipping those deleted since the iteration started."""
+        for technical_id, row in list(self.rows.items()):
+            if self.rows.get(technical_id) != row:
+                continue
+            entity = self._materialise(row)
+            entity["technical_id"] = technical_id
+            yield entity
+        yield from list(self._opaque.values())
+
+    def snapshot(self) -> "ColumnarStore":
+        """
+        Point-in-time copy that later puts and deletes do not change, cheap enough to take on the event loop;
+        entities are only materialised when it is read.
+        """
+        clone = copy.copy(self)
+        clone.columns = {name: column.snapshot() for name, column in self.columns.items()}
+        clone.live = self.live.copy()
+        clone.ids = list(self.ids)
+        clone.rows = dict(self.rows)
+        clone._free = list(self._free)
+        clone._opaque = dict(self._opaque)
+        return clone
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        return [(technical_id, self._materialise(row)) for technical_id, row in self.rows.items()] + \
+            list(self._opaque.items())
+
+    # Filters, as in common.service.aggregation: [{"field": ..., "operator": ..., "value": ...}] combined with AND
+
+    def _row_mask(self, field: str, operator: str, expected: Any):
+        """Row-by-row evaluation for nested paths and object columns."""
+        name, _, rest = field.partition(".")
+        column = self.columns.get(name)
+        check = PREDICATES[operator]
+        mask = np.zeros(self._size, dtype=bool)
+        if column is None:
+            return self.live[:self._size] & check(None, expected)
+        for row in np.flatnonzero(self.live[:self._size]).tolist():
+            value = None if column.state[row] != VALUE else column.get(row)
+            if rest:
+                value = get_field(value, rest) if isinstance(value, dict) else None
+            mask[row] = check(value, expected)
+        return mask
+
+    def _column_mask(self, field: str, operator: str, expected: Any):
+        column = self.columns.get(field)
+        size = self._size
+        if "." in field or (column is not None and column.kind == "object"):
+            return self._row_mask(field, operator, expected)
+        if column is None:
+            # A field no entity has is None everywhere
+            return np.full(size, PREDICATES[operator](None, expected), dtype=bool)
+        state = column.state[:size]
+        present = state == VALUE
+        if operator == "IS_NULL":
+            return ~present
+        if operator == "NOT_NULL":
+            return present
+        values = column.values[:size]
+        if operator in ("EQUALS", "NOT_EQUAL"):
+            if expected is None:
+                # As the predicates: only missing and None values equal None, every other value differs from it
+                return ~present if operator == "EQUALS" else present
+            equal = present & self._equals(column, values, expected)
+            return equal if operator == "EQUALS" else present & ~equal
+        if operator == "IN":
+            expected = list(expected)
+            mask = np.zeros(size, dtype=bool)
+            for value in expected:
+                if value is None:
+                    mask |= ~present
+                else:
+                    mask |= present & self._equals(column, values, value)
+            return mask
+        if operator in _COMPARISONS:
+            if expected is None:
+                raise _Unsupported()
+            if column.kind == "str":
+                if not isinstance(expected, str):
+                    raise _Unsupported()
+                # Compare each distinct string once, then look the result up by code
+                matches = np.array([getattr(text, _COMPARISONS[operator])(expected) for text in column.dictionary]
+                                   + [False], dtype=bool)
+                return present & matches[np.where(present, values, len(column.dictionary))]
+            if _kind_of(expected) not in ("int", "float", "bool"):
+                raise _Unsupported()
+            return present & getattr(values, _COMPARISONS[operator])(expected)
+        raise _Unsupported()
+
+    @staticmethod
+    def _equals(column: _Column, values, expected: Any):
+        if column.kind == "str":
+            code = column.codes.get(expected) if isinstance(expected, str) else None
+            return values == code if code is not None else np.zeros(len(values), dtype=bool)
+        if _kind_of(expected) not in ("int", "float", "bool"):
+            return np.zeros(len(values), dtype=bool)
+        return values == expected
+
+    def mask(self, filters: Optional[List[dict]]):
+        mask = self.live[:self._size].copy()
+        for condition in filters or []:
+            operator, field, expected = condition["operator"], condition["field"], condition.get("value")
+            try:
+                mask &= self._column_mask(field, operator, expected)
+            except _Unsupported:
+                mask &= self._row_mask(field, operator, expected)
+        return mask
+
+    def find(self, filters: Optional[List[dict]]) -> List[Any]:
+        # Non-dict entities have no fields, filters and aggregations never select them
+        return self.entities(self.mask(filters))
+
+    # Aggregations, same contract and result shape as aggregate_in_memory
+
+    def aggregate(self, aggregations: Dict[str, Tuple[str, Optional[str]]], group_by: Optional[List[str]] = None,
+                  filters: Optional[List[dict]] = None) -> List[dict]:
+        validate_aggregations(aggregations, filters)
+        group_by = group_by or []
+        vectorised = all(
+            field in self.columns and self.columns[field].kind in ("int", "float", "bool") for _, (function, field)
+            in aggregations.items() if field) and all(
+            field not in self.columns or self.columns[field].kind != "object" for field in group_by) and \
+            not any("." in field for field in group_by)
+        mask = self.mask(filters)
+        if not vectorised:
+            return aggregate_in_memory(self.entities(mask), aggregations, group_by)
+        rows = np.flatnonzero(mask)
+        if group_by:
+            encoded = [self._group_codes(field, rows) for field in group_by]
+            keys = np.stack([codes for codes, _, _ in encoded], axis=1)
+            unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            groups = len(unique_keys)
+        elif len(rows):
+            inverse = np.zeros(len(rows), dtype=np.int64)
+            groups = 1
+        else:
+            return aggregate_in_memory([], aggregations)
+
+        results = {}
+        for alias, (function, field) in aggregations.items():
+            if not field:
+                results[alias] = np.bincount(inverse, minlength=groups).tolist()
+                continue
+            column = self.columns[field]
+            present = column.state[rows] == VALUE
+            counts = np.bincount(inverse[present], minlength=groups)
+            values = column.values[rows][present]
+            group = inverse[present]
+            # Float columns also hold ints, flagged per row
+            integral = column.integral[rows][present] if column.integral is not None else None
+            if function == "count":
+                column_result = counts.tolist()
+            elif function in ("sum", "avg"):
+                totals = np.zeros(groups, dtype=np.float64 if column.kind == "float" else np.int64)
+                np.add.at(totals, group, values)
+                totals = totals.tolist()
+                if integral is not None:
+                    # A group summing only ints has an int total, as summing its dicts would
+                    floats = np.bincount(group[~integral], minlength=groups)
+                    totals = [int(total) if not floats[index] else total for index, total in enumerate(totals)]
+                column_result = [(total / count if function == "avg" else total) if count else None
+                                 for total, count in zip(totals, counts.tolist())]
+            else:
+                reduce = np.minimum if function == "min" else np.maximum
+                extremes = np.zeros(groups, dtype=values.dtype)
+                # Start each group from one of its own values so the reduction is exact for every dtype
+                first = np.full(groups, -1, dtype=np.int64)
+                first[group] = np.arange(len(group))
+                extremes[first >= 0] = values[first[first >= 0]]
+                reduce.at(extremes, group, values)
+                column_result = [extreme if count else None
+                                 for extreme, count in zip(extremes.tolist(), counts.tolist())]
+                if integral is not None:
+                    # The extreme keeps the type of the first row holding it
+                    holders = np.flatnonzero(values == extremes[group])
+                    holder_groups, first_holders = np.unique(group[holders], return_index=True)
+                    for index, holder in zip(holder_groups.tolist(), holders[first_holders].tolist()):
+                        if integral[holder]:
+                            column_result[index] = int(column_result[index])
+            results[alias] = column_result
+
+        key_values = [self._decode_keys(unique_keys[:, index].tolist(), decoded, integral, inverse)
+                      for index, (_, decoded, integral) in enumerate(encoded)] if group_by else []
+        return [{**{field: key_values[index][group] for index, field in enumerate(group_by)},
+                 **{alias: results[alias][group] for alias in aggregations}} for group in range(groups)]
+
+    @staticmethod
+    def _decode_keys(codes: List[int], decoded: List[Any], integral, inverse) -> List[Any]:
+        """Each group's key value, from a float column typed as the group's first row is, as in the dicts."""
+        keys = [decoded[code] if code >= 0 else None for code in codes]
+        if integral is not None:
+            _, first_rows = np.unique(inverse, return_index=True)
+            keys = [int(key) if key is not None and integral[row] else key
+                    for key, row in zip(keys, first_rows.tolist())]
+        return keys
+
+    def _group_codes(self, field: str, rows):
+        """
+        Integer group codes per row (-1 for None or missing), the value each code stands for and, for float
+        columns, which of the rows hold ints.
+        """
+        column = self.columns.get(field)
+        if column is None:
+            return np.full(len(rows), -1, dtype=np.int64), [], None
+        present = column.state[rows] == VALUE
+        values = column.values[rows]
+        if column.kind == "str":
+            return np.where(present, values, -1).astype(np.int64), column.dictionary, None
+        distinct = np.unique(values[present])
+        codes = np.searchsorted(distinct, values) if len(distinct) else np.zeros(len(rows), dtype=np.int64)
+        integral = column.integral[rows] if column.integral is not None else None
+        return np.where(present, codes, -1).astype(np.int64), distinct.tolist(), integral
+
+
+def columnar_available() -> bool:
+    return np is not None
@@ -1,6 +1,6 @@
 from abc import abstractmethod
 from enum import Enum
-from typing import List, Any, Optional
+from typing import List, Any, Optional, AsyncIterator
 
 from common.repository.repository import Repository
 
@@ -17,9 +17,9 @@ class CrudRepository(Repository):
         return {}
 
     @abstractmethod
-    async def count(self, meta) -> int:
+    async def count(self, meta, criteria: Any = None) -> int:
         """
-        Returns the number of entities available.
+        Returns the number of entities available, or of those matching the criteria.
         """
         pass
 
@@ -37,6 +37,14 @@ class CrudRepository(Repository):
         """
         pass
 
+    @abstractmethod
+    async def delete_all_by_ids(self, meta, ids: List[Any]) -> List[dict]:
+        """
+        Deletes the entities with the given technical ids, reporting per id, in the same order:
+        {"technical_id": id, "status": "deleted" | "not_found" | "failed", "error": message when failed}.
+        """
+        pass
+
     @abstractmethod
     async def delete_all(self, meta) -> None:
         """
@@ -79,6 +87,13 @@ class CrudRepository(Repository):
         """
         pass
 
+    @abstractmethod
+    def iter_all(self, meta) -> AsyncIterator[Any]:
+        """
+        Yields all instances of the type one by one, without loading them all at once.
+        """
+        pass
+
     @abstractmethod
     async def find_all_by_key(self, meta, keys: List[Any]) -> List:
         """
@@ -100,10 +115,18 @@ class CrudRepository(Repository):
         """
         pass
 
+    @abstractmethod
+    async def find_all_by_ids(self, meta, ids: List[Any]) -> List[Optional[Any]]:
+        """
+        Retrieves the entities with the given technical ids, in the same order, None for missing ones.
+        """
+        pass
+
     @abstractmethod
     async def find_all_by_criteria(self, meta, criteria: Any) -> Optional[Any]:
         """
-        Retrieves an entity by its technical id.
+        Retrieves the entities matching the criteria, at most meta["max_results"] of them (in no particular
+        order) when it is set.
         """
         pass
 
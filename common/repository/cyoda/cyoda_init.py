@@ -4,8 +4,10 @@ import os
 from pathlib import Path
 
 from common.ai.ai_assistant_service_impl import API_V_WORKFLOWS_
+from common.ai.ai_cache import ai_response_cache
 from common.config.config import ENTITY_VERSION, CHAT_ID, CYODA_AI_URL, CYODA_API_URL
 from common.repository.cyoda.cyoda_repository import CyodaRepository
+from common.service.trino_service import register_trino_schema, load_trino_schema_registry, TRINO_CONFIG_FILE
 from common.util.utils import send_post_request, send_get_request
 from app_init.app_init import ai_service
 
@@ -50,16 +52,25 @@ async def init_workflow(entity_dir, token, entity_name):
                 "workflow_json": f"{workflow_contents}",
                 "class_name": "com.cyoda.tdb.model.treenode.TreeNodeEntity"
             })
+            return_dto_path = "%s/return-dto" % API_V_WORKFLOWS_
+
+            async def convert_workflow():
+                response = await send_post_request(token=token, api_url=CYODA_AI_URL, path=return_dto_path, data=data)
+                return response.get('json') if response.get('status') == 200 else None
+
+            # Not cached: it registers the workflow with the AI service, which a cache hit must not skip
             await send_post_request(token, CYODA_AI_URL, "/api/v1/workflows/initial", data)
-            response = await send_post_request(token=token, api_url=CYODA_AI_URL, path="%s/return-dto" % API_V_WORKFLOWS_, data=data)
-            data = response.get('json')
-            response = await send_post_request(token=token, api_url=CYODA_API_URL, path="platform-api/statemachine/import?needRewrite=true", data=data)
+            converted = await ai_response_cache.get_or_fetch(return_dto_path, data, convert_workflow)
+            if converted is None:
+                raise Exception(f"Converting the workflow of '{entity_name}' failed, it is not imported")
+            response = await send_post_request(token=token, api_url=CYODA_API_URL, path="platform-api/statemachine/import?needRewrite=true", data=converted)
             return response
 
 
 
 async def init_trino(entity_name, token):
-    trino_models_config = {}
+    # Keep the schemas already registered for other entities
+    trino_models_config = dict(load_trino_schema_registry())
     resp = await send_get_request(token=token, api_url=CYODA_API_URL, path="treeNode/model/")
     trino_models = resp.get('json')
     for model in trino_models:
@@ -75,9 +86,9 @@ async def init_trino(entity_name, token):
             chat_id = resp.get('json')
             await ai_service.init_trino_chat(token=token, chat_id=chat_id, schema_name=entity_name)
             trino_models_config[entity_name] = chat_id
+            register_trino_schema(entity_name, chat_id)
             break
-    config_file_path = entity_dir / 'config.json'
-    with open(config_file_path, 'w') as file:
+    with open(TRINO_CONFIG_FILE, 'w') as file:
         # Write the dictionary as JSON
         json.dump(trino_models_config, file, indent=4)
 
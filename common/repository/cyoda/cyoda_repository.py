@@ -1,13 +1,36 @@
+import asyncio
 import threading
-from typing import List
-
-from common.config.config import CYODA_API_URL
+from typing import AsyncIterator, List
+
+from common.config.config import CYODA_API_URL, ENTITY_LOADER_FETCH_CONCURRENCY, COUNT_CACHE_TTL, \
+    DELETE_CHUNK_SIZE, DELETE_CONCURRENCY, ENTITY_STREAM_CHUNK_SIZE, SEARCH_PAGE_SIZE
+from common.exception.exceptions import DeadlineExceededException, EntityRejectedException
+from common.monitoring.metrics import instrument_repository, snapshot_search_phase_duration
+from common.monitoring.server_timing import timed
+from common.monitoring.tracing import trace_methods
+from common.resilience import deadline
+from common.resilience.bulkhead import bulkhead_methods
 from common.repository.crud_repository import CrudRepository
+from common.util.cache import TTLCache
+from common.util.json_stream import JsonArrayDecoder
+from common.util.logging_utils import hot_path_logger, truncated
 from common.util.utils import *
 
 logger = logging.getLogger('quart')
+_save_log = hot_path_logger(logger, "cyoda.save_new_entity")
+_search_log = hot_path_logger(logger, "cyoda.snapshot_search")
+_get_by_id_log = hot_path_logger(logger, "cyoda.get_by_id")
+_get_all_log = hot_path_logger(logger, "cyoda.get_all_entities")
+
+# Matches every entity of the model
+MATCH_ALL_CONDITION = {"type": "group", "operator": "AND", "conditions": []}
+# (entity model, version, serialised condition) -> totalElements
+_counts = TTLCache(ttl=COUNT_CACHE_TTL, max_entries=1024)
 
 
+@instrument_repository
+@trace_methods("cyoda_repository")
+@bulkhead_methods
 class CyodaRepository(CrudRepository):
     _instance = None
     _lock = threading.Lock()  # Lock for thread safety
@@ -26,28 +49,96 @@ class CyodaRepository(CrudRepository):
     async def get_meta(self, token, entity_model, entity_version):
         return {"token": token, "entity_model": entity_model, "entity_version": entity_version,  "update_transition": "update"}
 
-    async def count(self, meta) -> int:
-        pass
+    async def count(self, meta, criteria: Any = None) -> int:
+        """
+        Number of entities matching the search condition (all of the model by default), read from the search
+        metadata of a one-entity page and cached for COUNT_CACHE_TTL seconds per condition.
+        """
+        condition = criteria if isinstance(criteria, str) else json.dumps(
+            criteria if criteria is not None else MATCH_ALL_CONDITION, sort_keys=True)
+        key = (meta["entity_model"], meta["entity_version"], condition)
+        total = _counts.get(key)
+        if total is None:
+            search_result = await self._search_entities(meta, condition, page_size=1)
+            if search_result is None:
+                raise Exception(f"Counting {meta['entity_model']} entities failed: no snapshot created")
+            total = search_result.get("page", {}).get("totalElements", 0)
+            _counts.set(key, total)
+        return total
 
     async def delete_all(self, meta) -> None:
-        pass
+        res = await self._delete_all_entities(meta["token"], meta["entity_model"], meta["entity_version"])
+        _counts.invalidate()
+        return res
 
-    async def delete_all_entities(self, meta, entities: List[Any]) -> None:
-        pass
+    async def delete_all_entities(self, meta, entities: List[Any]) -> List[dict]:
+        return await self.delete_all_by_ids(meta, [entity["technical_id"] for entity in entities])
 
-    async def delete_all_by_key(self, meta, keys: List[Any]) -> None:
-        pass
+    async def delete_all_by_key(self, meta, keys: List[Any]) -> List[dict]:
+        return await self.delete_all_by_ids(meta, keys)
 
     async def delete_by_key(self, meta, key: Any) -> None:
-        pass
+        return await self.delete_by_id(meta, key)
+
+    async def delete_all_by_ids(self, meta, ids: List[Any]) -> List[dict]:
+        # Cyoda has no bulk delete by technical id: ids are deleted DELETE_CHUNK_SIZE at a time, with at most
+        # DELETE_CONCURRENCY requests in flight, and one failed id does not stop the others
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def delete(_id):
+            async with semaphore:
+                try:
+                    deleted = await self._delete_entity(meta["token"], _id)
+                    return {"technical_id": _id, "status": "deleted" if deleted else "not_found"}
+                except Exception as e:
+                    return {"technical_id": _id, "status": "failed", "error": str(e)}
+
+        results = []
+        try:
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                deadline.check(f"deleting {meta['entity_model']} entities")
+                results.extend(await asyncio.gather(*(delete(_id) for _id in ids[start:start + DELETE_CHUNK_SIZE])))
+        except DeadlineExceededException as e:
+            results.extend({"technical_id": _id, "status": "failed", "error": e.message} for _id in ids[len(results):])
+        finally:
+            _counts.invalidate()
+        failed = sum(1 for result in results if result["status"] == "failed")
+        if failed:
+            logger.warning(f"Deleting {len(ids)} {meta['entity_model']} entities: {failed} failed")
+        return results
 
     async def exists_by_key(self, meta, key: Any) -> bool:
-        pass
+        # As in find_by_key, the key is looked up through the search condition in meta
+        return await self.count(meta, meta.get("condition", key)) > 0
 
     async def find_all(self, meta) -> List[Any]:
         entities = await self._get_all_entities(meta)
         return entities
 
+    async def iter_all(self, meta) -> AsyncIterator[Any]:
+        """
+        All entities of the model, decoded from the response body as it arrives so only the entity being read is
+        held in memory. Like the other streaming calls it bypasses the retry and bulkhead policies, async
+        generators are not wrapped by the class decorators.
+        """
+        path = f"entity/{meta["entity_model"]}/{meta["entity_version"]}"
+        stream = send_get_stream_request(meta["token"], CYODA_API_URL, path, chunk_size=ENTITY_STREAM_CHUNK_SIZE)
+        try:
+            head = await anext(stream)
+            _get_all_log.info("Entities stream opened", entity_model=meta["entity_model"], status=head["status"])
+            if head["status"] == 404:
+                return
+            if head["status"] != 200:
+                raise Exception(f"Getting {meta["entity_model"]} entities failed with status {head["status"]}")
+            decoder = JsonArrayDecoder()
+            async for chunk in stream:
+                for entity in decoder.feed(chunk):
+                    yield entity
+            for entity in decoder.close():
+                yield entity
+        finally:
+            await stream.aclose()
+
     async def find_all_by_key(self, meta, keys: List[Any]) -> List[Any]:
         ids = await self._get_all_by_ids(meta, keys)
         return ids
@@ -60,68 +151,119 @@ class CyodaRepository(CrudRepository):
         res = await self._get_by_id(meta, _uuid)
         return res
 
+    async def find_all_by_ids(self, meta, ids: List[Any]) -> List[Optional[Any]]:
+        # Cyoda has no bulk read by technical id, fetch them concurrently with a bounded number of GETs.
+        # Failures are returned in place of the entity so one bad id does not fail the others.
+        semaphore = asyncio.Semaphore(ENTITY_LOADER_FETCH_CONCURRENCY)
+
+        async def fetch(_uuid):
+            async with semaphore:
+                return await self._get_by_id(meta, _uuid)
+
+        return await asyncio.gather(*(fetch(_uuid) for _uuid in ids), return_exceptions=True)
+
     async def find_all_by_criteria(self, meta, criteria: Any) -> Optional[Any]:
         try:
-            resp = await self._search_entities(meta, criteria)
-            if resp['page']['totalElements'] == 0:
-                # resp = {'page': {'number': 0, 'size': 10, 'totalElements': 0, 'totalPages': 0}}
-                return []
-            # resp = {'_embedded': {'objectNodes': [{'id': 'f04bce86-89a9-11b2-aa0c-169608d9bc9e', 'tree': {'email': '4126cf85-61b6-48ec-b7bc-89fc1999d9b9@q.q', 'name': 'test', 'role': 'Start-up', 'user_id': '1703b76f-8b2f-11ef-9910-40c2ba0ac9eb'}}]}, 'page': {'number': 0, 'size': 10, 'totalElements': 1, 'totalPages': 1}}
-            #entities = resp["_embedded"]["objectNodes"]
-            result_entities = await self._convert_to_entities(resp)
-            return result_entities
+            # Every match unless the caller can do with the first ones, it may sort the whole result
+            return await self._search_all_entities(meta, criteria, meta.get("max_results"))
+        except DeadlineExceededException:
+            raise
         except Exception as e:
             logger.exception(e)
             return []
 
     async def save(self, meta, entity: Any) -> Any:
-        res = await self._save_new_entities(meta, [entity])
+        try:
+            res = await self._save_new_entities(meta, [entity])
+        finally:
+            _counts.invalidate()
         return res[0]['entityIds'][0]
 
-    async def save_all(self, meta, entities: List[Any]) -> bool:
-        res = await self._save_new_entities(meta, entities)
-        return res[0]['entityIds'][0]
+    async def save_all(self, meta, entities: List[Any]) -> List[Any]:
+        try:
+            res = await self._save_new_entities(meta, entities)
+        finally:
+            _counts.invalidate()
+        return [entity_id for transaction in res for entity_id in transaction['entityIds']]
 
     async def update(self, meta, _id, entity: Any) -> Any:
         meta["technical_id"] = _id
-        if entity is None:
-            res = await self._launch_transition(meta)
-            return res
-        res = await self._update_entity(meta=meta, _id=_id, entity=entity)
+        # Updates and transitions change what the cached counts' conditions match, even when they fail midway
+        try:
+            if entity is None:
+                res = await self._launch_transition(meta)
+                return res
+            res = await self._update_entity(meta=meta, _id=_id, entity=entity)
+        finally:
+            _counts.invalidate()
         return res['entityIds'][0]
 
     async def update_all(self, meta, entities: List[Any]) -> List[Any]:
-        res = await self._update_entities(meta, entities)
+        try:
+            res = await self._update_entities(meta, entities)
+        finally:
+            _counts.invalidate()
         return res
 
-    async def _search_entities(self, meta, condition):
+    async def _search_entities(self, meta, condition, page_size=100):
+        snapshot_id = await self._run_snapshot_search(meta, condition)
+        if not snapshot_id:
+            return None
+        return await self._get_search_page(meta, snapshot_id, page_size, 0)
+
+    async def _search_all_entities(self, meta, condition, max_results: int = None) -> List[Any]:
+        """
+        The entities matching the condition, read SEARCH_PAGE_SIZE at a time from one snapshot: all of them, or
+        only the pages needed for the first `max_results`.
+        """
+        snapshot_id = await self._run_snapshot_search(meta, condition)
+        if not snapshot_id:
+            raise Exception(f"Searching {meta['entity_model']} entities failed: no snapshot created")
+        page_size = SEARCH_PAGE_SIZE if max_results is None else max(1, min(SEARCH_PAGE_SIZE, max_results))
+        # resp = {'_embedded': {'objectNodes': [{'id': 'f04bce86-89a9-11b2-aa0c-169608d9bc9e', 'tree': {...}}]}, 'page': {'number': 0, 'size': 10, 'totalElements': 1, 'totalPages': 1}}
+        first = await self._get_search_page(meta, snapshot_id, page_size, 0)
+        entities = await self._convert_to_entities(first) or []
+        for page_number in range(1, first.get("page", {}).get("totalPages", 1)):
+            if max_results is not None and len(entities) >= max_results:
+                break
+            deadline.check(f"reading search results of {meta['entity_model']}")
+            page = await self._get_search_page(meta, snapshot_id, page_size, page_number)
+            entities.extend(await self._convert_to_entities(page) or [])
+        return entities if max_results is None else entities[:max_results]
+
+    async def _run_snapshot_search(self, meta, condition):
         # Create a snapshot search
-        snapshot_response = await self._create_snapshot_search(
-            token=meta["token"],
-            model_name=meta["entity_model"],
-            model_version=meta["entity_version"],
-            condition=condition
-        )
+        with snapshot_search_phase_duration.time(phase="create"):
+            snapshot_response = await self._create_snapshot_search(
+                token=meta["token"],
+                model_name=meta["entity_model"],
+                model_version=meta["entity_version"],
+                condition=condition
+            )
         snapshot_id = snapshot_response
         if not snapshot_id:
             logger.error(f"Snapshot ID not found in response: {snapshot_response}")
             return None
 
         # Wait for the search to complete
-        await self._wait_for_search_completion(
-            token=meta["token"],
-            snapshot_id=snapshot_id,
-            timeout=60,  # Adjust timeout as needed
-            interval=300  # Adjust interval (in milliseconds) as needed
-        )
-
-        # Retrieve search results
-        search_result = await self._get_search_result(
-            token=meta["token"],
-            snapshot_id=snapshot_id,
-            page_size=100,  # Adjust page size as needed
-            page_number=1  # Starting with the first page
-        )
+        with snapshot_search_phase_duration.time(phase="poll"):
+            await self._wait_for_search_completion(
+                token=meta["token"],
+                snapshot_id=snapshot_id,
+                timeout=60,  # Adjust timeout as needed
+                interval=300  # Adjust interval (in milliseconds) as needed
+            )
+        return snapshot_id
+
+    async def _get_search_page(self, meta, snapshot_id, page_size, page_number):
+        # Retrieve search results, pages are numbered from 0
+        with snapshot_search_phase_duration.time(phase="fetch"):
+            search_result = await self._get_search_result(
+                token=meta["token"],
+                snapshot_id=snapshot_id,
+                page_size=page_size,
+                page_number=page_number
+            )
         return search_result
 
     async def _get_all_by_ids(self, meta, keys) -> List[Any]:
@@ -166,7 +308,8 @@ class CyodaRepository(CrudRepository):
         try:
 
             # Serialize the entity with the custom serializer
-            entities_data = json.dumps(entities, default=custom_serializer)
+            with timed("json"):
+                entities_data = json.dumps(entities, default=custom_serializer)
             resp = await self._save_new_entity(
                 token=meta["token"],
                 model=meta["entity_model"],
@@ -179,10 +322,22 @@ class CyodaRepository(CrudRepository):
             raise e
 
     async def delete(self, meta, entity: Any) -> None:
-        pass
+        return await self.delete_by_id(meta, entity["technical_id"])
 
     async def delete_by_id(self, meta, id: Any) -> None:
-        pass
+        deleted = await self._delete_entity(meta["token"], id)
+        _counts.invalidate()
+        return id if deleted else None
+
+    @staticmethod
+    async def _delete_entity(token, technical_id) -> bool:
+        """Delete one entity, False when it does not exist."""
+        response = await send_delete_request(token, CYODA_API_URL, f"entity/{technical_id}", idempotent=True)
+        if response.get("status") == 404:
+            return False
+        if response.get("status") != 200:
+            raise Exception(f"Deleting entity {technical_id} failed with status {response.get('status')}")
+        return True
 
     @staticmethod
     async def _save_entity_schema(token, entity_name, version, data):
@@ -209,7 +364,8 @@ class CyodaRepository(CrudRepository):
         path = f"model/{entity_name}/{version}/lock"
 
         try:
-            response = await send_put_request(token=token, api_url=CYODA_API_URL, path=path, data=data)
+            response = await send_put_request(token=token, api_url=CYODA_API_URL, path=path, data=data,
+                                              idempotent=True)
 
             if response:
                 logger.info(
@@ -248,13 +404,17 @@ class CyodaRepository(CrudRepository):
     @staticmethod
     async def _save_new_entity(token, model, version, data):
         path = f"entity/JSON/{model}/{version}"
-        logger.info(f"Saving new entity to path: {path}")
+        _save_log.debug("Saving new entity to path: %s", path)
 
         try:
             response = await send_post_request(token=token, api_url=CYODA_API_URL, path=path, data=data)
 
+            status = response.get("status") if response else None
+            if status is not None and 400 <= status < 500 and status not in (408, 429):
+                raise EntityRejectedException(f"Cyoda rejected the '{model}' entities: {response.get('json')}",
+                                              status)
             if response:
-                logger.info(f"Successfully saved new entity. Response: {response}")
+                _save_log.info("Successfully saved new entity. Response: %s", truncated(response), entity_model=model)
                 return response.get('json')
             else:
                 logger.error(f"Failed to save new entity. Response: {response}")
@@ -278,8 +438,10 @@ class CyodaRepository(CrudRepository):
     @staticmethod
     async def _create_snapshot_search(token, model_name, model_version, condition):
         search_url = f"search/snapshot/{model_name}/{model_version}"
-        logger.info(condition)
-        response = await send_post_request(token, CYODA_API_URL, search_url, data=json.dumps(condition))
+        _search_log.info("Snapshot search condition: %s", truncated(condition), entity_model=model_name)
+        # Compiled queries arrive already serialised
+        data = condition if isinstance(condition, str) else json.dumps(condition)
+        response = await send_post_request(token, CYODA_API_URL, search_url, data=data)
         if response:
             return response.get('json')
         else:
@@ -296,7 +458,9 @@ class CyodaRepository(CrudRepository):
             raise Exception(f"Snapshot search trigger failed: {response}")
 
     async def _wait_for_search_completion(self, token, snapshot_id, timeout=5, interval=10):
-        start_time = now()  # Record the start time
+        # timeout in seconds, interval in milliseconds; the caller's deadline shortens the timeout
+        timeout = deadline.timeout(timeout, f"polling snapshot {snapshot_id}")
+        start_time = time.monotonic()
 
         while True:
             status_response = await self._get_snapshot_status(token, snapshot_id)
@@ -308,21 +472,18 @@ class CyodaRepository(CrudRepository):
             elif status != "RUNNING":
                 raise Exception(f"Snapshot search failed: {json.dumps(status_response, indent=4)}")
 
-            elapsed_time = now() - start_time
+            elapsed_time = time.monotonic() - start_time
 
             if elapsed_time > timeout:
-                raise TimeoutError(f"Timeout exceeded after {timeout} seconds")
+                deadline.check(f"polling snapshot {snapshot_id}")
+                raise TimeoutError(f"Timeout exceeded after {timeout:.1f} seconds")
 
-            time.sleep(interval / 1000)  # Wait for the given interval (msec) before checking again
+            # Wait for the given interval (msec) before checking again, without blocking the event loop
+            await asyncio.sleep(min(interval / 1000, timeout - elapsed_time))
 
     @staticmethod
     async def _get_search_result(token, snapshot_id, page_size, page_number):
-        result_url = f"search/snapshot/{snapshot_id}"
-
-        params = {
-            'pageSize': f"{page_size}",
-            'pageNumber': f"{page_number}"
-        }
+        result_url = f"search/snapshot/{snapshot_id}?pageSize={page_size}&pageNumber={page_number}"
 
         response = await send_get_request(token=token, api_url=CYODA_API_URL, path=result_url)
 
@@ -333,24 +494,29 @@ class CyodaRepository(CrudRepository):
 
     @staticmethod
     async def _update_entities(meta, entities: List[Any]) -> List[Any]:
+        # Entities carry their technical_id, all of them are sent in a single bulk request
         path = "entity/JSON"
         payload = []
         for entity in entities:
-            payload_json = json.dumps(entity, default=custom_serializer)
+            _id = meta.get("technical_id")
+            if isinstance(entity, dict) and "technical_id" in entity:
+                _id = entity["technical_id"]
+                entity = {key: value for key, value in entity.items() if key != "technical_id"}
+            with timed("json"):
+                payload_json = json.dumps(entity, default=custom_serializer)
 
             payload.append({
-                "id": meta.get("technical_id"),
+                "id": _id,
                 "transition": meta.get("update_transition"),
                 "payload": payload_json
             })
+        with timed("json"):
             data = json.dumps(payload)
-            response = await send_put_request(meta["token"], CYODA_API_URL, path, data=data)
-            if response:
-                return entities
-            else:
-                raise Exception(f"Get search result failed: {response}")
-
-        return entities
+        response = await send_put_request(meta["token"], CYODA_API_URL, path, data=data)
+        if response and response.get('status') == 200:
+            return entities
+        else:
+            raise Exception(f"Bulk update of {len(entities)} entities failed: {response}")
 
     @staticmethod
     async def _update_entity(meta, _id, entity: Any) -> List[Any]:
@@ -360,7 +526,8 @@ class CyodaRepository(CrudRepository):
         #     key: value for key, value in entity.to_dict().items()
         #     if value is not None and key != "technical_id"
         # }
-        payload_json = json.dumps(entity, default=custom_serializer)
+        with timed("json"):
+            payload_json = json.dumps(entity, default=custom_serializer)
         response = await send_put_request(meta["token"], CYODA_API_URL,
                                           f"{path}/{_id}/{meta["update_transition"]}",
                                           data=payload_json)
@@ -390,17 +557,28 @@ class CyodaRepository(CrudRepository):
 
     async def _get_by_id(self, meta, _uuid):
         path = f"entity/{_uuid}"
-        response = await send_get_request(meta["token"], CYODA_API_URL, path=path)
-        logger.info(response)
+        response = await send_get_request(meta["token"], CYODA_API_URL, path=path, hedge=True)
+        _get_by_id_log.info("Entity response: %s", truncated(response), technical_id=_uuid,
+                            status=response.get('status'))
+        if response.get('status') == 404:
+            return None
+        if response.get('status') != 200 or not isinstance(response.get('json'), dict):
+            raise Exception(f"Getting entity {_uuid} failed with status {response.get('status')}")
         return response.get('json').get('tree')
 
     async def _get_all_entities(self, meta):
         path = f"entity/{meta["entity_model"]}/{meta["entity_version"]}"
         response = await send_get_request(meta["token"], CYODA_API_URL, path=path)
-        logger.info(response)
+        _get_all_log.info("Entities response: %s", truncated(response), entity_model=meta["entity_model"],
+                          status=response.get('status'))
+        if response.get('status') not in (200, 404):
+            raise Exception(f"Getting {meta["entity_model"]} entities failed with status {response.get('status')}")
         return response.get('json')
 
     async def _launch_transition(self, meta):
         path = f"/platform-api/entity/transition?entityId={meta["technical_id"]}&entityClass=com.cyoda.tdb.model.treenode.TreeNodeEntity&transitionName={meta["update_transition"]}"
         response = await send_put_request(meta["token"], CYODA_API_URL, path)
+        if response.get('status') != 200:
+            raise Exception(f"Transition {meta["update_transition"]} of entity {meta["technical_id"]} failed "
+                            f"with status {response.get('status')}")
         return response.get('json')
@@ -1,14 +1,112 @@
+import copy
 import threading
-from typing import List, Any
-
+from itertools import islice
+from typing import List, Any, AsyncIterator
+
+from common.config.config import IN_MEMORY_PERSISTENCE_ENABLED, IN_MEMORY_PERSISTENCE_DIR, \
+    IN_MEMORY_SNAPSHOT_INTERVAL, IN_MEMORY_SNAPSHOT_WAL_RECORDS, IN_MEMORY_WAL_FSYNC, IN_MEMORY_COLUMNAR_MODELS
+from common.monitoring.metrics import instrument_repository
+from common.monitoring.profiling import register_component
+from common.repository.columnar_store import ColumnarStore, columnar_available
 from common.repository.crud_repository import CrudRepository
+from common.repository.in_memory_persistence import InMemoryPersistence
+from common.service.aggregation import aggregate_in_memory
 from common.util.utils import *
 
 logger = logging.getLogger('django')
 
+# Dict-stored entities by entity model, then by technical id
 cache = {}
+register_component("in_memory_repository", lambda: cache)
+
+# Models stored column by column instead of as one dict per entity
+columnar_models = {model.strip() for model in IN_MEMORY_COLUMNAR_MODELS.split(",") if model.strip()}
+if columnar_models and not columnar_available():
+    logger.warning(f"numpy is not installed, models {sorted(columnar_models)} are stored as dicts")
+    columnar_models = set()
+columnar_stores = {model: ColumnarStore(model) for model in columnar_models}
+register_component("in_memory_columnar_stores", lambda: columnar_stores)
+
+
+def _store_for(entity_model) -> Optional[ColumnarStore]:
+    return columnar_stores.get(entity_model)
+
+
+def _entities_of(entity_model) -> dict:
+    return cache.get(entity_model, {})
+
+
+def _with_id(technical_id, entity):
+    # A copy, so callers never modify the stored entity behind the log's back
+    return {**entity, "technical_id": technical_id} if isinstance(entity, dict) else entity
+
+
+def _put(technical_id, entity, entity_model=None) -> None:
+    # A copy, so later changes to the caller's dict never reach the store without a log record
+    entity = copy.deepcopy(entity)
+    store = _store_for(entity_model)
+    if store is not None:
+        store.put(technical_id, entity)
+    else:
+        cache.setdefault(entity_model, {})[technical_id] = entity
+    if persistence:
+        persistence.log_put(technical_id, entity, entity_model)
+
+
+def _delete(technical_id, entity_model=None) -> None:
+    store = _store_for(entity_model)
+    if store is not None:
+        if not store.delete(technical_id):
+            raise KeyError(technical_id)
+    else:
+        del _entities_of(entity_model)[technical_id]
+    if persistence:
+        persistence.log_delete(technical_id, entity_model)
+
+
+def _restore_put(technical_id, entity, entity_model) -> None:
+    store = _store_for(entity_model)
+    if store is not None:
+        store.put(technical_id, entity)
+    else:
+        cache.setdefault(entity_model, {})[technical_id] = entity
+
+
+def _restore_delete(technical_id, entity_model) -> None:
+    store = _store_for(entity_model)
+    if store is not None:
+        store.delete(technical_id)
+    else:
+        _entities_of(entity_model).pop(technical_id, None)
+
+
+def _snapshot_items():
+    """
+    Point-in-time copy of the store, taken on the event loop and iterated by the snapshot writer thread. Only the
+    containers are copied: stored entities are never modified in place, _put stores a copy.
+    """
+    entities_by_model = {model: dict(entities) for model, entities in cache.items()}
+    stores = [store.snapshot() for store in columnar_stores.values()]
 
+    def items():
+        for model, entities in entities_by_model.items():
+            for technical_id, entity in entities.items():
+                yield technical_id, entity, model
+        for store in stores:
+            for technical_id, entity in store.items():
+                yield technical_id, entity, store.entity_model
 
+    return items()
+
+
+persistence = InMemoryPersistence(IN_MEMORY_PERSISTENCE_DIR, IN_MEMORY_SNAPSHOT_INTERVAL,
+                                  IN_MEMORY_SNAPSHOT_WAL_RECORDS, IN_MEMORY_WAL_FSYNC == "true") \
+    if IN_MEMORY_PERSISTENCE_ENABLED == "true" else None
+if persistence:
+    persistence.load(_restore_put, _restore_delete, _snapshot_items)
+
+
+@instrument_repository
 class InMemoryRepository(CrudRepository):
     _instance = None
     _lock = threading.Lock()
@@ -27,26 +125,58 @@ class InMemoryRepository(CrudRepository):
     async def get_meta(self, token, entity_model, entity_version):
         return {"token": token, "entity_model": entity_model, "entity_version": entity_version}
 
-    async def count(self, meta) -> int:
-        pass
+    async def count(self, meta, criteria: Any = None) -> int:
+        if criteria is None:
+            store = _store_for(meta.get("entity_model"))
+            return len(store) if store is not None else len(_entities_of(meta.get("entity_model")))
+        return len(await self.find_all_by_criteria(meta, criteria))
 
     async def delete_all(self, meta) -> None:
-        pass
+        store = _store_for(meta.get("entity_model"))
+        technical_ids = store.technical_ids() if store is not None else list(_entities_of(meta.get("entity_model")))
+        for technical_id in technical_ids:
+            _delete(technical_id, meta.get("entity_model"))
 
-    async def delete_all_entities(self, meta, entities: List[Any]) -> None:
-        pass
+    async def delete_all_entities(self, meta, entities: List[Any]) -> List[dict]:
+        return await self.delete_all_by_ids(meta, [entity["technical_id"] for entity in entities])
 
-    async def delete_all_by_key(self, meta, keys: List[Any]) -> None:
-        pass
+    async def delete_all_by_key(self, meta, keys: List[Any]) -> List[dict]:
+        return await self.delete_all_by_ids(meta, keys)
 
     async def delete_by_key(self, meta, key: Any) -> None:
-        pass
+        return await self.delete_by_id(meta, key)
+
+    async def delete_all_by_ids(self, meta, ids: List[Any]) -> List[dict]:
+        results = []
+        for technical_id in ids:
+            try:
+                _delete(technical_id, meta.get("entity_model"))
+                results.append({"technical_id": technical_id, "status": "deleted"})
+            except KeyError:
+                results.append({"technical_id": technical_id, "status": "not_found"})
+        return results
 
     async def exists_by_key(self, meta, key: Any) -> bool:
-        pass
+        return await self.count(meta, meta.get("condition", key)) > 0
 
     async def find_all(self, meta) -> List[Any]:
-        pass
+        store = _store_for(meta.get("entity_model"))
+        if store is not None:
+            return store.entities()
+        return [_with_id(uuid, entity) for uuid, entity in _entities_of(meta.get("entity_model")).items()]
+
+    async def iter_all(self, meta) -> AsyncIterator[Any]:
+        store = _store_for(meta.get("entity_model"))
+        if store is not None:
+            for entity in store.iter_entities():
+                yield entity
+            return
+        entities = _entities_of(meta.get("entity_model"))
+        for uuid in list(entities):
+            entity = entities.get(uuid)
+            if entity is None:
+                continue
+            yield _with_id(uuid, entity)
 
     async def find_all_by_key(self, meta, keys: List[Any]) -> List[Any]:
         pass
@@ -55,32 +185,59 @@ class InMemoryRepository(CrudRepository):
         pass
 
     async def find_by_id(self, meta, uuid: Any) -> Optional[Any]:
-        return cache.get(uuid)
+        store = _store_for(meta.get("entity_model"))
+        if store is not None:
+            return store.get(uuid)
+        entity = _entities_of(meta.get("entity_model")).get(uuid)
+        return dict(entity) if isinstance(entity, dict) else entity
+
+    async def find_all_by_ids(self, meta, ids: List[Any]) -> List[Optional[Any]]:
+        return [await self.find_by_id(meta, uuid) for uuid in ids]
 
     async def find_all_by_criteria(self, meta, criteria: Any) -> Optional[Any]:
-        entities = []
-        for uuid in cache:
-            if cache[uuid][criteria["key"]] == criteria["value"]:
-                cache[uuid]['technical_id'] = uuid
-                entities.append(cache[uuid])
-        return entities
+        max_results = meta.get("max_results")
+        if callable(criteria):
+            # A compiled query predicate
+            return list(islice((entity for entity in await self.find_all(meta) if criteria(entity)), max_results))
+        store = _store_for(meta.get("entity_model"))
+        if store is not None:
+            return store.find([{"field": criteria["key"], "operator": "EQUALS", "value": criteria["value"]}])[
+                :max_results]
+        return list(islice((_with_id(uuid, entity) for uuid, entity in _entities_of(meta.get("entity_model")).items()
+                            if entity.get(criteria["key"]) == criteria["value"]), max_results))
+
+    async def aggregate(self, meta, aggregations: Any, group_by: List[str] = None,
+                        filters: List[Any] = None) -> List[Any]:
+        """Aggregations as in common.service.aggregation, evaluated on the columns for columnar models."""
+        store = _store_for(meta.get("entity_model"))
+        if store is not None:
+            return store.aggregate(aggregations, group_by, filters)
+        # Aggregations only read the entities, no copies needed
+        return aggregate_in_memory(_entities_of(meta.get("entity_model")).values(), aggregations, group_by, filters)
 
     async def save(self, meta, entity: Any) -> Any:
         uuid = str(generate_uuid())
-        cache[uuid] = entity
+        _put(uuid, entity, meta.get("entity_model"))
         return uuid
 
-    async def save_all(self, meta, entities: List[Any]) -> bool:
-        pass
+    async def save_all(self, meta, entities: List[Any]) -> List[Any]:
+        return [await self.save(meta, entity) for entity in entities]
 
     async def update(self, meta, id, entity: Any) -> Any:
-        cache[id] = entity
+        if entity is None:
+            # A transition without new data, there is no workflow to run in memory
+            return id
+        _put(id, entity, meta.get("entity_model"))
+        return id
 
     async def update_all(self, meta, entities: List[Any]) -> List[Any]:
-        pass
+        for entity in entities:
+            _put(entity["technical_id"], {key: value for key, value in entity.items() if key != "technical_id"},
+                 meta.get("entity_model"))
+        return entities
 
     async def delete(self, meta, entity: Any) -> None:
-        pass
+        return await self.delete_by_id(meta, entity["technical_id"])
 
     async def delete_by_id(self, meta, technical_id: Any) -> None:
-        del cache[technical_id]
+        _delete(technical_id, meta.get("entity_model"))
@@ -0,0 +1,187 @@
+"""
+Optional persistence for InMemoryRepository: every mutation is appended to a write-ahead log and the whole store
+is periodically written to a compact snapshot, after which the log starts over. On start the snapshot is read
+through a memory map, one entity per line, and only the log written since is replayed.
+"""
+import asyncio
+import glob
+import json
+import logging
+import mmap
+import os
+import time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+WAL_FILE = "wal.log"
+
+
+class InMemoryPersistence:
+
+    def __init__(self, directory: str, snapshot_interval: float = 300, snapshot_wal_records: int = 10000,
+                 fsync: bool = False):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_wal_records = snapshot_wal_records
+        self.fsync = fsync
+        self.seq = 0
+        self._wal = None
+        self._wal_records = 0
+        self._last_snapshot = time.monotonic()
+        self._snapshot_task = None
+        self._items = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load(self, put: Callable[[Any, Any, Optional[str]], None], delete: Callable[[Any, Optional[str]], None],
+             items: Callable[[], Iterable[Tuple[Any, Any, Optional[str]]]]) -> None:
+        """
+        Restore the store through `put` and `delete` (technical id, entity, entity model) from the snapshot and
+        the log written after it, then open the log for appending. `items` returns a point-in-time copy of the
+        store for later snapshots, which is iterated in a worker thread.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.monotonic()
+        self._items = items
+        snapshot_seq, loaded = self._load_snapshot(put)
+        self.seq = snapshot_seq
+        # Logs rotated by snapshots that did not complete come first, then the current one
+        replayed = 0
+        for path in self._rotated_logs() + [self._path(WAL_FILE)]:
+            replayed += self._replay_wal(path, put, delete, snapshot_seq)
+        self._wal = open(self._path(WAL_FILE), "a", encoding="utf-8")
+        self._wal_records = replayed
+        logger.info(f"Loaded {loaded} in-memory entities and replayed {replayed} log records "
+                    f"in {time.monotonic() - start:.2f}s from {self.directory}")
+
+    def _load_snapshot(self, put) -> Tuple[int, int]:
+        try:
+            file = open(self._path(SNAPSHOT_FILE), "rb")
+        except FileNotFoundError:
+            return 0, 0
+        loaded = 0
+        with file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return 0, 0
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                header = json.loads(mapped.readline())
+                for line in iter(mapped.readline, b""):
+                    # [technical id, entity, entity model], older snapshots have no model
+                    technical_id, entity, *entity_model = json.loads(line)
+                    put(technical_id, entity, entity_model[0] if entity_model else None)
+                    loaded += 1
+        return header.get("seq", 0), loaded
+
+    def _replay_wal(self, path: str, put, delete, after_seq: int) -> int:
+        replayed = 0
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last record from a crash mid-write
+                        logger.warning(f"Skipping unreadable in-memory log record in {path}")
+                        continue
+                    self.seq = max(self.seq, record["seq"])
+                    if record["seq"] <= after_seq:
+                        continue
+                    if record["op"] == "put":
+                        put(record["id"], record["entity"], record.get("model"))
+                    else:
+                        delete(record["id"], record.get("model"))
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        return replayed
+
+    def log_put(self, technical_id: Any, entity: Any, entity_model: Optional[str] = None) -> None:
+        self._append({"op": "put", "id": technical_id, "entity": entity, "model": entity_model})
+
+    def log_delete(self, technical_id: Any, entity_model: Optional[str] = None) -> None:
+        self._append({"op": "delete", "id": technical_id, "model": entity_model})
+
+    def _append(self, record: dict) -> None:
+        self.seq += 1
+        record["seq"] = self.seq
+        self._wal.write(json.dumps(record, default=str) + "\n")
+        self._wal.flush()
+        if self.fsync:
+            os.fsync(self._wal.fileno())
+        self._wal_records += 1
+        if self._snapshot_task is None and (
+                self._wal_records >= self.snapshot_wal_records
+                or time.monotonic() - self._last_snapshot >= self.snapshot_interval):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # No event loop to write it in the background, e.g. a script filling the store
+                self._snapshot_sync()
+            else:
+                self._snapshot_task = loop.create_task(self.snapshot())
+
+    def _rotate(self) -> Tuple[int, Iterable[Tuple[Any, Any, Optional[str]]]]:
+        seq = self.seq
+        # Copied right away, as the live store keeps changing while the snapshot is written
+        items = self._items()
+        # Rotate the log: records after `seq` go to a fresh log, the old one is kept until a snapshot is safe
+        self._wal.close()
+        os.replace(self._path(WAL_FILE), self._path(f"{WAL_FILE}.{seq}"))
+        self._wal = open(self._path(WAL_FILE), "a", encoding="utf-8")
+        self._wal_records = 0
+        return seq, items
+
+    async def snapshot(self) -> None:
+        """Write the store to a new snapshot and drop the logs whose records it contains."""
+        try:
+            seq, items = self._rotate()
+            written = await asyncio.to_thread(self._write_snapshot, items, seq)
+            logger.info(f"Wrote in-memory snapshot of {written} entities at log position {seq}")
+        except Exception as e:
+            logger.error(f"In-memory snapshot failed: {e}")
+        finally:
+            self._last_snapshot = time.monotonic()
+            self._snapshot_task = None
+
+    def _snapshot_sync(self) -> None:
+        try:
+            seq, items = self._rotate()
+            written = self._write_snapshot(items, seq)
+            logger.info(f"Wrote in-memory snapshot of {written} entities at log position {seq}")
+        except Exception as e:
+            logger.error(f"In-memory snapshot failed: {e}")
+        finally:
+            self._last_snapshot = time.monotonic()
+
+    def _write_snapshot(self, items: Iterable[Tuple[Any, Any, Optional[str]]], seq: int) -> int:
+        lines = [json.dumps(item, default=str) for item in items]
+        tmp_path = self._path(f"{SNAPSHOT_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"seq": seq, "entities": len(lines)}) + "\n")
+            for line in lines:
+                file.write(line + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self._path(SNAPSHOT_FILE))
+        # Logs rotated by earlier snapshots that failed are contained in this one as well
+        for path in self._rotated_logs():
+            if int(path.rsplit(".", 1)[1]) <= seq:
+                os.remove(path)
+        return len(lines)
+
+    def _rotated_logs(self) -> List[str]:
+        """Logs rotated by snapshots that have not completed, oldest first."""
+        return sorted(glob.glob(self._path(f"{WAL_FILE}.*")), key=lambda path: int(path.rsplit(".", 1)[1]))
+
+    async def close(self) -> None:
+        """Wait for a snapshot in progress, then flush, sync and close the log."""
+        if self._snapshot_task is not None:
+            await self._snapshot_task
+        if self._wal is not None:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._wal.close()
+            self._wal = None
@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+
+from common.config.config import CYODA_LIMITER_ENABLED, CYODA_LIMITER_INITIAL, CYODA_LIMITER_MIN, \
+    CYODA_LIMITER_MAX, CYODA_LIMITER_MAX_QUEUE, CYODA_LIMITER_MAX_WAIT
+from common.exception.exceptions import LoadSheddingException
+from common.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Outcome:
+    __slots__ = ("dropped",)
+
+    def __init__(self):
+        self.dropped = False
+
+    def drop(self) -> None:
+        """Mark the call as overloaded (timeout, 5xx, 429) so the limiter backs off."""
+        self.dropped = True
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limiter that learns the backend's latency-optimal concurrency (gradient + AIMD).
+
+    While round trips stay within `tolerance` x the observed minimum RTT and the limit is in use, the limit grows
+    by about sqrt(limit); as latency rises it shrinks by the RTT gradient, and dropped calls cut it multiplicatively.
+    Calls over the limit wait in a queue of at most `max_queue`, served by priority then arrival order, for up to
+    `max_wait` seconds, after which they are shed with a LoadSheddingException.
+    """
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int, max_limit: int, max_queue: int,
+                 max_wait: float, tolerance: float = 2.0, smoothing: float = 0.2, backoff_ratio: float = 0.9,
+                 min_rtt_window: int = 500):
+        self.name = name
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff_ratio = backoff_ratio
+        self.min_rtt_window = min_rtt_window
+        self.min_rtt = None
+        self._samples = 0
+        self.in_flight = 0
+        self._queued = 0
+        self._waiters = []  # heap of (priority, sequence, future), lower priority values first
+        self._sequence = itertools.count()
+
+    async def acquire(self, timeout: float = None, priority: int = 0) -> None:
+        if self.in_flight < int(self.limit) and not self._queued:
+            self.in_flight += 1
+            return
+        if self._queued >= self.max_queue:
+            self._shed("queue_full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(future):
+                return
+            self._shed("timeout")
+        except asyncio.CancelledError:
+            if not self._abandon(future):
+                self.release(0, sample=False)
+            raise
+
+    def _abandon(self, future) -> bool:
+        """Leave the queue; returns False when the slot had already been granted."""
+        if future.done():
+            return False
+        # Left in the heap and skipped once popped
+        future.cancel()
+        self._queued -= 1
+        return True
+
+    def _shed(self, reason: str):
+        metrics.load_shed.inc(limiter=self.name, reason=reason)
+        logger.warning(f"Shedding {self.name} call ({reason}): limit {int(self.limit)}, "
+                       f"{self.in_flight} in flight, {self._queued} queued")
+        raise LoadSheddingException(f"{self.name} is overloaded, try again later")
+
+    def release(self, rtt: float, dropped: bool = False, sample: bool = True) -> None:
+        self.in_flight -= 1
+        if dropped:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        elif sample:
+            self._on_sample(rtt)
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._queued -= 1
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _on_sample(self, rtt: float) -> None:
+        self._samples += 1
+        if self.min_rtt is None or rtt < self.min_rtt or self._samples % self.min_rtt_window == 0:
+            # Periodically re-learn the no-load latency so the limiter follows backend changes
+            self.min_rtt = rtt
+        gradient = max(0.5, min(1.0, self.tolerance * self.min_rtt / rtt)) if rtt > 0 else 1.0
+        # Only grow while the limit is actually used, otherwise an idle app would drift up to max_limit
+        headroom = math.sqrt(self.limit) if self.in_flight + 1 >= self.limit / 2 else 0
+        target = self.limit * gradient + headroom
+        self.limit = min(self.max_limit, max(self.min_limit,
+                                             self.limit * (1 - self.smoothing) + target * self.smoothing))
+
+    @asynccontextmanager
+    async def slot(self, timeout: float = None, priority: int = 0):
+        """Hold a slot for the block, timing it; exceptions count as dropped calls."""
+        await self.acquire(timeout, priority)
+        outcome = _Outcome()
+        start = time.monotonic()
+        sample = True
+        try:
+            yield outcome
+        except asyncio.CancelledError:
+            sample = False
+            raise
+        except Exception:
+            outcome.drop()
+            raise
+        finally:
+            self.release(time.monotonic() - start, outcome.dropped, sample)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "min_rtt": self.min_rtt,
+        }
+
+
+cyoda_limiter = AdaptiveLimiter(
+    "cyoda", initial_limit=CYODA_LIMITER_INITIAL, min_limit=CYODA_LIMITER_MIN, max_limit=CYODA_LIMITER_MAX,
+    max_queue=CYODA_LIMITER_MAX_QUEUE, max_wait=CYODA_LIMITER_MAX_WAIT) if CYODA_LIMITER_ENABLED == "true" else None
+
+if cyoda_limiter:
+    metrics.concurrency_limit.add_function(lambda: {
+        ("cyoda", "limit"): int(cyoda_limiter.limit),
+        ("cyoda", "in_flight"): cyoda_limiter.in_flight,
+    })
+    metrics.queue_depth.add_function(lambda: {("cyoda_limiter",): cyoda_limiter.queued})
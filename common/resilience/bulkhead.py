@@ -0,0 +1,185 @@
+"""
+Bulkheads: separate concurrency pools per entity model and per traffic class (HTTP API, gRPC processor,
+startup init), so a slow model or a flood of processor work cannot take all outbound capacity. Waiters are
+served by traffic class priority, API first, and the same priority orders the shared Cyoda limiter queue.
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from common.config.config import BULKHEAD_ENABLED, BULKHEAD_CLASS_LIMITS, BULKHEAD_MODEL_LIMIT, BULKHEAD_MODEL_LIMITS
+from common.monitoring import metrics
+from common.monitoring.profiling import register_component
+from common.resilience import deadline
+from common.util.class_decorators import wrap_public_coroutines
+
+API, INIT, PROCESSOR = "api", "init", "processor"
+# Lower value is served first
+PRIORITIES = {API: 0, INIT: 1, PROCESSOR: 2}
+
+# Work outside an API request or the startup init counts as background processing
+_traffic_class: ContextVar[str] = ContextVar("traffic_class", default=PROCESSOR)
+# Set while a bulkhead slot is held, so nested repository calls do not take a second one
+_inside: ContextVar[bool] = ContextVar("bulkhead_inside", default=False)
+
+
+def current_traffic_class() -> str:
+    return _traffic_class.get()
+
+
+def current_priority() -> int:
+    return PRIORITIES.get(_traffic_class.get(), PRIORITIES[PROCESSOR])
+
+
+def set_traffic_class(name: str) -> None:
+    """Set the traffic class for the rest of the current context."""
+    _traffic_class.set(name)
+
+
+@contextmanager
+def traffic_class(name: str):
+    """Run the block as the given traffic class."""
+    token = _traffic_class.set(name)
+    try:
+        yield
+    finally:
+        _traffic_class.reset(token)
+
+
+class _Pool:
+    """Counting semaphore whose waiters are woken by priority, then arrival order."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.queued = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority: int) -> None:
+        if self.in_flight < self.limit and not self.queued:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the cancellation, pass it on
+                self.release()
+            else:
+                # Left in the heap and skipped once popped
+                future.cancel()
+                self.queued -= 1
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.queued -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+
+def _parse_limits(value: str) -> dict:
+    # "api=64,processor=32" -> {"api": 64, "processor": 32}
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, limit = item.partition("=")
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+class Bulkheads:
+    """Concurrency pools per traffic class and per entity model; a call holds one slot of each."""
+
+    def __init__(self, class_limits: dict, model_limit: int, model_limits: dict = None):
+        self.class_pools = {name: _Pool(name, limit) for name, limit in class_limits.items()}
+        self.model_limit = model_limit
+        self.model_limits = model_limits or {}
+        self.model_pools = {}
+
+    def _model_pool(self, entity_model: str) -> _Pool:
+        pool = self.model_pools.get(entity_model)
+        if pool is None:
+            pool = self.model_pools[entity_model] = _Pool(
+                entity_model, self.model_limits.get(entity_model, self.model_limit))
+        return pool
+
+    @asynccontextmanager
+    async def enter(self, entity_model: str = None):
+        """Hold a slot of the model's pool and of the current traffic class' pool for the block."""
+        if _inside.get():
+            yield
+            return
+        priority = current_priority()
+        # Always model first, then class, so two calls never wait on each other's pools
+        pools = [pool for pool in (self._model_pool(entity_model) if entity_model else None,
+                                   self.class_pools.get(current_traffic_class())) if pool is not None]
+        acquired = []
+        token = _inside.set(True)
+        try:
+            for pool in pools:
+                await deadline.wait_for(pool.acquire(priority), f"{pool.name} bulkhead")
+                acquired.append(pool)
+            yield
+        finally:
+            _inside.reset(token)
+            for pool in reversed(acquired):
+                pool.release()
+
+    def stats(self) -> dict:
+        return {
+            f"{kind}:{name}": {"limit": pool.limit, "in_flight": pool.in_flight, "queued": pool.queued}
+            for kind, pools in (("class", self.class_pools), ("model", self.model_pools))
+            for name, pool in pools.items()
+        }
+
+
+bulkheads = Bulkheads(_parse_limits(BULKHEAD_CLASS_LIMITS), BULKHEAD_MODEL_LIMIT,
+                      _parse_limits(BULKHEAD_MODEL_LIMITS)) if BULKHEAD_ENABLED == "true" else None
+
+
+def bulkhead_methods(cls):
+    """Class decorator running every public async repository method inside the bulkheads of its meta."""
+    if bulkheads is None:
+        return cls
+    return wrap_public_coroutines(cls, lambda method, name: _isolated(method))
+
+
+def _isolated(method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        meta = args[1] if len(args) > 1 and isinstance(args[1], dict) else kwargs.get("meta")
+        async with bulkheads.enter(meta.get("entity_model") if isinstance(meta, dict) else None):
+            return await method(*args, **kwargs)
+
+    return wrapper
+
+
+def register_request_traffic_class(app) -> None:
+    """Run every Quart request as API traffic."""
+
+    @app.before_request
+    async def _set_traffic_class():
+        # Set for the whole request task, whose context is discarded once the request is done
+        set_traffic_class(API)
+
+
+if bulkheads:
+    metrics.concurrency_limit.add_function(lambda: {
+        (f"bulkhead_{name}", value): stats[value]
+        for name, stats in bulkheads.stats().items() for value in ("limit", "in_flight")
+    })
+    metrics.queue_depth.add_function(
+        lambda: {(f"bulkhead_{name}",): stats["queued"] for name, stats in bulkheads.stats().items()})
+    register_component("bulkhead_pools", lambda: bulkheads.model_pools)
@@ -0,0 +1,100 @@
+"""
+Deadline propagation: the time budget of the current API request or processor event, kept in a context variable
+so every downstream call (Cyoda REST, snapshot polling, AI) can shrink its timeout and stop once it is spent.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from common.config.config import REQUEST_DEADLINE
+from common.exception.exceptions import DeadlineExceededException
+
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# Absolute time.monotonic() value after which the caller has given up
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None when there is no deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(operation: str = "operation") -> None:
+    """Raise DeadlineExceededException when the current deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceededException(f"Deadline exceeded before {operation}")
+
+
+def timeout(default: float, operation: str = "operation") -> float:
+    """The default timeout shrunk to the time left; raises when nothing is left."""
+    check(operation)
+    left = remaining()
+    return default if left is None else min(default, left)
+
+
+def clear() -> None:
+    """Drop the deadline of the current context, e.g. for shared work that outlives any single caller."""
+    _deadline.set(None)
+
+
+@contextmanager
+def scope(seconds: Optional[float]):
+    """Run the block with a deadline `seconds` from now, never extending an enclosing deadline."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+async def wait_for(awaitable, operation: str = "operation"):
+    """Await with the time left as timeout, raising DeadlineExceededException when it runs out."""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    check(operation)
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceededException(f"Deadline exceeded while waiting for {operation}")
+
+
+def exempt(route):
+    """Mark a Quart route (e.g. a long-lived stream) as not bound by the default request deadline."""
+    route.deadline_exempt = True
+    return route
+
+
+def register_request_deadline(app) -> None:
+    """
+    Give every Quart request a deadline: REQUEST_DEADLINE, or the X-Request-Timeout header (seconds) when the
+    client sends a shorter one. Routes marked with @exempt only get a deadline from the header.
+    """
+    from quart import request
+
+    @app.before_request
+    async def _set_request_deadline():
+        view = app.view_functions.get(request.endpoint)
+        seconds = None if getattr(view, "deadline_exempt", False) else REQUEST_DEADLINE
+        header = request.headers.get(DEADLINE_HEADER)
+        if header:
+            try:
+                requested = float(header)
+            except ValueError:
+                requested = None
+            if requested is not None:
+                # Clients may only shorten the server-side cap, never extend it
+                seconds = min(requested, seconds) if seconds and seconds > 0 else requested
+        if seconds and seconds > 0:
+            # Set for the whole request task, whose context is discarded once the request is done
+            _deadline.set(time.monotonic() + seconds)
@@ -0,0 +1,227 @@
+"""
+Outbound request policies layered around send_request: retries, per-host circuit breakers and hedged reads.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+from common.config.config import RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, CIRCUIT_BREAKER_ENABLED, \
+    CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET_TIMEOUT, HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES
+from common.exception.exceptions import CircuitOpenException, LoadSheddingException
+from common.monitoring import metrics
+from common.resilience import deadline
+from common.resilience.adaptive_limiter import cyoda_limiter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+# Raised before the request reached the server, so retrying is safe whatever the method
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetryPolicy:
+    """Retries with exponential backoff and full jitter; non-idempotent calls are only retried when never sent."""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, func, url: str, method: str, idempotent: bool = None):
+        """Await func() until it returns a non-retryable response or the attempts are used up."""
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            attempt += 1
+            last_attempt = attempt >= self.max_attempts
+            error = response = None
+            try:
+                response = await func()
+            except (CircuitOpenException, LoadSheddingException):
+                raise
+            except httpx.TransportError as e:
+                if last_attempt or not (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                    raise
+                error, reason = e, type(e).__name__
+            else:
+                if last_attempt or not idempotent or response["status"] not in RETRYABLE_STATUSES:
+                    return response
+                reason = str(response["status"])
+            delay = self.backoff(attempt - 1)
+            left = deadline.remaining()
+            if left is not None and left <= delay:
+                # The caller's deadline would pass before the retry, hand back what we have
+                if error is not None:
+                    raise error
+                return response
+            metrics.request_retries.inc(host=host, reason=reason)
+            logger.warning(f"{method.upper()} {url} failed ({reason}), retry {attempt}/{self.max_attempts - 1} "
+                           f"in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+class _CallOutcome:
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self) -> None:
+        self.failed = True
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker: opens after `failure_threshold` consecutive failures and fails fast for
+    `reset_timeout` seconds, then lets a single probe through (half-open) to decide whether to close again.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, host: str, failure_threshold: int, reset_timeout: float):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenException when calls should fail fast; returns True for a half-open probe."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.CLOSED:
+            return False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        raise CircuitOpenException(f"Circuit for {self.host} is open, failing fast")
+
+    def record(self, failed: bool, probe: bool) -> None:
+        if probe:
+            self._probing = False
+        if not failed:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.host} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            return
+        self.failures += 1
+        if probe or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit for {self.host} opened after {self.failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @asynccontextmanager
+    async def guard(self):
+        """Run the block through the breaker; transport errors and outcome.fail() count as failures."""
+        probe = self.before_call()
+        outcome = _CallOutcome()
+        try:
+            yield outcome
+        except httpx.TransportError:
+            self.record(True, probe)
+            raise
+        except BaseException:
+            # Cancellations and load shedding say nothing about the host, only release the probe
+            if probe:
+                self._probing = False
+            raise
+        self.record(outcome.failed, probe)
+
+
+_circuit_breakers = {}
+
+
+def circuit_breaker_for(url: str):
+    """Return the circuit breaker of the url's host, or None when circuit breaking is disabled."""
+    if CIRCUIT_BREAKER_ENABLED != "true":
+        return None
+    host = urlsplit(url).netloc
+    breaker = _circuit_breakers.get(host)
+    if breaker is None:
+        breaker = _circuit_breakers[host] = CircuitBreaker(host, CIRCUIT_BREAKER_FAILURES,
+                                                           CIRCUIT_BREAKER_RESET_TIMEOUT)
+    return breaker
+
+
+class LatencyTracker:
+    """Rolling window of recent latencies used to derive the hedging delay."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int):
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class HedgePolicy:
+    """
+    Sends a second copy of a read when the first has not answered within the tracked latency percentile and
+    returns whichever succeeds first. Hedging is skipped while the Cyoda limiter is queueing, so it never adds
+    load to an already saturated backend.
+    """
+
+    def __init__(self, percentile: float, min_samples: int):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._trackers = {}
+
+    async def run(self, key: str, func):
+        tracker = self._trackers.setdefault(key, LatencyTracker())
+
+        async def timed_call():
+            start = time.monotonic()
+            response = await func()
+            tracker.record(time.monotonic() - start)
+            return response
+
+        delay = tracker.percentile(self.percentile, self.min_samples)
+        if delay is None or (cyoda_limiter is not None and cyoda_limiter.queued):
+            return await timed_call()
+        tasks = [asyncio.ensure_future(timed_call())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            tasks.append(asyncio.ensure_future(timed_call()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        metrics.hedged_requests.inc(path=key, winner="primary" if task is tasks[0] else "hedge")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+retry_policy = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+hedge_policy = HedgePolicy(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES) if HEDGE_ENABLED == "true" else None
+
+metrics.circuit_state.add_function(
+    lambda: {(host,): int(breaker.state != CircuitBreaker.CLOSED) for host, breaker in _circuit_breakers.items()})
@@ -0,0 +1,166 @@
+"""
+Aggregations over entities: compiled to SQL for Trino, or evaluated in memory for the in-memory repository.
+
+Aggregations are given as {alias: (function, field)}, e.g. {"total": ("count", None), "avg_price": ("avg", "price")}.
+Filters are a list of {"field": ..., "operator": ..., "value": ...} using the Cyoda operator names below,
+combined with AND.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+AGGREGATE_FUNCTIONS = ("count", "sum", "avg", "min", "max")
+
+SQL_OPERATORS = {
+    "EQUALS": "=",
+    "NOT_EQUAL": "<>",
+    "GREATER_THAN": ">",
+    "GREATER_OR_EQUAL": ">=",
+    "LESS_THAN": "<",
+    "LESS_OR_EQUAL": "<=",
+}
+
+PREDICATES = {
+    "EQUALS": lambda value, expected: value == expected,
+    "NOT_EQUAL": lambda value, expected: value is not None and value != expected,
+    "GREATER_THAN": lambda value, expected: value is not None and value > expected,
+    "GREATER_OR_EQUAL": lambda value, expected: value is not None and value >= expected,
+    "LESS_THAN": lambda value, expected: value is not None and value < expected,
+    "LESS_OR_EQUAL": lambda value, expected: value is not None and value <= expected,
+    "IN": lambda value, expected: value in expected,
+    "IS_NULL": lambda value, expected: value is None,
+    "NOT_NULL": lambda value, expected: value is not None,
+}
+
+
+def validate_aggregations(aggregations: Dict[str, Tuple[str, Optional[str]]], filters: Optional[List[dict]]):
+    if not aggregations:
+        raise ValueError("At least one aggregation is required")
+    for alias, (function, field) in aggregations.items():
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unsupported aggregate function '{function}' for '{alias}'")
+        if function != "count" and not field:
+            raise ValueError(f"Aggregate function '{function}' for '{alias}' requires a field")
+    for condition in filters or []:
+        if condition.get("operator") not in PREDICATES:
+            raise ValueError(f"Unsupported filter operator '{condition.get('operator')}'")
+
+
+def quote_identifier(name: str) -> str:
+    return '"%s"' % name.replace('"', '""')
+
+
+def sql_literal(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def _sql_column(field: str) -> str:
+    # Trino names the columns of nested fields its own way, a dotted path cannot be mapped to one
+    if "." in field:
+        raise ValueError(f"Nested field '{field}' is only supported in memory, aggregate a table's own columns")
+    return quote_identifier(field)
+
+
+def _sql_condition(condition: dict) -> str:
+    column = _sql_column(condition["field"])
+    operator = condition["operator"]
+    if operator == "IS_NULL":
+        return f"{column} IS NULL"
+    if operator == "NOT_NULL":
+        return f"{column} IS NOT NULL"
+    if operator == "IN":
+        values = list(condition["value"])
+        if not values:
+            return "FALSE"
+        return f"{column} IN ({', '.join(sql_literal(value) for value in values)})"
+    return f"{column} {SQL_OPERATORS[operator]} {sql_literal(condition['value'])}"
+
+
+def compile_aggregation_sql(table: str, aggregations: Dict[str, Tuple[str, Optional[str]]],
+                            group_by: Optional[List[str]] = None, filters: Optional[List[dict]] = None) -> str:
+    """Build the SELECT ... GROUP BY statement computing the aggregations on the given table."""
+    validate_aggregations(aggregations, filters)
+    group_by = group_by or []
+    columns = [_sql_column(field) for field in group_by]
+    for alias, (function, field) in aggregations.items():
+        argument = _sql_column(field) if field else "*"
+        columns.append(f"{function.upper()}({argument}) AS {quote_identifier(alias)}")
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if filters:
+        query += " WHERE " + " AND ".join(_sql_condition(condition) for condition in filters)
+    if group_by:
+        query += " GROUP BY " + ", ".join(_sql_column(field) for field in group_by)
+    return query
+
+
+def get_field(entity: dict, field: str) -> Any:
+    """Resolve a dotted field path against an entity dict, None when any part is missing."""
+    value = entity
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compile_filters(filters: Optional[List[dict]]):
+    """Compile filters into a single predicate over an entity dict."""
+    checks = [(condition["field"], PREDICATES[condition["operator"]], condition.get("value"))
+              for condition in filters or []]
+
+    def predicate(entity: dict) -> bool:
+        return all(check(get_field(entity, field), expected) for field, check, expected in checks)
+
+    return predicate
+
+
+def aggregate_in_memory(entities: Iterable[dict], aggregations: Dict[str, Tuple[str, Optional[str]]],
+                        group_by: Optional[List[str]] = None, filters: Optional[List[dict]] = None) -> List[dict]:
+    """Evaluate the aggregations in a single pass, with the same result shape as the SQL version."""
+    validate_aggregations(aggregations, filters)
+    group_by = group_by or []
+    predicate = compile_filters(filters)
+    groups = {}
+    for entity in entities:
+        if not predicate(entity):
+            continue
+        key = tuple(get_field(entity, field) for field in group_by)
+        state = groups.get(key)
+        if state is None:
+            state = groups[key] = {alias: [0, 0, None, None] for alias in aggregations}  # count, sum, min, max
+        for alias, (function, field) in aggregations.items():
+            if not field:
+                state[alias][0] += 1
+                continue
+            value = get_field(entity, field)
+            if value is None:
+                continue
+            accumulator = state[alias]
+            accumulator[0] += 1
+            if function in ("sum", "avg"):
+                accumulator[1] += value
+            elif function == "min":
+                accumulator[2] = value if accumulator[2] is None else min(accumulator[2], value)
+            elif function == "max":
+                accumulator[3] = value if accumulator[3] is None else max(accumulator[3], value)
+    if not groups and not group_by:
+        groups[()] = {alias: [0, 0, None, None] for alias in aggregations}
+
+    rows = []
+    for key, state in groups.items():
+        row = dict(zip(group_by, key))
+        for alias, (function, _) in aggregations.items():
+            count, total, minimum, maximum = state[alias]
+            row[alias] = {
+                "count": count,
+                "sum": total if count else None,
+                "avg": total / count if count else None,
+                "min": minimum,
+                "max": maximum,
+            }[function]
+        rows.append(row)
+    return rows
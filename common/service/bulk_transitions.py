@@ -0,0 +1,111 @@
+"""
+Bulk workflow transitions: launch a transition for a stream of entity ids with bounded concurrency and a rate
+limit, reporting progress while it runs.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Union
+
+from common.repository.crud_repository import CrudRepository
+from common.util.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+async def _aiter_ids(ids: Union[Iterable[Any], AsyncIterable[Any]]) -> AsyncIterator[Any]:
+    if hasattr(ids, "__aiter__"):
+        async for technical_id in ids:
+            yield technical_id
+    else:
+        for technical_id in ids:
+            yield technical_id
+
+
+async def launch_transitions(repository: CrudRepository, meta: dict, ids: Union[Iterable[Any], AsyncIterable[Any]],
+                             concurrency: int = 10, rate: float = 0, burst: float = 1,
+                             report_every: int = 100,
+                             resolve_id: Callable[[Any], Awaitable[Any]] = None) -> AsyncIterator[dict]:
+    """
+    Launch meta["update_transition"] for every id through repository.update(meta, id, None), with at most
+    `concurrency` transitions in flight and at most `rate` started per second (0 = unlimited). The ids are read
+    lazily, so an async stream is consumed only as fast as transitions are launched. `resolve_id` is awaited to map
+    each id to the technical id to transition, reports keep the ids as given.
+
+    Yields a progress report after every `report_every` completed ids and a final one with "finished": True:
+    {"done", "succeeded", "failed", "elapsed", "failures": [{"technical_id", "error"}, ...] since the last report},
+    the final report also has an "error" when reading the ids failed.
+    Closing the generator early stops launching and cancels the transitions in flight.
+    """
+    bucket = TokenBucket(rate, burst)
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue()
+
+    async def stop_workers():
+        for _ in range(concurrency):
+            await pending.put(_DONE)
+
+    async def feed():
+        try:
+            async for technical_id in _aiter_ids(ids):
+                await pending.put(technical_id)
+        except Exception:
+            # Let the workers finish what was read, the error is reported at the end; a cancellation stops all
+            await stop_workers()
+            raise
+        await stop_workers()
+
+    async def work():
+        while (technical_id := await pending.get()) is not _DONE:
+            await bucket.acquire()
+            try:
+                await repository.update(dict(meta), await resolve_id(technical_id) if resolve_id else technical_id,
+                                        None)
+                await results.put((technical_id, None))
+            except Exception as e:
+                await results.put((technical_id, e))
+        await results.put(_DONE)
+
+    loop = asyncio.get_running_loop()
+    feeder = loop.create_task(feed())
+    workers = [loop.create_task(work()) for _ in range(concurrency)]
+    start = time.monotonic()
+    done = succeeded = 0
+    failures = []
+    running = concurrency
+
+    def report(finished: bool = False) -> dict:
+        nonlocal failures
+        progress = {"done": done, "succeeded": succeeded, "failed": done - succeeded,
+                    "elapsed": round(time.monotonic() - start, 3), "failures": failures, "finished": finished}
+        failures = []
+        return progress
+
+    try:
+        while running:
+            result = await results.get()
+            if result is _DONE:
+                running -= 1
+                continue
+            technical_id, error = result
+            done += 1
+            if error is None:
+                succeeded += 1
+            else:
+                failures.append({"technical_id": technical_id, "error": str(error)})
+            if done % report_every == 0:
+                yield report()
+        logger.info(f"Launched {meta.get('update_transition')} for {done} {meta.get('entity_model')} entities, "
+                    f"{done - succeeded} failed")
+        final = report(finished=True)
+        # A failing id stream ends the run early, the final report says why
+        if feeder.done() and not feeder.cancelled() and feeder.exception() is not None:
+            logger.error(f"Reading ids for {meta.get('update_transition')} transitions failed: {feeder.exception()}")
+            final["error"] = f"Reading ids failed: {feeder.exception()}"
+        yield final
+    finally:
+        for task in [feeder, *workers]:
+            task.cancel()
+        await asyncio.gather(feeder, *workers, return_exceptions=True)
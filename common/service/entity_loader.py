@@ -0,0 +1,89 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any, Optional
+
+from common.repository.crud_repository import CrudRepository
+from common.resilience import bulkhead, deadline
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    __slots__ = ("meta", "futures", "handle", "context")
+
+    def __init__(self, meta, traffic_class: str):
+        self.meta = meta
+        self.futures = {}  # technical_id -> future shared by every caller asking for it
+        self.handle = None
+        # The fetch runs in a copy of the first caller's context, keeping its trace and Server-Timing collector,
+        # but without its deadline, as the other callers are waiting for the same fetch
+        self.context = contextvars.copy_context()
+        self.context.run(bulkhead.set_traffic_class, traffic_class)
+        self.context.run(deadline.clear)
+
+
+class EntityLoader:
+    """
+    DataLoader-style batching of find_by_id: ids requested for the same model and version within `window`
+    seconds (0 = the current event loop tick) are de-duplicated and fetched with one find_all_by_ids call,
+    whose results are handed back to each awaiting caller.
+
+    Cyoda has no bulk read by technical id, so CyodaRepository.find_all_by_ids still sends one GET per distinct
+    id: the loader saves the duplicate reads, not round trips, and is opt-in (ENTITY_LOADER_ENABLED).
+    """
+
+    def __init__(self, repository: CrudRepository, window: float = 0, max_batch: int = 100):
+        self.repository = repository
+        self.window = window
+        self.max_batch = max_batch
+        self._batches = {}
+        self._tasks = set()
+
+    async def load(self, meta: dict, technical_id: Any) -> Optional[Any]:
+        # API and background callers are batched separately so each batch keeps its caller's priority
+        key = (meta.get("token"), meta.get("entity_model"), meta.get("entity_version"),
+               bulkhead.current_traffic_class())
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(meta, key[3])
+            self._schedule(key, batch)
+        future = batch.futures.get(technical_id)
+        if future is None:
+            future = batch.futures[technical_id] = asyncio.get_running_loop().create_future()
+            if len(batch.futures) >= self.max_batch:
+                batch.handle.cancel()
+                self._dispatch(key, batch)
+        # Shielded: a caller giving up must not cancel the result other callers are waiting for
+        return await deadline.wait_for(asyncio.shield(future), f"entity {technical_id}")
+
+    def _schedule(self, key, batch: _Batch) -> None:
+        loop = asyncio.get_running_loop()
+        if self.window > 0:
+            batch.handle = loop.call_later(self.window, self._dispatch, key, batch)
+        else:
+            batch.handle = loop.call_soon(self._dispatch, key, batch)
+
+    def _dispatch(self, key, batch: _Batch) -> None:
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+        task = asyncio.get_running_loop().create_task(self._fetch(batch), context=batch.context)
+        # Keep a reference until done, the event loop only holds weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: _Batch) -> None:
+        ids = list(batch.futures)
+        try:
+            results = await self.repository.find_all_by_ids(batch.meta, ids)
+        except Exception as e:
+            logger.error(f"Batch fetch of {len(ids)} {batch.meta.get('entity_model')} entities failed: {e}")
+            results = [e] * len(ids)
+        for technical_id, result in zip(ids, results):
+            future = batch.futures[technical_id]
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Any
+from typing import List, Any, AsyncIterator
 
 class EntityService(ABC):
 
@@ -8,11 +8,21 @@ class EntityService(ABC):
         """Retrieve a single item based on its ID."""
         pass
 
+    @abstractmethod
+    async def get_items_by_ids(self, token: str, entity_model: str, entity_version: str, ids: List[str]) -> List[Any]:
+        """Retrieve the items with the given IDs, None for missing ones."""
+        pass
+
     @abstractmethod
     async def get_items(self, token: str, entity_model: str, entity_version: str) -> List[Any]:
         """Retrieve multiple items based on their IDs."""
         pass
 
+    @abstractmethod
+    def iter_items(self, token: str, entity_model: str, entity_version: str) -> AsyncIterator[Any]:
+        """Yield all items of the model one by one as they are read."""
+        pass
+
     @abstractmethod
     async def get_single_item_by_condition(self, token: str, entity_model: str, entity_version: str, condition: Any) -> List[Any]:
         """Retrieve multiple items based on their IDs."""
@@ -23,6 +33,29 @@ class EntityService(ABC):
         """Retrieve multiple items based on their IDs."""
         pass
 
+    @abstractmethod
+    async def get_items_by_query(self, token: str, entity_model: str, entity_version: str, query: Any) -> List[Any]:
+        """Retrieve the items matching a common.service.query.Query."""
+        pass
+
+    @abstractmethod
+    async def count_items(self, token: str, entity_model: str, entity_version: str, condition: Any = None) -> int:
+        """Count the items matching the condition, all items by default."""
+        pass
+
+    @abstractmethod
+    async def launch_transitions(self, token: str, entity_model: str, entity_version: str, technical_ids: Any,
+                                 transition: str = None, concurrency: int = None,
+                                 rate: float = None) -> AsyncIterator[Any]:
+        """Launch a workflow transition for each of the IDs, yielding progress reports."""
+        yield
+
+    @abstractmethod
+    async def delete_items(self, token: str, entity_model: str, entity_version: str, technical_ids: List[str],
+                           meta: Any = None) -> List[Any]:
+        """Delete the items with the given IDs, reporting the outcome per ID."""
+        pass
+
     @abstractmethod
     async def add_item(self, token: str, entity_model: str, entity_version: str, entity: Any) -> Any:
         """Add a new item to the repository."""
@@ -31,4 +64,10 @@ class EntityService(ABC):
     @abstractmethod
     async def update_item(self, token: str, entity_model: str, entity_version: str, id: str, entity: Any, meta: Any) -> Any:
         """Update an existing item in the repository."""
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def aggregate(self, token: str, entity_model: str, entity_version: str, aggregations: Any,
+                        group_by: List[str] = None, filters: List[Any] = None) -> List[Any]:
+        """Compute count/sum/avg/min/max aggregations, optionally grouped and filtered."""
+        pass
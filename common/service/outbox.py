@@ -0,0 +1,276 @@
+"""
+Durable local outbox for new entities: add_item appends the entity to an append-only log and returns a
+provisional id at once, while a background drainer saves the log in bulk and maps provisional ids to real ones.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+
+from common.exception.exceptions import EntityRejectedException
+from common.monitoring import metrics
+from common.repository.crud_repository import CrudRepository
+from common.resilience import bulkhead, deadline
+
+logger = logging.getLogger(__name__)
+
+FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER = "always", "interval", "never"
+
+
+class Outbox:
+    """
+    File-backed outbox. Every entity is appended to `path` as an "add" record before add_item returns; a "done"
+    record with the real id follows once the drainer saved it, so after a crash the adds without a "done" are
+    replayed. `fsync` is "always" (before returning), "interval" (at most every `fsync_interval` seconds) or
+    "never" (left to the OS). An entity the repository rejects (EntityRejectedException) is not retried but
+    moved to a "dead" record, and waiting for its id raises. Provisional ids stay valid across restarts, the
+    `max_resolved` most recent ones: when the backlog is empty and the log has grown well past the id map, it is
+    compacted to one "done" or "dead" record per remembered provisional id.
+    """
+
+    def __init__(self, repository: CrudRepository, path: str, fsync: str = FSYNC_ALWAYS, fsync_interval: float = 1,
+                 batch_size: int = 100, max_resolved: int = 100000):
+        self.repository = repository
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.max_resolved = max_resolved
+        self._pending = OrderedDict()  # provisional id -> add record, oldest first
+        self._resolved = OrderedDict()  # provisional id -> real id, oldest first
+        self._dead = OrderedDict()  # provisional id -> dead record of a rejected entity, oldest first
+        self._waiters = {}  # provisional id -> future set to the real id once saved
+        self._records = 0  # records in the log since it was last compacted
+        self._file = None
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._last_fsync = 0.0
+        self._drainer = None
+        self._token = None
+
+    @property
+    def backlog(self) -> int:
+        return len(self._pending)
+
+    def start(self, token: str) -> None:
+        """Replay the log left by a previous run and start draining it in the background."""
+        self._token = token
+        self._replay()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._pending:
+            logger.info(f"Replaying {len(self._pending)} outbox entries from {self.path}")
+            self._wakeup.set()
+        # The drainer is background work whatever context starts it
+        with bulkhead.traffic_class(bulkhead.PROCESSOR):
+            self._drainer = asyncio.get_running_loop().create_task(self._drain_loop())
+
+    async def stop(self) -> None:
+        """Make a last attempt to drain the backlog, then stop; what is left is replayed on the next start."""
+        if self._drainer is None:
+            return
+        self._drainer.cancel()
+        try:
+            await self._drainer
+        except asyncio.CancelledError:
+            pass
+        self._drainer = None
+        while self._pending:
+            try:
+                await self._drain_once()
+            except Exception as e:
+                logger.error(f"Outbox drain on shutdown failed, {self.backlog} entries left for replay: {e}")
+                break
+        for provisional_id, waiter in self._waiters.items():
+            if not waiter.done():
+                waiter.set_exception(Exception(f"Outbox stopped before entity {provisional_id} was saved"))
+        self._waiters.clear()
+        async with self._lock:
+            await asyncio.to_thread(self._close)
+
+    async def add(self, meta: dict, entity: Any) -> str:
+        """Durably queue the entity for saving and return its provisional id."""
+        record = {"op": "add", "id": str(uuid.uuid4()), "entity_model": meta["entity_model"],
+                  "entity_version": meta["entity_version"], "entity": entity, "ts": time.time()}
+        await self._append([record], lambda: self._enqueue(record))
+        self._wakeup.set()
+        return record["id"]
+
+    def _enqueue(self, record: dict) -> None:
+        self._pending[record["id"]] = record
+
+    def resolve(self, provisional_id: str) -> Optional[str]:
+        """The real id of a drained entity, None while unknown; raises for an entity the repository rejected."""
+        if provisional_id in self._dead:
+            raise self._rejection(self._dead[provisional_id])
+        return self._resolved.get(provisional_id)
+
+    async def wait_resolved(self, technical_id: str) -> str:
+        """
+        The real id behind a provisional id, waiting (within the caller's deadline) while its entity is still
+        queued, so an operation on it never reaches the backend before the entity exists. Other ids are returned
+        as they are.
+        """
+        if technical_id in self._dead:
+            raise self._rejection(self._dead[technical_id])
+        if technical_id in self._pending:
+            waiter = self._waiters.get(technical_id)
+            if waiter is None:
+                waiter = self._waiters[technical_id] = asyncio.get_running_loop().create_future()
+            # Shielded, one caller running out of time must not cancel the wait of the others
+            return await deadline.wait_for(asyncio.shield(waiter), f"saving outbox entity {technical_id}")
+        return self._resolved.get(technical_id, technical_id)
+
+    @staticmethod
+    def _rejection(dead: dict) -> EntityRejectedException:
+        return EntityRejectedException(f"Outbox entity {dead['id']} was rejected: {dead['error']}",
+                                       dead.get("status", 400))
+
+    def _remember(self, mapping: OrderedDict, provisional_id: str, value: Any) -> None:
+        """Record the outcome of a provisional id, forgetting the oldest beyond max_resolved."""
+        mapping[provisional_id] = value
+        while len(self._resolved) + len(self._dead) > self.max_resolved:
+            oldest = self._resolved if self._resolved else self._dead
+            oldest.popitem(last=False)
+
+    def pending_entity(self, provisional_id: str) -> Optional[Any]:
+        record = self._pending.get(provisional_id)
+        return None if record is None else record["entity"]
+
+    async def _append(self, records, on_written=None) -> None:
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        async with self._lock:
+            sync = self.fsync == FSYNC_ALWAYS or (
+                    self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_fsync >= self.fsync_interval)
+            await asyncio.to_thread(self._write, lines, sync)
+            if sync:
+                self._last_fsync = time.monotonic()
+            # Still under the lock, so a concurrent compaction cannot drop records not yet in the backlog
+            self._records += len(records)
+            if on_written is not None:
+                on_written()
+
+    def _write(self, lines: str, sync: bool) -> None:
+        self._file.write(lines)
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def _close(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def _replay(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash mid-write, its add_item never returned
+                        logger.warning(f"Skipping unreadable outbox record in {self.path}")
+                        continue
+                    self._records += 1
+                    if record.get("op") == "add":
+                        self._pending[record["id"]] = record
+                    elif record.get("op") == "done":
+                        self._pending.pop(record["id"], None)
+                        self._remember(self._resolved, record["id"], record["entity_id"])
+                    elif record.get("op") == "dead":
+                        self._pending.pop(record["id"], None)
+                        self._remember(self._dead, record["id"], record)
+        except FileNotFoundError:
+            pass
+
+    async def _drain_loop(self) -> None:
+        failures = 0
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                try:
+                    await self._drain_once()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    delay = min(30.0, 0.5 * 2 ** failures)
+                    logger.error(f"Outbox drain failed ({self.backlog} pending), retrying in {delay:.1f}s: {e}")
+                    await asyncio.sleep(delay)
+
+    async def _drain_once(self) -> None:
+        """Save the oldest batch of one model and record the real ids."""
+        first = next(iter(self._pending.values()))
+        model = (first["entity_model"], first["entity_version"])
+        batch = [record for record in self._pending.values()
+                 if (record["entity_model"], record["entity_version"]) == model][:self.batch_size]
+        meta = await self.repository.get_meta(self._token, *model)
+        await self._save(meta, batch)
+        # Rewriting the id map costs as much as the map, so only once the log holds twice as many records
+        if not self._pending and self._records >= max(2 * (len(self._resolved) + len(self._dead)), self.batch_size):
+            # Shielded, stopping the drainer waits for the lock instead of closing the log mid-compaction
+            await asyncio.shield(self._compact_log())
+
+    async def _compact_log(self) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._compact)
+
+    async def _save(self, meta: dict, batch: list) -> None:
+        try:
+            entity_ids = await self.repository.save_all(meta, [record["entity"] for record in batch])
+        except EntityRejectedException as e:
+            if len(batch) == 1:
+                await self._dead_letter(batch[0], e)
+                return
+            # One entity spoils the bulk save, saved one at a time only the rejected ones are dead-lettered
+            for record in batch:
+                await self._save(meta, [record])
+            return
+        if not isinstance(entity_ids, list) or len(entity_ids) != len(batch):
+            raise Exception(f"Bulk save returned {entity_ids!r} for {len(batch)} entities")
+        done = [{"op": "done", "id": record["id"], "entity_id": entity_id}
+                for record, entity_id in zip(batch, entity_ids)]
+        await self._append(done)
+        for record, entity_id in zip(batch, entity_ids):
+            self._pending.pop(record["id"], None)
+            self._remember(self._resolved, record["id"], entity_id)
+            waiter = self._waiters.pop(record["id"], None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(entity_id)
+
+    async def _dead_letter(self, record: dict, error: EntityRejectedException) -> None:
+        """Take a rejected entity out of the backlog, keeping it in the log for inspection."""
+        logger.error(f"Outbox entity {record['id']} of {record['entity_model']} rejected, not retried: {error}")
+        dead = {**record, "op": "dead", "error": error.message, "status": error.status_code}
+        await self._append([dead])
+        self._pending.pop(record["id"], None)
+        self._remember(self._dead, record["id"], dead)
+        waiter = self._waiters.pop(record["id"], None)
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(self._rejection(dead))
+
+    def _compact(self) -> None:
+        """Replace the log by the "done" and "dead" records of the id map, atomically, once nothing is pending."""
+        if self._pending or self._file is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for provisional_id, entity_id in self._resolved.items():
+                file.write(json.dumps({"op": "done", "id": provisional_id, "entity_id": entity_id}) + "\n")
+            for dead in self._dead.values():
+                file.write(json.dumps(dead, default=str) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._records = len(self._resolved) + len(self._dead)
+
+
+def register_backlog_metric(outbox: Outbox) -> None:
+    metrics.queue_depth.add_function(lambda: {("outbox",): outbox.backlog})
@@ -0,0 +1,294 @@
+"""
+Typed entity queries, compiled once per shape to Cyoda snapshot search JSON and to an in-memory predicate.
+
+    query = Query().where(field("status") == "active", field("price").between(10, 20)) \
+        .where(field("category").isin(["books", "games"]) | field("name").starts_with("A")) \
+        .order_by("price", descending=True).limit(50)
+    items = await entity_service.get_items_by_query(token, "product", ENTITY_VERSION, query)
+
+The shape of a query is its structure without the compared values, so queries differing only in values share a
+cached plan; the values are bound as parameters when the plan runs.
+"""
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from common.config.config import QUERY_PLAN_CACHE_SIZE
+from common.service.aggregation import PREDICATES, get_field
+
+# Local checks for the Cyoda operator types: the aggregation filter predicates, with None (missing) values never
+# matching a comparison, plus the string matchers. IN has its own condition node.
+_CHECKS = {
+    **{operator: check for operator, check in PREDICATES.items() if operator != "IN"},
+    "CONTAINS": lambda value, expected: isinstance(value, str) and expected in value,
+    "STARTS_WITH": lambda value, expected: isinstance(value, str) and value.startswith(expected),
+    "ENDS_WITH": lambda value, expected: isinstance(value, str) and value.endswith(expected),
+}
+
+
+class Condition:
+    """A node of a query's condition tree; combine with & and |."""
+
+    def __and__(self, other: "Condition") -> "Condition":
+        return Group("AND", [self, other])
+
+    def __or__(self, other: "Condition") -> "Condition":
+        return Group("OR", [self, other])
+
+
+class Comparison(Condition):
+    __slots__ = ("path", "operator", "value")
+
+    def __init__(self, path: str, operator: str, value: Any = None):
+        self.path = path
+        self.operator = operator
+        self.value = value
+
+
+class In(Condition):
+    __slots__ = ("path", "values")
+
+    def __init__(self, path: str, values: Sequence[Any]):
+        self.path = path
+        self.values = list(values)
+
+
+class Between(Condition):
+    """Inclusive range, either bound may be None for an open end."""
+    __slots__ = ("path", "low", "high")
+
+    def __init__(self, path: str, low: Any, high: Any):
+        self.path = path
+        self.low = low
+        self.high = high
+
+
+class Group(Condition):
+    __slots__ = ("operator", "conditions")
+
+    def __init__(self, operator: str, conditions: List[Condition]):
+        self.operator = operator
+        # Flatten nested groups of the same operator, a & b & c is one group
+        self.conditions = [nested for condition in conditions for nested in (
+            condition.conditions if isinstance(condition, Group) and condition.operator == operator else [condition])]
+
+
+class Field:
+    """An entity field (dotted path for nested fields) whose comparisons build conditions."""
+    __slots__ = ("path",)
+    __hash__ = None
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __eq__(self, value: Any) -> Condition:
+        return Comparison(self.path, "IS_NULL") if value is None else Comparison(self.path, "EQUALS", value)
+
+    def __ne__(self, value: Any) -> Condition:
+        return Comparison(self.path, "NOT_NULL") if value is None else Comparison(self.path, "NOT_EQUAL", value)
+
+    def __gt__(self, value: Any) -> Condition:
+        return Comparison(self.path, "GREATER_THAN", value)
+
+    def __ge__(self, value: Any) -> Condition:
+        return Comparison(self.path, "GREATER_OR_EQUAL", value)
+
+    def __lt__(self, value: Any) -> Condition:
+        return Comparison(self.path, "LESS_THAN", value)
+
+    def __le__(self, value: Any) -> Condition:
+        return Comparison(self.path, "LESS_OR_EQUAL", value)
+
+    def isin(self, values: Sequence[Any]) -> Condition:
+        return In(self.path, values)
+
+    def between(self, low: Any, high: Any) -> Condition:
+        return Between(self.path, low, high)
+
+    def is_null(self) -> Condition:
+        return Comparison(self.path, "IS_NULL")
+
+    def not_null(self) -> Condition:
+        return Comparison(self.path, "NOT_NULL")
+
+    def contains(self, text: str) -> Condition:
+        return Comparison(self.path, "CONTAINS", text)
+
+    def starts_with(self, text: str) -> Condition:
+        return Comparison(self.path, "STARTS_WITH", text)
+
+    def ends_with(self, text: str) -> Condition:
+        return Comparison(self.path, "ENDS_WITH", text)
+
+
+def field(path: str) -> Field:
+    return Field(path)
+
+
+class Query:
+    """Conditions combined with AND, optional sorting and limit. Builder methods return the query itself."""
+
+    def __init__(self):
+        self.conditions: List[Condition] = []
+        self.sort: List[Tuple[str, bool]] = []
+        self.max_results: Optional[int] = None
+
+    def where(self, *conditions: Condition) -> "Query":
+        self.conditions.extend(conditions)
+        return self
+
+    def order_by(self, path: str, descending: bool = False) -> "Query":
+        self.sort.append((path, descending))
+        return self
+
+    def limit(self, max_results: int) -> "Query":
+        self.max_results = max_results
+        return self
+
+
+# Compilation: the condition tree is walked once per shape into a JSON template and a predicate builder, both
+# reading the compared values from the parameter tuple by position
+
+_PLACEHOLDER = "\x00p%d\x00"
+_PLACEHOLDER_PATTERN = re.compile(r'"\\u0000p(\d+)\\u0000"')
+
+
+def _shape(condition: Condition, params: list) -> tuple:
+    """Structure of the condition with its values moved to `params`."""
+    if isinstance(condition, Group):
+        return ("group", condition.operator, tuple(_shape(nested, params) for nested in condition.conditions))
+    if isinstance(condition, In):
+        params.extend(condition.values)
+        return ("in", condition.path, len(condition.values))
+    if isinstance(condition, Between):
+        bounds = tuple(bound is not None for bound in (condition.low, condition.high))
+        params.extend(bound for bound in (condition.low, condition.high) if bound is not None)
+        return ("between", condition.path, bounds)
+    if isinstance(condition, Comparison):
+        if condition.operator not in _CHECKS:
+            raise ValueError(f"Unsupported operator '{condition.operator}'")
+        has_value = condition.operator not in ("IS_NULL", "NOT_NULL")
+        if has_value:
+            params.append(condition.value)
+        return ("simple", condition.path, condition.operator, has_value)
+    raise TypeError(f"Not a query condition: {condition!r}")
+
+
+class _Compiler:
+    def __init__(self):
+        self.position = 0
+
+    def _next(self) -> int:
+        self.position += 1
+        return self.position - 1
+
+    def cyoda(self, shape: tuple) -> dict:
+        kind = shape[0]
+        if kind == "group":
+            return {"type": "group", "operator": shape[1], "conditions": [self.cyoda(nested) for nested in shape[2]]}
+        if kind == "in":
+            return {"type": "group", "operator": "OR", "conditions": [
+                self._simple(shape[1], "EQUALS", _PLACEHOLDER % self._next()) for _ in range(shape[2])]}
+        if kind == "between":
+            bounds = [self._simple(shape[1], operator, _PLACEHOLDER % self._next())
+                      for operator, present in zip(("GREATER_OR_EQUAL", "LESS_OR_EQUAL"), shape[2]) if present]
+            return {"type": "group", "operator": "AND", "conditions": bounds}
+        _, path, operator, has_value = shape
+        return self._simple(path, operator, _PLACEHOLDER % self._next() if has_value else None)
+
+    @staticmethod
+    def _simple(path: str, operator: str, value: Any) -> dict:
+        return {"type": "simple", "jsonPath": f"$.{path}", "operatorType": operator, "value": value}
+
+    def predicate(self, shape: tuple) -> Callable[[Any, tuple], bool]:
+        kind = shape[0]
+        if kind == "group":
+            children = [self.predicate(nested) for nested in shape[2]]
+            if shape[1] == "AND":
+                return lambda entity, params: all(child(entity, params) for child in children)
+            return lambda entity, params: any(child(entity, params) for child in children)
+        if kind == "in":
+            path, start = shape[1], self.position
+            self.position += shape[2]
+            end = self.position
+            return lambda entity, params: get_field(entity, path) in params[start:end]
+        if kind == "between":
+            path = shape[1]
+            low = self._next() if shape[2][0] else None
+            high = self._next() if shape[2][1] else None
+
+            def between(entity, params):
+                value = get_field(entity, path)
+                return value is not None and (low is None or value >= params[low]) and \
+                    (high is None or value <= params[high])
+
+            return between
+        _, path, operator, has_value = shape
+        check = _CHECKS[operator]
+        position = self._next() if has_value else None
+        return lambda entity, params: check(get_field(entity, path), None if position is None else params[position])
+
+
+class QueryPlan:
+    """Compiled form of one query shape."""
+
+    def __init__(self, shape: tuple, sort: Tuple[Tuple[str, bool], ...]):
+        self.shape = shape
+        self.sort = sort
+        # Serialised once, only the parameters are serialised per search
+        template = json.dumps(_Compiler().cyoda(shape))
+        self._template = _PLACEHOLDER_PATTERN.split(template)  # text, position, text, position, ..., text
+        self._predicate = _Compiler().predicate(shape)
+
+    def cyoda_json(self, params: tuple) -> str:
+        """The Cyoda snapshot search condition, serialised."""
+        parts = list(self._template)
+        for index in range(1, len(parts), 2):
+            parts[index] = json.dumps(params[int(parts[index])], default=str)
+        return "".join(parts)
+
+    def cyoda_condition(self, params: tuple) -> dict:
+        return json.loads(self.cyoda_json(params))
+
+    def predicate(self, params: tuple) -> Callable[[Any], bool]:
+        """The local predicate over an entity dict."""
+        compiled = self._predicate
+        return lambda entity: isinstance(entity, dict) and compiled(entity, params)
+
+    def finish(self, entities: List[Any], max_results: Optional[int]) -> List[Any]:
+        """Apply the sorting and limit, which Cyoda snapshot searches do not support."""
+        entities = list(entities or [])
+        # Stable sorts from the last key to the first; None values sort last in either direction
+        for path, descending in reversed(self.sort):
+            present = [entity for entity in entities if get_field(entity, path) is not None]
+            missing = [entity for entity in entities if get_field(entity, path) is None]
+            present.sort(key=lambda entity: get_field(entity, path), reverse=descending)
+            entities = present + missing
+        return entities if max_results is None else entities[:max_results]
+
+
+_plans: "OrderedDict[tuple, QueryPlan]" = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def compile_query(query: Query) -> Tuple[QueryPlan, tuple]:
+    """The cached plan of the query's shape and the query's parameters."""
+    params = []
+    conditions = query.conditions
+    # Cyoda expects a group at the root of a search condition
+    root = conditions[0] if len(conditions) == 1 and isinstance(conditions[0], Group) else Group("AND", conditions)
+    shape = _shape(root, params)
+    key = (shape, tuple(query.sort))
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+    if plan is None:
+        plan = QueryPlan(shape, tuple(query.sort))
+        with _plans_lock:
+            _plans[key] = plan
+            while len(_plans) > QUERY_PLAN_CACHE_SIZE:
+                _plans.popitem(last=False)
+    return plan, tuple(params)
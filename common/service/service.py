@@ -1,17 +1,36 @@
+import asyncio
 import logging
 import threading
-from typing import Any, List
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, List, Union
 
-from common.config.config import CHAT_REPOSITORY
+from common.config.config import CHAT_REPOSITORY, ENTITY_LOADER_ENABLED, ENTITY_LOADER_WINDOW_MS, \
+    ENTITY_LOADER_MAX_BATCH, WRITE_BEHIND_ENABLED, WRITE_BEHIND_WINDOW_MS, WRITE_BEHIND_MAX_BATCH, OUTBOX_ENABLED, \
+    OUTBOX_FILE, OUTBOX_FSYNC, OUTBOX_FSYNC_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_MAX_RESOLVED, \
+    BULK_TRANSITION_CONCURRENCY, BULK_TRANSITION_RATE, BULK_TRANSITION_BURST, BULK_TRANSITION_REPORT_EVERY, \
+    SEARCH_MAX_RESULTS
+from common.monitoring.server_timing import timed_methods
+from common.monitoring.tracing import trace_methods
 from common.repository.crud_repository import CrudRepository
+from common.service.aggregation import compile_aggregation_sql
+from common.service.bulk_transitions import launch_transitions
+from common.service.entity_loader import EntityLoader
 from common.service.entity_service_interface import EntityService
+from common.service.outbox import Outbox, register_backlog_metric
+from common.service.query import Query, compile_query
+from common.service.trino_service import get_trino_schema_id_by_entity_name, run_sql_query, trino_table_name
+from common.service.write_behind import WriteBehindBuffer
 
 logger = logging.getLogger('quart')
 
+@timed_methods("entity")
+@trace_methods("entity_service")
 class EntityServiceImpl(EntityService):
     _instance = None
     _lock = threading.Lock()
     _repository: CrudRepository = None
+    _loader: EntityLoader = None
+    _write_behind: WriteBehindBuffer = None
+    _outbox: Outbox = None
 
     def __new__(cls, repository: CrudRepository = None):
         logger.info("initializing CyodaService")
@@ -23,6 +42,17 @@ class EntityServiceImpl(EntityService):
                     # Only initialize _repository during the first instantiation
                     if repository is not None:
                         cls._instance._repository = repository
+                        if ENTITY_LOADER_ENABLED == "true":
+                            cls._instance._loader = EntityLoader(repository, ENTITY_LOADER_WINDOW_MS / 1000,
+                                                                 ENTITY_LOADER_MAX_BATCH)
+                        if WRITE_BEHIND_ENABLED == "true":
+                            cls._instance._write_behind = WriteBehindBuffer(
+                                repository, WRITE_BEHIND_WINDOW_MS / 1000, WRITE_BEHIND_MAX_BATCH)
+                        if OUTBOX_ENABLED == "true":
+                            cls._instance._outbox = Outbox(repository, OUTBOX_FILE, OUTBOX_FSYNC,
+                                                           OUTBOX_FSYNC_INTERVAL, OUTBOX_BATCH_SIZE,
+                                                           OUTBOX_MAX_RESOLVED)
+                            register_backlog_metric(cls._instance._outbox)
         return cls._instance
 
     def __init__(self, repository: CrudRepository):
@@ -33,11 +63,30 @@ class EntityServiceImpl(EntityService):
     async def get_item(self, token: str, entity_model: str, entity_version: str, technical_id: str) -> Any:
         """Retrieve a single item based on its ID."""
         meta = await self._repository.get_meta(token, entity_model, entity_version)
-        resp = await self._repository.find_by_id(meta, technical_id)
+        if self._outbox is not None:
+            # Provisional ids from the outbox: serve the queued entity until it is saved, then its real id
+            pending = self._outbox.pending_entity(technical_id)
+            if pending is not None:
+                return pending
+            technical_id = self._outbox.resolve(technical_id) or technical_id
+        if self._loader is not None:
+            # Batched with the other ids requested for this model in the same event loop tick
+            resp = await self._loader.load(meta, technical_id)
+        else:
+            resp = await self._repository.find_by_id(meta, technical_id)
         if resp and isinstance(resp, dict) and resp.get("errorMessage"):
             return []
         return resp
 
+    async def get_items_by_ids(self, token: str, entity_model: str, entity_version: str, ids: List[str]) -> List[Any]:
+        """Retrieve the items with the given IDs in one batch, None for missing ones."""
+        meta = await self._repository.get_meta(token, entity_model, entity_version)
+        resp = await self._repository.find_all_by_ids(meta, ids)
+        for item in resp:
+            if isinstance(item, Exception):
+                raise item
+        return resp
+
     async def get_items(self, token: str, entity_model: str, entity_version: str) -> List[Any]:
         """Retrieve multiple items based on their IDs."""
         meta = await self._repository.get_meta(token, entity_model, entity_version)
@@ -46,35 +95,128 @@ class EntityServiceImpl(EntityService):
             return []
         return resp
 
+    async def iter_items(self, token: str, entity_model: str, entity_version: str) -> AsyncIterator[Any]:
+        """Yield all items of the model one by one as they are read, instead of loading them into a list."""
+        meta = await self._repository.get_meta(token, entity_model, entity_version)
+        async for item in self._repository.iter_all(meta):
+            yield item
+
     async def get_single_item_by_condition(self, token: str, entity_model: str, entity_version: str, condition: Any) -> List[Any]:
         """Retrieve multiple items based on their IDs."""
-        resp = await self._find_by_criteria(token, entity_model, entity_version, condition)
+        resp = await self._find_by_criteria(token, entity_model, entity_version, condition, max_results=1)
         if resp and isinstance(resp, dict) and resp.get("errorMessage"):
             return []
         return resp[0]
 
     async def get_items_by_condition(self, token: str, entity_model: str, entity_version: str, condition: Any) -> List[Any]:
         """Retrieve multiple items based on their IDs."""
-        resp = await self._find_by_criteria(token, entity_model, entity_version, condition.get(CHAT_REPOSITORY))
+        if isinstance(condition, Query):
+            return await self.get_items_by_query(token, entity_model, entity_version, condition)
+        # Capped at SEARCH_MAX_RESULTS matches, a broad condition would otherwise be read into memory whole
+        max_results = SEARCH_MAX_RESULTS or None
+        resp = await self._find_by_criteria(token, entity_model, entity_version, condition.get(CHAT_REPOSITORY),
+                                            max_results=max_results)
         if resp and isinstance(resp, dict) and resp.get("errorMessage"):
             return []
+        if max_results is not None and len(resp or []) >= max_results:
+            logger.warning(f"get_items_by_condition on {entity_model} returned the first {max_results} matches, "
+                           f"raise SEARCH_MAX_RESULTS or use a Query with a limit")
         return resp
 
+    async def get_items_by_query(self, token: str, entity_model: str, entity_version: str, query: Query) -> List[Any]:
+        """Retrieve the items matching a Query, compiled for the configured repository."""
+        plan, params = compile_query(query)
+        criteria = plan.cyoda_json(params) if CHAT_REPOSITORY == "cyoda" else plan.predicate(params)
+        # Unsorted, any max_results matches will do and the repository stops reading once it has them
+        resp = await self._find_by_criteria(token, entity_model, entity_version, criteria,
+                                            max_results=None if query.sort else query.max_results)
+        if resp and isinstance(resp, dict) and resp.get("errorMessage"):
+            return []
+        return plan.finish(resp, query.max_results)
+
+    async def count_items(self, token: str, entity_model: str, entity_version: str, condition: Any = None) -> int:
+        """
+        Count the items matching a Query or a condition keyed by repository like get_items_by_condition, all items
+        by default. No entities are transferred, Cyoda only reports the number of matches.
+        """
+        meta = await self._repository.get_meta(token, entity_model, entity_version)
+        if isinstance(condition, Query):
+            plan, params = compile_query(condition)
+            criteria = plan.cyoda_json(params) if CHAT_REPOSITORY == "cyoda" else plan.predicate(params)
+            total = await self._repository.count(meta, criteria)
+            return total if condition.max_results is None else min(total, condition.max_results)
+        criteria = condition.get(CHAT_REPOSITORY) if condition is not None else None
+        return await self._repository.count(meta, criteria)
+
     async def add_item(self, token: str, entity_model: str, entity_version: str, entity: Any, workflow=None) -> Any:
         """Add a new item to the repository."""
         meta = await self._repository.get_meta(token, entity_model, entity_version)
+        if self._outbox is not None:
+            # Durably queued, the returned id is provisional until the outbox drainer has saved the entity
+            return await self._outbox.add(meta, entity)
         resp = await self._repository.save(meta, entity)
         return resp
 
+    def start_outbox(self, token: str) -> None:
+        """Replay and start draining the outbox, if enabled."""
+        if self._outbox is not None:
+            self._outbox.start(token)
+
+    async def stop_outbox(self) -> None:
+        if self._outbox is not None:
+            await self._outbox.stop()
+
+    async def resolve_id(self, technical_id: str) -> str:
+        """
+        The real id behind a provisional outbox id, or the id itself. While the entity is still queued this waits
+        for it to be saved, within the request deadline.
+        """
+        if self._outbox is None:
+            return technical_id
+        return await self._outbox.wait_resolved(technical_id)
+
     async def update_item(self, token: str, entity_model: str, entity_version: str, technical_id: str, entity: Any, meta: Any) -> Any:
-        """Update an existing item in the repository."""
+        """
+        Update an existing item in the repository and return its technical id, or only launch the update transition
+        when entity is None and return the repository's response. With write-behind the update is buffered, the id
+        is returned the same way once the bulk flush carrying it has succeeded.
+        """
         repository_meta = await self._repository.get_meta(token, entity_model, entity_version)
         meta.update(repository_meta)
+        technical_id = await self.resolve_id(technical_id)
+        if self._write_behind is not None and entity is not None:
+            # Coalesced with other updates of the entity and flushed in bulk after the write-behind window
+            return await self._write_behind.update(meta, technical_id, entity)
         resp = await self._repository.update(meta, technical_id, entity)
         return resp
 
-    async def _find_by_criteria(self, token, entity_model, entity_version, condition):
+    async def flush_updates(self) -> None:
+        """Wait for the buffered write-behind updates to be flushed."""
+        if self._write_behind is not None:
+            await self._write_behind.flush_all()
+
+    async def aggregate(self, token: str, entity_model: str, entity_version: str, aggregations: Any,
+                        group_by: List[str] = None, filters: List[Any] = None, table: str = None) -> List[Any]:
+        """
+        Compute aggregations such as {"total": ("count", None), "avg_price": ("avg", "price")}, optionally
+        grouped by fields and filtered with [{"field": ..., "operator": ..., "value": ...}].
+        With Cyoda the query runs in Trino against the schema created by init_trino, so no entities are fetched:
+        on the entity's root table, or on `table` of that schema. Fields are top-level columns there, dotted paths
+        only work in memory.
+        """
+        if CHAT_REPOSITORY == "cyoda":
+            if await get_trino_schema_id_by_entity_name(entity_model) is None:
+                raise ValueError(f"No trino schema for entity '{entity_model}', run init_trino first")
+            query = compile_aggregation_sql(trino_table_name(entity_model, table), aggregations, group_by, filters)
+            # Not cached, an aggregate must reflect the writes made since the last one
+            return await run_sql_query(token, query, use_cache=False)
+        meta = await self._repository.get_meta(token, entity_model, entity_version)
+        return await self._repository.aggregate(meta, aggregations, group_by, filters)
+
+    async def _find_by_criteria(self, token, entity_model, entity_version, condition, max_results=None):
         meta = await self._repository.get_meta(token, entity_model, entity_version)
+        if max_results is not None:
+            meta = {**meta, "max_results": max_results}
         resp = await self._repository.find_all_by_criteria(meta, condition)
         return resp
 
@@ -82,5 +224,36 @@ class EntityServiceImpl(EntityService):
         """Update an existing item in the repository."""
         repository_meta = await self._repository.get_meta(token, entity_model, entity_version)
         meta.update(repository_meta)
-        resp = await self._repository.delete_by_id(meta, technical_id)
-        return resp
\ No newline at end of file
+        resp = await self._repository.delete_by_id(meta, await self.resolve_id(technical_id))
+        return resp
+
+    async def launch_transitions(self, token: str, entity_model: str, entity_version: str,
+                                 technical_ids: Union[Iterable[str], AsyncIterable[str]], transition: str = None,
+                                 concurrency: int = None, rate: float = None) -> AsyncIterator[Any]:
+        """
+        Launch a workflow transition (the repository's update transition by default) for each of the IDs, which
+        may be an async stream, with bounded concurrency and rate. Async iterator of progress reports, see
+        common.service.bulk_transitions.launch_transitions.
+        """
+        meta = await self._repository.get_meta(token, entity_model, entity_version)
+        if transition is not None:
+            meta["update_transition"] = transition
+        async for progress in launch_transitions(
+                self._repository, meta, technical_ids,
+                concurrency=concurrency or BULK_TRANSITION_CONCURRENCY,
+                rate=BULK_TRANSITION_RATE if rate is None else rate, burst=BULK_TRANSITION_BURST,
+                report_every=BULK_TRANSITION_REPORT_EVERY, resolve_id=self.resolve_id):
+            yield progress
+
+    async def delete_items(self, token: str, entity_model: str, entity_version: str, technical_ids: List[str],
+                           meta: Any = None) -> List[Any]:
+        """
+        Delete the items with the given IDs in bulk, returning per ID (in the same order)
+        {"technical_id": ..., "status": "deleted" | "not_found" | "failed", "error": ...}.
+        """
+        repository_meta = await self._repository.get_meta(token, entity_model, entity_version)
+        meta = {**(meta or {}), **repository_meta}
+        resolved = await asyncio.gather(*(self.resolve_id(technical_id) for technical_id in technical_ids))
+        results = await self._repository.delete_all_by_ids(meta, resolved)
+        # Report the IDs the caller passed, provisional outbox IDs included
+        return [{**result, "technical_id": technical_id} for technical_id, result in zip(technical_ids, results)]
\ No newline at end of file
@@ -1,10 +1,106 @@
-from common.config.config import CYODA_AI_URL
+import copy
+import json
+import logging
+import re
+from pathlib import Path
+
+from common.config.config import CYODA_AI_URL, TRINO_CACHE_TTL, TRINO_CACHE_MAX_ENTRIES, TRINO_PAGE_SIZE, \
+    TRINO_CATALOG
+from common.monitoring.profiling import register_component
+from common.service.aggregation import quote_identifier
+from common.util.cache import TTLCache
 from common.util.utils import send_post_request
 
+logger = logging.getLogger(__name__)
+
+# Written by cyoda_init.init_trino: {entity_name: trino schema id}
+TRINO_CONFIG_FILE = Path(__file__).resolve().parent.parent.parent / 'entity' / 'config.json'
+
+_schema_registry = {}
+_schema_registry_loaded = False
+_query_cache = TTLCache(ttl=TRINO_CACHE_TTL, max_entries=TRINO_CACHE_MAX_ENTRIES)
+register_component("trino_query_cache", lambda: _query_cache._entries)
+
+
+def register_trino_schema(entity_name: str, schema_id: str):
+    _schema_registry[entity_name] = schema_id
+
+
+def load_trino_schema_registry(config_file: Path = TRINO_CONFIG_FILE):
+    global _schema_registry_loaded
+    try:
+        _schema_registry.update(json.loads(config_file.read_text()))
+    except FileNotFoundError:
+        logger.info(f"No trino schema config found at {config_file}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse trino schema config {config_file}: {e}")
+    _schema_registry_loaded = True
+    return _schema_registry
+
+
 async def get_trino_schema_id_by_entity_name(entity_name: str):
-    return "2f303900-d8e3-11ef-a78b-ea51a4527ea1"
+    if not _schema_registry_loaded:
+        load_trino_schema_registry()
+    schema_id = _schema_registry.get(entity_name)
+    if schema_id is None:
+        logger.warning(f"No trino schema registered for entity '{entity_name}', run init_trino first")
+    return schema_id
+
+
+def trino_table_name(entity_name: str, table: str = None) -> str:
+    """
+    Qualified name of a table in the schema init_trino created for the entity (named after it), the entity's root
+    table by default.
+    """
+    return ".".join(quote_identifier(part) for part in (TRINO_CATALOG, entity_name, table or entity_name))
+
+
+# A trailing OFFSET, LIMIT or FETCH clause of the outermost query
+_PAGING_CLAUSE = re.compile(r"\b(OFFSET|LIMIT|FETCH)\b[^()]*$", re.IGNORECASE)
+# String literals and quoted identifiers, whose content is not SQL syntax
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside string literals and quoted identifiers and drop the trailing semicolon."""
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    return "".join(part if part[:1] in ("'", '"') else re.sub(r"\s+", " ", part) for part in parts)
+
 
 #runs sql to retrieve data
-async def run_sql_query(token, query):
+async def run_sql_query(token, query, use_cache=True):
+    cache_key = normalize_sql(query) if use_cache else None
+    if cache_key is not None:
+        cached = _query_cache.get(cache_key)
+        if cached is not None:
+            # Copies, so callers modifying their result never change what later callers get
+            return copy.deepcopy(cached)
     resp = await send_post_request(token, CYODA_AI_URL, "api/v1/trino/run-query", query)
-    return resp.get('json')["message"]
\ No newline at end of file
+    result = resp.get('json')["message"]
+    if cache_key is not None and resp.get('status') == 200:
+        _query_cache.set(cache_key, copy.deepcopy(result))
+    return result
+
+
+async def stream_sql_query(token, query, page_size=TRINO_PAGE_SIZE):
+    """
+    Run a query page by page and yield the result rows one at a time, so callers never hold the full result.
+    OFFSET and LIMIT are appended to the query itself, so its ORDER BY (needed for stable pages) applies to them;
+    the query must not have its own OFFSET, LIMIT or FETCH clause.
+    """
+    base_query = normalize_sql(query)
+    if _PAGING_CLAUSE.search(_QUOTED.sub("''", base_query)):
+        raise ValueError("stream_sql_query pages the query itself, drop its OFFSET, LIMIT or FETCH clause")
+    offset = 0
+    while True:
+        page = await run_sql_query(token, f"{base_query} OFFSET {offset} LIMIT {page_size}", use_cache=False)
+        if not isinstance(page, list):
+            # Not a row set (e.g. an error message), hand it over as is
+            if page:
+                yield page
+            return
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        offset += page_size
@@ -0,0 +1,101 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any
+
+from common.repository.crud_repository import CrudRepository
+from common.resilience import bulkhead
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingUpdate:
+    __slots__ = ("entity", "futures")
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.futures = []
+
+
+class _Batch:
+    __slots__ = ("meta", "transition", "updates")
+
+    def __init__(self, meta, transition):
+        self.meta = meta
+        self.transition = transition
+        self.updates = {}  # technical_id -> _PendingUpdate, in arrival order
+
+
+class WriteBehindBuffer:
+    """
+    Write-behind buffer for entity updates: updates of the same entity with the same transition arriving within
+    `window` seconds are coalesced (the last entity wins, it is a full replacement) and each model's updates are
+    flushed in bulk through update_all. Batches of a model are flushed one after the other, so updates of an
+    entity reach the backend in order, and every awaiter gets the outcome of the flush that carried its update.
+    """
+
+    def __init__(self, repository: CrudRepository, window: float, max_batch: int = 100):
+        self.repository = repository
+        self.window = window
+        self.max_batch = max_batch
+        self._queues = {}  # (token, model, version) -> list of _Batch, oldest first
+        self._flushers = {}
+
+    async def update(self, meta: dict, technical_id: Any, entity: Any) -> Any:
+        key = (meta.get("token"), meta.get("entity_model"), meta.get("entity_version"))
+        transition = meta.get("update_transition")
+        batches = self._queues.setdefault(key, [])
+        # Only the newest batch takes updates, so an entity's updates are never reordered across batches
+        batch = batches[-1] if batches else None
+        if batch is None or batch.transition != transition or \
+                (len(batch.updates) >= self.max_batch and technical_id not in batch.updates):
+            batch = _Batch(dict(meta), transition)
+            batches.append(batch)
+        pending = batch.updates.get(technical_id)
+        if pending is None:
+            pending = batch.updates[technical_id] = _PendingUpdate(entity)
+        else:
+            pending.entity = entity
+        future = asyncio.get_running_loop().create_future()
+        pending.futures.append(future)
+        if key not in self._flushers:
+            # Flush outside the caller's context so its deadline does not cut the flush short for the others
+            context = contextvars.Context()
+            context.run(bulkhead.set_traffic_class, bulkhead.current_traffic_class())
+            self._flushers[key] = asyncio.get_running_loop().create_task(self._flush_loop(key), context=context)
+        return await future
+
+    async def _flush_loop(self, key) -> None:
+        batches = self._queues[key]
+        try:
+            while batches:
+                await asyncio.sleep(self.window)
+                await self._flush(batches.pop(0))
+        finally:
+            del self._flushers[key]
+            if not batches:
+                self._queues.pop(key, None)
+
+    async def _flush(self, batch: _Batch) -> None:
+        meta = {**batch.meta, "update_transition": batch.transition}
+        ids = list(batch.updates)
+        entities = [{**pending.entity, "technical_id": technical_id} if isinstance(pending.entity, dict)
+                    else pending.entity for technical_id, pending in batch.updates.items()]
+        try:
+            await self.repository.update_all(meta, entities)
+        except Exception as e:
+            logger.error(f"Write-behind flush of {len(ids)} {meta.get('entity_model')} updates failed: {e}")
+            for pending in batch.updates.values():
+                for future in pending.futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for technical_id, pending in batch.updates.items():
+            for future in pending.futures:
+                if not future.done():
+                    future.set_result(technical_id)
+
+    async def flush_all(self) -> None:
+        """Wait until every buffered update has been flushed, e.g. on shutdown."""
+        while self._flushers:
+            await asyncio.gather(*self._flushers.values(), return_exceptions=True)
@@ -0,0 +1,11 @@
+import inspect
+from typing import Callable
+
+
+def wrap_public_coroutines(cls, wrap: Callable[[Callable, str], Callable]):
+    """Replace every public async method defined on the class by wrap(method, name); returns the class."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, name, wrap(method, name))
+    return cls
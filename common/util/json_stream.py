@@ -0,0 +1,90 @@
+import json
+import re
+from typing import Any, Iterator, List
+
+_WHITESPACE = re.compile(r"\s*")
+_DELIMITERS = frozenset(",] \t\r\n")
+
+_START, _VALUE_OR_END, _VALUE, _AFTER_VALUE, _DONE = range(5)
+
+
+class JsonArrayDecoder:
+    """
+    Incremental decoder for a top-level JSON array arriving in text chunks: feed() returns the elements completed
+    by each chunk and only the element being received stays buffered. An element that is still incomplete is
+    decoded again only once the buffer has grown by its pending size, so large elements spread over many chunks
+    are not re-parsed chunk after chunk.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0  # start of the next token in the buffer
+        self._state = _START
+        self._retry_at = 0  # buffer length at which an incomplete element is decoded again
+        self._chunks = []  # received while waiting for _retry_at, joined to the buffer once it is reached
+        self._received = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        self._chunks.append(chunk)
+        self._received += len(chunk)
+        if self._received < self._retry_at:
+            return []
+        self._buffer = "".join([self._buffer, *self._chunks])
+        self._chunks = []
+        elements = list(self._drain())
+        # Drop what has been decoded, the buffer only keeps the incomplete element
+        if self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._retry_at = max(0, self._retry_at - self._pos)
+            self._pos = 0
+        self._received = len(self._buffer)
+        return elements
+
+    def close(self) -> List[Any]:
+        """Decode what is left at the end of the stream and check it held one complete array."""
+        self._retry_at = 0
+        elements = self.feed("")
+        if self._state != _DONE:
+            raise ValueError("Truncated or invalid JSON array" if self._state != _START else "Empty JSON response")
+        return elements
+
+    def _drain(self) -> Iterator[Any]:
+        buffer = self._buffer
+        while True:
+            self._pos = _WHITESPACE.match(buffer, self._pos).end()
+            if self._pos >= len(buffer):
+                return
+            char = buffer[self._pos]
+            if self._state == _START:
+                if char != "[":
+                    raise ValueError(f"Expected a JSON array, got {buffer[self._pos:self._pos + 20]!r}")
+                self._pos += 1
+                self._state = _VALUE_OR_END
+            elif self._state == _DONE:
+                raise ValueError("Unexpected data after the JSON array")
+            elif self._state == _AFTER_VALUE:
+                if char not in ",]":
+                    raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+                self._pos += 1
+                self._state = _VALUE if char == "," else _DONE
+            elif self._state == _VALUE_OR_END and char == "]":
+                self._pos += 1
+                self._state = _DONE
+            else:
+                self._state = _VALUE
+                if len(buffer) < self._retry_at:
+                    return
+                try:
+                    element, end = self._decoder.raw_decode(buffer, self._pos)
+                except json.JSONDecodeError:
+                    end = None
+                # A number is complete only once a delimiter follows it, the next chunk may hold more of it
+                if end is None or (buffer[end - 1] not in '}]"el'
+                                   and (end == len(buffer) or buffer[end] not in _DELIMITERS)):
+                    self._retry_at = 2 * len(buffer) - self._pos
+                    return
+                self._pos = end
+                self._retry_at = 0
+                self._state = _AFTER_VALUE
+                yield element
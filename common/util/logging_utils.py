@@ -0,0 +1,113 @@
+"""
+Cost-bounded logging for hot paths.
+
+Messages use lazy %-style formatting, payloads are truncated only when a record is actually emitted,
+and every log site can be sampled and rate limited so high-volume paths cannot dominate CPU or log volume.
+"""
+import json
+import logging
+import random
+
+from common.config.config import LOG_PAYLOAD_MAX_CHARS, LOG_SAMPLE_RATES, LOG_RATE_LIMIT, LOG_RATE_BURST
+from common.util.rate_limiter import TokenBucket
+
+
+def _parse_sample_rates(value: str) -> dict:
+    # "grpc.calc_request=0.1,cyoda.get_by_id=0.01" -> {"grpc.calc_request": 0.1, "cyoda.get_by_id": 0.01}
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        site, _, rate = item.partition("=")
+        rates[site.strip()] = float(rate)
+    return rates
+
+
+_sample_rates = _parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+class truncated:
+    """Lazily rendered payload, cut to max_chars when the log record is formatted."""
+    __slots__ = ("payload", "max_chars")
+
+    def __init__(self, payload, max_chars: int = None):
+        self.payload = payload
+        self.max_chars = LOG_PAYLOAD_MAX_CHARS if max_chars is None else max_chars
+
+    def __str__(self) -> str:
+        text = self.payload if isinstance(self.payload, str) else _render(self.payload)
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... ({len(text)} chars)"
+        return text
+
+    __repr__ = __str__
+
+
+def _render(payload) -> str:
+    if isinstance(payload, (dict, list)):
+        try:
+            return json.dumps(payload, default=str, ensure_ascii=False)
+        except (TypeError, ValueError):
+            pass
+    return str(payload)
+
+
+class _Fields:
+    __slots__ = ("fields",)
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return " ".join(f"{key}={value}" for key, value in self.fields.items())
+
+
+class HotPathLogger:
+    """
+    Logger for a single log site with sampling (keep `sample_rate` of the records) and a token-bucket limit
+    of `rate` records per second. Suppressed records are counted and reported on the next emitted one.
+    Keyword arguments are structured fields: they go to the record's `fields` attribute and the message tail.
+    """
+
+    def __init__(self, logger: logging.Logger, site: str, sample_rate: float = None, rate: float = None,
+                 burst: float = None):
+        self.logger = logger
+        self.site = site
+        self.sample_rate = _sample_rates.get(site, 1.0) if sample_rate is None else sample_rate
+        self.bucket = TokenBucket(LOG_RATE_LIMIT if rate is None else rate, LOG_RATE_BURST if burst is None else burst)
+        self.suppressed = 0
+
+    def _log(self, level: int, msg: str, args, fields: dict) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if not self.bucket.try_acquire():
+            self.suppressed += 1
+            return
+        fields = {"site": self.site, **fields}
+        if self.suppressed:
+            fields["suppressed"] = self.suppressed
+            self.suppressed = 0
+        self.logger.log(level, f"{msg} %s", *args, _Fields(fields), extra={"fields": fields}, stacklevel=3)
+
+    def debug(self, msg: str, *args, **fields) -> None:
+        self._log(logging.DEBUG, msg, args, fields)
+
+    def info(self, msg: str, *args, **fields) -> None:
+        self._log(logging.INFO, msg, args, fields)
+
+    def warning(self, msg: str, *args, **fields) -> None:
+        self._log(logging.WARNING, msg, args, fields)
+
+    def error(self, msg: str, *args, **fields) -> None:
+        self._log(logging.ERROR, msg, args, fields)
+
+
+_hot_path_loggers = {}
+
+
+def hot_path_logger(logger: logging.Logger, site: str, **kwargs) -> HotPathLogger:
+    """Return the shared HotPathLogger of a log site, creating it on first use."""
+    hot_logger = _hot_path_loggers.get(site)
+    if hot_logger is None:
+        hot_logger = _hot_path_loggers[site] = HotPathLogger(logger, site, **kwargs)
+    return hot_logger
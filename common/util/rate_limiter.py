@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: allows `rate` operations per second on average with bursts of up to `burst`.
+    A rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        current = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (current - self._updated) * self.rate)
+        self._updated = current
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens without waiting, returns False when the bucket is empty."""
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Wait until tokens are available and take them."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens < 0:
+                # Tokens are reserved up front so waiters are served in arrival order
+                await asyncio.sleep(-self._tokens / self.rate)
@@ -12,9 +12,17 @@ import httpx
 import jsonschema
 from jsonschema import validate
 
-from common.config.config import PROJECT_DIR, REPOSITORY_NAME
+from common.config.config import PROJECT_DIR, REPOSITORY_NAME, CYODA_AI_URL, CYODA_API_URL
+from common.monitoring import metrics, tracing, server_timing
+from common.resilience import deadline, bulkhead
+from common.resilience.adaptive_limiter import cyoda_limiter
+from common.resilience.policies import retry_policy, hedge_policy, circuit_breaker_for
+from common.util.logging_utils import hot_path_logger
 
 logger = logging.getLogger(__name__)
+# Upper bound of a single outbound request, shortened to the remaining deadline of the caller
+REQUEST_TIMEOUT = 15.0
+_request_log = hot_path_logger(logger, "utils.send_request")
 
 class ValidationErrorException(Exception):
     """Custom exception for validation errors."""
@@ -321,10 +329,11 @@ async def validate_result(data: str, file_path: str, schema: Optional[str]) -> s
             raise
 
     try:
-        parsed_data = parse_json(data)
-        json_data = json.loads(parsed_data)
-        normalized_json_data = _normalize_boolean_json(json_data)
-        validate(instance=normalized_json_data, schema=schema)
+        with server_timing.timed("validation"):
+            parsed_data = parse_json(data)
+            json_data = json.loads(parsed_data)
+            normalized_json_data = _normalize_boolean_json(json_data)
+            validate(instance=normalized_json_data, schema=schema)
         logger.info("JSON validation successful.")
         return normalized_json_data
     except jsonschema.exceptions.ValidationError as err:
@@ -408,7 +417,7 @@ async def read_json_file(file_path: str):
         logger.error(f"An unexpected error occurred while reading the file {file_path}: {e}")
         raise
 
-async def send_get_request(token: str, api_url: str, path: str) -> Optional[Any]:
+async def send_get_request(token: str, api_url: str, path: str, hedge: bool = False) -> Optional[Any]:
     url = f"{api_url}/{path}"
     token = f"Bearer {token}" if not token.startswith('Bearer') else token
     headers = {
@@ -416,34 +425,99 @@ async def send_get_request(token: str, api_url: str, path: str) -> Optional[Any]
         "Authorization": f"{token}",
     }
     try:
-        response = await send_request(headers, url, 'GET', None, None)
+        response = await send_request(headers, url, 'GET', None, None, hedge=hedge)
         # Raise an error for bad status codes
-        logger.info(f"GET request to {url} successful.")
+        _request_log.info("GET request to %s successful.", url, method="GET", status=response.get("status"))
         return response
     except Exception as err:
         logger.error(f"Error during GET request to {url}: {err}")
         raise
 
 
-async def send_request(headers, url, method, data=None, json=None):
-    async with httpx.AsyncClient(timeout=15.0) as client:
+async def send_request(headers, url, method, data=None, json=None, idempotent=None, hedge=False):
+    """
+    Send a request through the outbound policies: retries (GET, or any method with idempotent=True),
+    the host's circuit breaker, the Cyoda concurrency limiter and, for GETs with hedge=True, hedged reads.
+    """
+    with server_timing.timed("ai" if url.startswith(CYODA_AI_URL) else "cyoda"):
+        async def attempt():
+            return await _guarded_send_request(headers, url, method, data, json)
+
+        async def hedged():
+            return await hedge_policy.run(metrics.path_template(url), attempt)
+
+        send = hedged if hedge and hedge_policy is not None and method.upper() == 'GET' else attempt
+        return await retry_policy.run(send, url, method, idempotent)
+
+
+async def _guarded_send_request(headers, url, method, data=None, json=None):
+    breaker = circuit_breaker_for(url)
+    if breaker is None:
+        return await _limited_send_request(headers, url, method, data, json)
+    async with breaker.guard() as outcome:
+        response = await _limited_send_request(headers, url, method, data, json)
+        if response["status"] >= 500:
+            outcome.fail()
+        return response
+
+
+async def _limited_send_request(headers, url, method, data=None, json=None):
+    if cyoda_limiter is None or not url.startswith(CYODA_API_URL):
+        return await _observed_send_request(headers, url, method, data, json)
+    async with cyoda_limiter.slot(timeout=deadline.timeout(cyoda_limiter.max_wait, url),
+                                  priority=bulkhead.current_priority()) as outcome:
+        response = await _observed_send_request(headers, url, method, data, json)
+        if response["status"] == 429 or response["status"] >= 500:
+            outcome.drop()
+        return response
+
+
+async def _observed_send_request(headers, url, method, data=None, json=None):
+    if not metrics.enabled and not tracing.enabled:
+        return await _send_request(headers, url, method, data, json)
+    path = metrics.path_template(url)
+    start = time.perf_counter()
+    status = "error"
+    with tracing.span(f"HTTP {method.upper()} {path}", method=method.upper(), url=url) as current:
+        if current is not None:
+            headers = {**headers, "traceparent": tracing.traceparent_header()}
+        try:
+            response = await _send_request(headers, url, method, data, json)
+            status = response["status"]
+            return response
+        finally:
+            if current is not None:
+                current.set_attribute("status_code", status)
+            metrics.http_request_duration.observe(time.perf_counter() - start, method=method.upper(),
+                                                  path=path, status=status)
+
+
+def _parse_content(response):
+    if 'application/json' not in response.headers.get('Content-Type', ''):
+        return response.text
+    with server_timing.timed("json"):
+        return response.json()
+
+
+async def _send_request(headers, url, method, data=None, json=None):
+    async with httpx.AsyncClient(timeout=deadline.timeout(REQUEST_TIMEOUT, url)) as client:
         method = method.upper()
         if method == 'GET':
             response = await client.get(url, headers=headers)
             # Only process GET responses with status 200 or 404 as in your original code
             if response.status_code in (200, 404):
-                content = response.json() if 'application/json' in response.headers.get('Content-Type', '') else response.text
+                content = _parse_content(response)
             else:
                 content = None
         elif method == 'POST':
             response = await client.post(url, headers=headers, data=data, json=json)
-            content = response.json() if 'application/json' in response.headers.get('Content-Type', '') else response.text
+            content = _parse_content(response)
         elif method == 'PUT':
             response = await client.put(url, headers=headers, data=data, json=json)
-            content = response.json() if 'application/json' in response.headers.get('Content-Type', '') else response.text
+            content = _parse_content(response)
         elif method == 'DELETE':
             response = await client.delete(url, headers=headers)
-            content = response.json() if 'application/json' in response.headers.get('Content-Type', '') else response.text
+            content = _parse_content(response)
         else:
             raise ValueError("Unsupported HTTP method")
 
@@ -468,23 +542,79 @@ async def send_post_request(token: str, api_url: str, path: str, data=None, json
         raise
 
 
-async def send_put_request(token: str, api_url: str, path: str, data=None, json=None) -> Optional[Any]:
+async def send_stream_request(headers, url, method, data=None, json=None, chunk_size=None):
+    """
+    Send a request and yield the response as it arrives instead of buffering the whole body.
+
+    The first item yielded is a dict with the response "status" and "content_type";
+    every following item is a text chunk of at most chunk_size characters. Each read from the socket gets the
+    request timeout, and every chunk is also bounded by what is left of the caller's deadline.
+    """
+    async with httpx.AsyncClient(timeout=deadline.timeout(REQUEST_TIMEOUT, url)) as client:
+        async with client.stream(method.upper(), url, headers=headers, data=data, json=json) as response:
+            yield {
+                "status": response.status_code,
+                "content_type": response.headers.get('Content-Type', '')
+            }
+            chunks = response.aiter_text(chunk_size=chunk_size)
+            while True:
+                try:
+                    chunk = await deadline.wait_for(anext(chunks), f"reading {url}")
+                except StopAsyncIteration:
+                    break
+                if chunk:
+                    yield chunk
+
+
+async def send_post_stream_request(token: str, api_url: str, path: str, data=None, json=None, chunk_size=None):
     url = f"{api_url}/{path}"
     token = f"Bearer {token}" if not token.startswith('Bearer') else token
     headers = {
         "Content-Type": "application/json",
+        "Accept": "text/event-stream, application/json",
         "Authorization": f"{token}",
     }
     try:
-        response = await send_request(headers, url, 'PUT', data, json)
-        logger.info(f"PUT request to {url} successful.")
+        async for item in send_stream_request(headers, url, 'POST', data, json, chunk_size):
+            yield item
+    except Exception as err:
+        logger.error(f"Error during streaming POST request to {url}: {err}")
+        raise
+
+
+async def send_get_stream_request(token: str, api_url: str, path: str, chunk_size=None):
+    url = f"{api_url}/{path}"
+    token = f"Bearer {token}" if not token.startswith('Bearer') else token
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"{token}",
+    }
+    try:
+        async for item in send_stream_request(headers, url, 'GET', chunk_size=chunk_size):
+            yield item
+    except Exception as err:
+        logger.error(f"Error during streaming GET request to {url}: {err}")
+        raise
+
+
+async def send_put_request(token: str, api_url: str, path: str, data=None, json=None,
+                           idempotent: bool = False) -> Optional[Any]:
+    url = f"{api_url}/{path}"
+    token = f"Bearer {token}" if not token.startswith('Bearer') else token
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"{token}",
+    }
+    try:
+        response = await send_request(headers, url, 'PUT', data, json, idempotent=idempotent)
+        _request_log.info("PUT request to %s successful.", url, method="PUT", status=response.get("status"))
         return response
     except Exception as err:
         logger.error(f"Error during PUT request to {url}: {err}")
         raise
 
 
-async def send_delete_request(token: str, api_url: str, path: str) -> Optional[Any]:
+async def send_delete_request(token: str, api_url: str, path: str, idempotent: bool = False) -> Optional[Any]:
     url = f"{api_url}/{path}"
     token = f"Bearer {token}" if not token.startswith('Bearer') else token
     headers = {
@@ -492,11 +622,11 @@ async def send_delete_request(token: str, api_url: str, path: str) -> Optional[A
         "Authorization": f"{token}",
     }
     try:
-        response = await send_request(headers, url, 'DELETE', None, None)
-        logger.info(f"GET request to {url} successful.")
+        response = await send_request(headers, url, 'DELETE', None, None, idempotent=idempotent)
+        _request_log.info("DELETE request to %s successful.", url, method="DELETE", status=response.get("status"))
         return response
     except Exception as err:
-        logger.error(f"Error during GET request to {url}: {err}")
+        logger.error(f"Error during DELETE request to {url}: {err}")
         raise
 
 
@@ -0,0 +1,6 @@
+"""The configuration requires the Cyoda connection settings, placeholder values do for the unit tests."""
+import os
+
+for _key, _value in {"CYODA_HOST": "localhost", "CYODA_API_KEY": "dGVzdA==", "CYODA_API_SECRET": "dGVzdA==",
+                     "CONNECTION_AI_API": "test", "RANDOM_AI_API": "test", "TRINO_AI_API": "test"}.items():
+    os.environ.setdefault(_key, _value)
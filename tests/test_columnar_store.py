@@ -0,0 +1,74 @@
+"""Differential tests: the columnar store must give the same results as the dict-based evaluation."""
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from common.repository.columnar_store import ColumnarStore
+from common.service.aggregation import aggregate_in_memory, compile_filters
+
+
+def _entities(count=300, seed=7):
+    rng = random.Random(seed)
+    entities = {}
+    for index in range(count):
+        entity = {"qty": rng.randint(0, 5), "flag": rng.random() < 0.5, "nested": {"level": rng.randint(1, 3)}}
+        # Floats and ints mixed in one column, halves keep the sums exact in any order
+        entity["price"] = rng.choice([rng.randint(1, 4), rng.randint(1, 8) / 2])
+        category = rng.choice(["books", "games", "music", None, "missing"])
+        if category != "missing":
+            entity["category"] = category
+        if rng.random() < 0.2:
+            entity["price"] = None
+        entities[f"id-{index}"] = entity
+    return entities
+
+
+@pytest.fixture
+def data():
+    entities = _entities()
+    store = ColumnarStore("product")
+    for technical_id, entity in entities.items():
+        store.put(technical_id, entity)
+    return store, list(entities.values())
+
+
+def _canonical(rows):
+    # repr keeps 2 and 2.0 apart, so the value types are compared too
+    return sorted(repr(sorted(row.items())) for row in rows)
+
+
+AGGREGATIONS = {"total": ("count", None), "priced": ("count", "price"), "sum": ("sum", "price"),
+                "avg": ("avg", "price"), "min": ("min", "price"), "max": ("max", "price"), "qty": ("sum", "qty")}
+
+FILTERS = [
+    [],
+    [{"field": "category", "operator": "NOT_EQUAL", "value": None}],
+    [{"field": "category", "operator": "EQUALS", "value": None}],
+    [{"field": "category", "operator": "NOT_EQUAL", "value": "books"}],
+    [{"field": "price", "operator": "NOT_EQUAL", "value": 2}],
+    [{"field": "price", "operator": "GREATER_OR_EQUAL", "value": 2}],
+    [{"field": "category", "operator": "IN", "value": ["games", None]}],
+    [{"field": "nested.level", "operator": "LESS_THAN", "value": 3}],
+    [{"field": "price", "operator": "IS_NULL"}, {"field": "flag", "operator": "EQUALS", "value": True}],
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_find_matches_predicates(data, filters):
+    store, entities = data
+    predicate = compile_filters(filters)
+    expected = [entity for entity in entities if predicate(entity)]
+    found = store.find(filters)
+    assert _canonical(found_entity for found_entity in
+                      ({key: value for key, value in entity.items() if key != "technical_id"} for entity in found)) \
+        == _canonical(expected)
+
+
+@pytest.mark.parametrize("group_by", [[], ["category"], ["price"], ["qty", "flag"], ["category", "price"]])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_aggregate_matches_aggregate_in_memory(data, group_by, filters):
+    store, entities = data
+    assert _canonical(store.aggregate(AGGREGATIONS, group_by, filters)) == \
+        _canonical(aggregate_in_memory(entities, AGGREGATIONS, group_by, filters))
@@ -0,0 +1,118 @@
+"""Write-ahead log and snapshot recovery of the in-memory repository."""
+import asyncio
+import glob
+import json
+import os
+
+from common.repository import in_memory_persistence
+from common.repository.in_memory_persistence import InMemoryPersistence
+
+
+class _Store:
+    """A dict standing in for the repository, keyed by (model, technical id)."""
+
+    def __init__(self):
+        self.entities = {}
+
+    def put(self, technical_id, entity, entity_model=None):
+        self.entities[(entity_model, technical_id)] = entity
+
+    def delete(self, technical_id, entity_model=None):
+        self.entities.pop((entity_model, technical_id), None)
+
+    def items(self):
+        return [(technical_id, entity, model) for (model, technical_id), entity in dict(self.entities).items()]
+
+
+def _open(directory, store, snapshot_wal_records=1000):
+    persistence = InMemoryPersistence(str(directory), snapshot_interval=3600,
+                                      snapshot_wal_records=snapshot_wal_records)
+    persistence.load(store.put, store.delete, store.items)
+    return persistence
+
+
+def _write(persistence, store, technical_id, entity, model="m"):
+    store.put(technical_id, entity, model)
+    persistence.log_put(technical_id, entity, model)
+
+
+def _rotated(directory):
+    return glob.glob(os.path.join(str(directory), "wal.log.*"))
+
+
+def test_replay_restores_log_without_snapshot(tmp_path):
+    store = _Store()
+    persistence = _open(tmp_path, store)
+    _write(persistence, store, "a", {"x": 1})
+    _write(persistence, store, "b", {"x": 2})
+    store.delete("a", "m")
+    persistence.log_delete("a", "m")
+
+    restored = _Store()
+    _open(tmp_path, restored)
+    assert restored.entities == {("m", "b"): {"x": 2}}
+
+
+def test_crash_mid_snapshot_keeps_rotated_log_and_next_snapshot_folds_it(tmp_path, monkeypatch):
+    store = _Store()
+    persistence = _open(tmp_path, store, snapshot_wal_records=3)
+    _write(persistence, store, "a", {"x": 1})
+    _write(persistence, store, "b", {"x": 2})
+
+    def crash(self, items, seq):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(InMemoryPersistence, "_write_snapshot", crash)
+        # The third record reaches the threshold, the snapshot (synchronous without a loop) fails after rotating
+        _write(persistence, store, "c", {"x": 3})
+    assert [os.path.basename(path) for path in _rotated(tmp_path)] == ["wal.log.3"]
+    _write(persistence, store, "a", {"x": 10})
+
+    # A crash now: the rotated log is replayed before the current one
+    restored = _Store()
+    _open(tmp_path, restored)
+    assert restored.entities == store.entities
+
+    # The next snapshot contains the rotated log's records and removes it
+    _write(persistence, store, "d", {"x": 4})
+    _write(persistence, store, "e", {"x": 5})
+    assert _rotated(tmp_path) == []
+    restored = _Store()
+    recovered = _open(tmp_path, restored)
+    assert restored.entities == store.entities
+    assert recovered.seq == persistence.seq
+
+
+def test_torn_last_record_is_skipped(tmp_path):
+    store = _Store()
+    persistence = _open(tmp_path, store)
+    _write(persistence, store, "a", {"x": 1})
+    persistence._wal.write('{"op": "put", "id": "b", "ent')
+    persistence._wal.flush()
+
+    restored = _Store()
+    _open(tmp_path, restored)
+    assert restored.entities == {("m", "a"): {"x": 1}}
+
+
+def test_background_snapshot_then_log_restore_the_store(tmp_path):
+    store = _Store()
+
+    async def run():
+        persistence = _open(tmp_path, store, snapshot_wal_records=2)
+        _write(persistence, store, "a", {"x": 1})
+        _write(persistence, store, "b", {"x": 2})
+        await asyncio.sleep(0)
+        # Logged after the snapshot was taken
+        _write(persistence, store, "a", {"x": 3})
+        await persistence.close()
+
+    asyncio.run(run())
+    assert _rotated(tmp_path) == []
+    with open(os.path.join(str(tmp_path), in_memory_persistence.SNAPSHOT_FILE)) as file:
+        assert json.loads(file.readline()) == {"seq": 2, "entities": 2}
+
+    restored = _Store()
+    _open(tmp_path, restored)
+    assert restored.entities == {("m", "a"): {"x": 3}, ("m", "b"): {"x": 2}}
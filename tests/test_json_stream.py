@@ -0,0 +1,90 @@
+"""JsonArrayDecoder must decode the same elements whatever the chunk boundaries."""
+import json
+import random
+
+import pytest
+
+from common.util.json_stream import JsonArrayDecoder
+
+ELEMENTS = [
+    {"id": 1, "name": "a, b ] c", "quote": "say \"hi\" \\\\ [x]", "nested": {"list": [1, 2.5, -3e2], "empty": {}}},
+    12345,
+    -0.25,
+    "plain",
+    True,
+    False,
+    None,
+    [],
+    [[1, [2]], {"k": "v"}],
+    {"unicode": "été ☃", "big": "x" * 5000},
+]
+
+
+def _decode(chunks):
+    decoder = JsonArrayDecoder()
+    elements = []
+    for chunk in chunks:
+        elements.extend(decoder.feed(chunk))
+    elements.extend(decoder.close())
+    return elements
+
+
+def _split(text, rng, max_size):
+    chunks, start = [], 0
+    while start < len(text):
+        size = rng.randint(1, max_size)
+        chunks.append(text[start:start + size])
+        start += size
+    return chunks
+
+
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": ")])
+def test_any_split_point_gives_the_same_elements(separators):
+    text = json.dumps(ELEMENTS[:9], separators=separators)
+    for split in range(len(text) + 1):
+        assert _decode([text[:split], text[split:]]) == ELEMENTS[:9]
+
+
+def test_random_chunk_sizes():
+    rng = random.Random(5)
+    text = json.dumps(ELEMENTS, indent=2)
+    for max_size in (1, 3, 17, 256, 4096):
+        assert _decode(_split(text, rng, max_size)) == ELEMENTS
+
+
+def test_elements_are_returned_as_soon_as_they_are_complete():
+    decoder = JsonArrayDecoder()
+    assert decoder.feed('[{"a": 1}, {"b"') == [{"a": 1}]
+    assert decoder.feed(': 2}, 4') == [{"b": 2}]
+    # 4 may continue in the next chunk
+    assert decoder.feed('2]') == [42]
+    assert decoder.close() == []
+
+
+def test_large_element_over_many_chunks_is_decoded_once_complete():
+    element = {"payload": ["y" * 100 for _ in range(200)]}
+    text = json.dumps([element, 7])
+    decoder = JsonArrayDecoder()
+    received = []
+    for start in range(0, len(text), 64):
+        received.extend(decoder.feed(text[start:start + 64]))
+    received.extend(decoder.close())
+    assert received == [element, 7]
+
+
+@pytest.mark.parametrize("text", ["[]", " [ ] ", "\n[\n]\n"])
+def test_empty_array(text):
+    assert _decode([text]) == []
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "Empty JSON response"),
+    ("[1, 2", "Truncated"),
+    ('[{"a": 1}', "Truncated"),
+    ('{"a": 1}', "Expected a JSON array"),
+    ("[1 2]", "Expected ',' or ']'"),
+    ("[1] [2]", "Unexpected data"),
+])
+def test_invalid_input(text, message):
+    with pytest.raises(ValueError, match=message):
+        _decode([text[:3], text[3:]])
@@ -0,0 +1,152 @@
+"""Outbox replay after a restart, compaction of the log and dead-lettering of rejected entities."""
+import asyncio
+import json
+
+import pytest
+
+from common.exception.exceptions import EntityRejectedException
+from common.service.outbox import FSYNC_NEVER, Outbox
+
+
+class _Repository:
+    def __init__(self, reject=(), fail_times=0, gate=None):
+        self.saved = []
+        self.reject = set(reject)
+        self.fail_times = fail_times
+        self.gate = gate
+
+    async def get_meta(self, token, entity_model, entity_version):
+        return {"token": token, "entity_model": entity_model, "entity_version": entity_version}
+
+    async def save_all(self, meta, entities):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail_times:
+            self.fail_times -= 1
+            raise ConnectionError("backend down")
+        if any(entity.get("name") in self.reject for entity in entities):
+            raise EntityRejectedException("invalid name", 400)
+        ids = []
+        for entity in entities:
+            self.saved.append(entity)
+            ids.append(f"real-{len(self.saved)}")
+        return ids
+
+
+_META = {"entity_model": "m", "entity_version": "1"}
+
+
+def _outbox(path, repository, **kwargs):
+    return Outbox(repository, str(path), FSYNC_NEVER, batch_size=kwargs.pop("batch_size", 10), **kwargs)
+
+
+def _records(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_unsaved_entities_are_replayed_after_a_restart(tmp_path):
+    path = tmp_path / "outbox.log"
+
+    async def crash_before_draining():
+        outbox = _outbox(path, _Repository(fail_times=100))
+        outbox.start("token")
+        ids = [await outbox.add(_META, {"name": name}) for name in ("a", "b")]
+        # The process dies, the drainer never got a save through
+        outbox._drainer.cancel()
+        outbox._file.close()
+        return ids
+
+    ids = asyncio.run(crash_before_draining())
+
+    async def restart():
+        repository = _Repository()
+        outbox = _outbox(path, repository)
+        outbox.start("token")
+        resolved = [await outbox.wait_resolved(provisional_id) for provisional_id in ids]
+        await outbox.stop()
+        return repository, resolved
+
+    repository, resolved = asyncio.run(restart())
+    assert repository.saved == [{"name": "a"}, {"name": "b"}]
+    assert resolved == ["real-1", "real-2"]
+
+    # Provisional ids still resolve after another restart, nothing is saved twice
+    async def reopen():
+        outbox = _outbox(path, _Repository())
+        outbox.start("token")
+        await outbox.stop()
+        return outbox
+
+    outbox = asyncio.run(reopen())
+    assert outbox.backlog == 0
+    assert [outbox.resolve(provisional_id) for provisional_id in ids] == ["real-1", "real-2"]
+
+
+def test_log_is_compacted_to_the_id_map(tmp_path):
+    path = tmp_path / "outbox.log"
+
+    async def run():
+        # Saves wait until everything is queued, so the backlog only empties with the last batch
+        gate = asyncio.Event()
+        outbox = _outbox(path, _Repository(gate=gate), batch_size=2)
+        outbox.start("token")
+        ids = [await outbox.add(_META, {"name": str(index)}) for index in range(6)]
+        gate.set()
+        for provisional_id in ids:
+            await outbox.wait_resolved(provisional_id)
+        await outbox.stop()
+        return ids
+
+    ids = asyncio.run(run())
+    records = _records(path)
+    assert all(record["op"] == "done" for record in records)
+    assert {record["id"] for record in records} == set(ids)
+
+
+def test_id_map_keeps_the_most_recent_ids(tmp_path):
+    async def run():
+        outbox = _outbox(tmp_path / "outbox.log", _Repository(), max_resolved=3)
+        outbox.start("token")
+        ids = [await outbox.add(_META, {"name": str(index)}) for index in range(5)]
+        resolved = [await outbox.wait_resolved(provisional_id) for provisional_id in ids[2:]]
+        await outbox.stop()
+        return outbox, ids, resolved
+
+    outbox, ids, resolved = asyncio.run(run())
+    assert resolved == ["real-3", "real-4", "real-5"]
+    assert outbox.resolve(ids[0]) is None
+    assert len(outbox._resolved) == 3
+
+
+def test_rejected_entity_is_dead_lettered_and_does_not_block_the_others(tmp_path):
+    path = tmp_path / "outbox.log"
+
+    async def run():
+        repository = _Repository(reject={"bad"})
+        outbox = _outbox(path, repository)
+        outbox.start("token")
+        good, bad, later = [await outbox.add(_META, {"name": name}) for name in ("good", "bad", "later")]
+        assert await outbox.wait_resolved(good) == "real-1"
+        assert await outbox.wait_resolved(later) == "real-2"
+        with pytest.raises(EntityRejectedException):
+            await outbox.wait_resolved(bad)
+        await outbox.stop()
+        return repository, bad
+
+    repository, bad = asyncio.run(run())
+    assert repository.saved == [{"name": "good"}, {"name": "later"}]
+    dead = [record for record in _records(path) if record["op"] == "dead"]
+    assert [(record["id"], record["entity"], record["status"]) for record in dead] == [(bad, {"name": "bad"}, 400)]
+
+    # Still rejected after a restart, and not replayed
+    async def reopen():
+        outbox = _outbox(path, _Repository())
+        outbox.start("token")
+        await outbox.stop()
+        return outbox
+
+    outbox = asyncio.run(reopen())
+    assert outbox.backlog == 0
+    with pytest.raises(EntityRejectedException):
+        outbox.resolve(bad)
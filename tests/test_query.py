@@ -0,0 +1,90 @@
+"""Compiled queries: plan reuse per shape, and the Cyoda condition selecting what the local predicate selects."""
+import json
+import random
+
+from common.service.query import Query, compile_query, field
+
+# Cyoda's semantics for the operators, written independently of the compiled predicate
+_CYODA_OPERATORS = {
+    "EQUALS": lambda value, expected: value == expected,
+    "NOT_EQUAL": lambda value, expected: value is not None and value != expected,
+    "GREATER_THAN": lambda value, expected: value is not None and value > expected,
+    "GREATER_OR_EQUAL": lambda value, expected: value is not None and value >= expected,
+    "LESS_THAN": lambda value, expected: value is not None and value < expected,
+    "LESS_OR_EQUAL": lambda value, expected: value is not None and value <= expected,
+    "IS_NULL": lambda value, expected: value is None,
+    "NOT_NULL": lambda value, expected: value is not None,
+    "CONTAINS": lambda value, expected: isinstance(value, str) and expected in value,
+    "STARTS_WITH": lambda value, expected: isinstance(value, str) and value.startswith(expected),
+    "ENDS_WITH": lambda value, expected: isinstance(value, str) and value.endswith(expected),
+}
+
+
+def _json_path(entity, json_path):
+    value = entity
+    for key in json_path[2:].split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def _cyoda_matches(condition, entity):
+    if condition["type"] == "group":
+        results = [_cyoda_matches(nested, entity) for nested in condition["conditions"]]
+        return all(results) if condition["operator"] == "AND" else any(results)
+    return _CYODA_OPERATORS[condition["operatorType"]](_json_path(entity, condition["jsonPath"]), condition["value"])
+
+
+def _entities(count=200, seed=3):
+    rng = random.Random(seed)
+    entities = []
+    for _ in range(count):
+        entity = {"price": rng.choice([None, rng.randint(0, 30)]), "status": rng.choice(["active", "sold", None]),
+                  "name": rng.choice(["Alpha", "Beta", "Apex", "gamma"]),
+                  "details": {"stock": rng.randint(0, 5)}}
+        if rng.random() < 0.1:
+            del entity["status"]
+        entities.append(entity)
+    return entities
+
+
+QUERIES = [
+    lambda: Query().where(field("status") == "active"),
+    lambda: Query().where(field("status") != "active", field("price") > 10),
+    lambda: Query().where(field("price").between(5, 20)),
+    lambda: Query().where(field("price").between(None, 8)),
+    lambda: Query().where(field("status").isin(["active", "sold"]) | field("name").starts_with("A")),
+    lambda: Query().where(field("status") == None),  # noqa: E711, builds an IS_NULL condition
+    lambda: Query().where(field("details.stock") >= 3, field("name").contains("a") | field("name").ends_with("x")),
+    lambda: Query().where((field("price") < 10) | (field("price") > 25)),
+]
+
+
+def test_queries_of_the_same_shape_share_a_plan():
+    plan, params = compile_query(Query().where(field("price") > 10, field("status") == "active"))
+    other_plan, other_params = compile_query(Query().where(field("price") > 20, field("status") == "sold"))
+    assert plan is other_plan
+    assert params == (10, "active")
+    assert other_params == (20, "sold")
+    # A different operator, sort or number of IN values is another shape
+    assert compile_query(Query().where(field("price") >= 10, field("status") == "active"))[0] is not plan
+    assert compile_query(Query().where(field("price") > 10, field("status") == "active")
+                         .order_by("price"))[0] is not plan
+    assert compile_query(Query().where(field("status").isin(["a"])))[0] is not \
+        compile_query(Query().where(field("status").isin(["a", "b"])))[0]
+
+
+def test_cyoda_condition_and_predicate_select_the_same_entities():
+    entities = _entities()
+    for build in QUERIES:
+        plan, params = compile_query(build())
+        condition = json.loads(plan.cyoda_json(params))
+        assert condition["type"] == "group"
+        predicate = plan.predicate(params)
+        expected = [entity for entity in entities if _cyoda_matches(condition, entity)]
+        assert [entity for entity in entities if predicate(entity)] == expected
+
+
+def test_finish_sorts_missing_values_last_and_limits():
+    plan, _ = compile_query(Query().order_by("price", descending=True))
+    entities = [{"price": 1}, {"price": None}, {"price": 5}, {}, {"price": 3}]
+    assert plan.finish(entities, 3) == [{"price": 5}, {"price": 3}, {"price": 1}]
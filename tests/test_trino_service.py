@@ -0,0 +1,49 @@
+"""SQL normalisation and the paging of stream_sql_query."""
+import asyncio
+
+import pytest
+
+from common.service import trino_service
+from common.service.trino_service import normalize_sql, stream_sql_query
+
+
+def test_normalize_sql_keeps_quoted_text():
+    query = "SELECT  \"a  b\",\n 'it''s  x'  FROM t ;"
+    assert normalize_sql(query) == "SELECT \"a  b\", 'it''s  x' FROM t"
+
+
+def _stream(query, pages):
+    sent = []
+
+    async def run_sql_query(token, sql, use_cache=True):
+        sent.append(sql)
+        return pages[len(sent) - 1]
+
+    async def collect():
+        return [row async for row in stream_sql_query("token", query, page_size=2)]
+
+    original = trino_service.run_sql_query
+    trino_service.run_sql_query = run_sql_query
+    try:
+        return asyncio.run(collect()), sent
+    finally:
+        trino_service.run_sql_query = original
+
+
+def test_pages_are_appended_to_the_query():
+    rows, sent = _stream('SELECT "limit" FROM t ORDER BY "offset"', [[1, 2], [3]])
+    assert rows == [1, 2, 3]
+    assert sent == ['SELECT "limit" FROM t ORDER BY "offset" OFFSET 0 LIMIT 2',
+                    'SELECT "limit" FROM t ORDER BY "offset" OFFSET 2 LIMIT 2']
+
+
+@pytest.mark.parametrize("query", ["SELECT a FROM t WHERE b = 'limit 1'", "SELECT * FROM (SELECT a FROM t LIMIT 3) s"])
+def test_paging_words_in_literals_or_subqueries_are_accepted(query):
+    assert _stream(query, [[]])[0] == []
+
+
+@pytest.mark.parametrize("query", ["SELECT a FROM t LIMIT 5", "SELECT a FROM t OFFSET 1",
+                                   "SELECT a FROM t FETCH FIRST 3 ROWS ONLY"])
+def test_query_with_its_own_paging_is_rejected(query):
+    with pytest.raises(ValueError):
+        _stream(query, [[]])